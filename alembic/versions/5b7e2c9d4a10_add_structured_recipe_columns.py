@@ -0,0 +1,44 @@
+"""add structured recipe columns
+
+Revision ID: 5b7e2c9d4a10
+Revises: 027abed83f89
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b7e2c9d4a10'
+down_revision: Union[str, None] = '027abed83f89'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+NUTRITION_COLUMNS = [
+    'calories_100g', 'protein_100g', 'fat_100g', 'carbs_100g',
+    'calories_portion', 'protein_portion', 'fat_portion', 'carbs_portion',
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('recipe_history') as batch_op:
+        batch_op.add_column(sa.Column('title', sa.String(), nullable=True))
+        batch_op.add_column(sa.Column('difficulty', sa.String(), nullable=True))
+        batch_op.add_column(sa.Column('recipe_ingredients', postgresql.JSONB(astext_type=sa.Text()), nullable=True))
+        for name in NUTRITION_COLUMNS:
+            batch_op.add_column(sa.Column(name, sa.Numeric(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('recipe_history') as batch_op:
+        for name in reversed(NUTRITION_COLUMNS):
+            batch_op.drop_column(name)
+        batch_op.drop_column('recipe_ingredients')
+        batch_op.drop_column('difficulty')
+        batch_op.drop_column('title')
@@ -0,0 +1,38 @@
+"""index recipe_history by user and created_at
+
+Revision ID: 9f3a61c2b8e4
+Revises: 5b7e2c9d4a10
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9f3a61c2b8e4'
+down_revision: Union[str, None] = '5b7e2c9d4a10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        'ix_recipe_history_user_created',
+        'recipe_history',
+        ['user_id', sa.text('created_at DESC'), sa.text('id DESC')]
+    )
+    # Названия для записей, сохранённых до колонки title: список не должен читать текст рецепта
+    op.execute(
+        "UPDATE recipe_history "
+        "SET title = left(regexp_replace(split_part(recipe, E'\\n', 1), '^📌\\s*', ''), 80) "
+        "WHERE title IS NULL"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_recipe_history_user_created', table_name='recipe_history')
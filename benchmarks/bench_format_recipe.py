@@ -0,0 +1,214 @@
+# Микробенчмарк format_recipe: однопроходный парсер против прежней реализации.
+# Заодно проверяет, что вывод совпадает байт в байт на корпусе рецептов.
+#
+# Запуск:
+#   python benchmarks/bench_format_recipe.py                # встроенные примеры
+#   python benchmarks/bench_format_recipe.py --db           # + RecipeHistory.recipe из DATABASE_URL
+#   python benchmarks/bench_format_recipe.py --dir corpus/  # + *.txt из каталога
+import os
+import re
+import sys
+import glob
+import timeit
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from generate_recipe import format_recipe
+
+SAMPLES = [
+    '📌 Картофельные драники\n\n⚡️ Сложность: Легкий\n\n📝 Ингредиенты:\n– картофель 4 шт\n– яйцо 1 шт\n– лук 1 шт\n\n🔪 Подготовка ингредиентов:\n– Очистить картофель и лук.\n– Натереть на тёрке.\n\n🥣 Шаги приготовления:\n1. Смешать картофель, лук и яйцо.\n2. Посолить и поперчить.\n3. Жарить на сковороде до золотистой корочки.\n\n💡 Советы от шефа:\n– Подавайте со сметаной 🍽️\n– Отожмите лишнюю жидкость.\n\n🍽 КБЖУ (приблизительно):\nНа 100 г: 150 ккал, 4 г белков, 6 г жиров, 20 г углеводов\nНа порцию (300 г): 450 ккал, 12 г белков, 18 г жиров, 60 г углеводов\n\n👨\u200d🍳 Приятного аппетита от вашего шефа!',
+    '**Омлет с сыром**\nСложность: Средний\n**Ингредиенты:**\n* яйца — 3 шт\n* сыр 50 г\nПодготовка:\n* натереть сыр\nИнструкции:\n1. Взбить яйца\n2. Добавить сыр\nСоветы:\n• не пережарьте\nКБЖУ: На 100 г: 200 ккал, 12 г белков',
+    'Просто текст без структуры',
+    '',
+    'Салат\nИнгредиенты\nогурец\nпомидор\nКБЖУ - на 2 порции 300 ккал, 5 г белков, 10 г жиров, 40 г углеводов',
+    '📌 Суп\nШаги приготовления:\n1. Варить\nСоветы от шефа:\nИнгредиенты: морковь\nПодготовка: нарезать\nКБЖУ',
+    'Ингредиенты на столе\nСложность:сложный\nСоветы: \n1. ...\n- пусто\nПодготовка',
+]
+
+
+# Прежняя реализация (до однопроходного парсера) — эталон для сравнения
+def legacy_format_recipe(text: str) -> str:
+    # Удаляем markdown и лишние символы
+    text = re.sub(r'\*\*([^*]+)\*\*', r'\1', text)
+    text = text.replace('**', '').replace('*', '')
+    text = text.replace('•', '-')
+    text = text.replace('—', '-')
+    text = text.replace('__', '')
+
+    # Функция для очистки строки от emoji и заголовков
+    def clean_line(line, block_emoji, block_title):
+        # Удаляем emoji и заголовок в начале строки
+        pattern = rf'^{re.escape(block_emoji)}\s*{re.escape(block_title)}:?\s*'
+        return re.sub(pattern, '', line, flags=re.IGNORECASE).strip()
+
+    # Парсим блоки по ключевым словам
+    blocks = {
+        'title': '',
+        'difficulty': '',
+        'ingredients': '',
+        'prep': '',
+        'steps': '',
+        'tips': '',
+        'kbju': ''
+    }
+    lines = [l.strip() for l in text.strip().split('\n') if l.strip()]
+    # 1. Название (первая строка)
+    if lines:
+        blocks['title'] = re.sub(r'^📌\s*', '', lines[0]).strip()
+    # 2. Сложность
+    diff_match = next((l for l in lines if re.match(r'(?i)^Сложность[:\s]', l)), None)
+    if diff_match:
+        blocks['difficulty'] = re.sub(r'(?i)^Сложность[:\s]*', '', diff_match).strip()
+    if not blocks['difficulty']:
+        blocks['difficulty'] = 'Средний'
+    # 3. Ингредиенты
+    ing_start = next((i for i, l in enumerate(lines) if re.search(r'(?i)ингредиенты', l)), None)
+    prep_start = next((i for i, l in enumerate(lines) if re.search(r'(?i)подготовка', l)), None)
+    steps_start = next((i for i, l in enumerate(lines) if re.search(r'(?i)шаги|инструкции', l)), None)
+    tips_start = next((i for i, l in enumerate(lines) if re.search(r'(?i)советы', l)), None)
+    kbju_start = next((i for i, l in enumerate(lines) if re.search(r'(?i)кбжу', l)), None)
+
+    # Ингредиенты
+    if ing_start is not None:
+        end = prep_start or steps_start or tips_start or kbju_start or len(lines)
+        block_lines = lines[ing_start+1:end]
+        # Очищаем каждую строку от emoji/заголовка
+        block_lines = [clean_line(l, '📝', 'Ингредиенты') for l in block_lines if l]
+        ings = [re.sub(r'^[-–\d.\s]*', '', i) for i in block_lines]
+        blocks['ingredients'] = '\n'.join(f'– {i}' for i in ings if i)
+    # Подготовка
+    if prep_start is not None:
+        end = steps_start or tips_start or kbju_start or len(lines)
+        block_lines = lines[prep_start+1:end]
+        block_lines = [clean_line(l, '🔪', 'Подготовка ингредиентов') for l in block_lines if l]
+        preps = [re.sub(r'^[-–\d.\s]*', '', i) for i in block_lines]
+        blocks['prep'] = '\n'.join(f'– {i}' for i in preps if i)
+    # Шаги
+    if steps_start is not None:
+        end = tips_start or kbju_start or len(lines)
+        block_lines = lines[steps_start+1:end]
+        block_lines = [clean_line(l, '🥣', 'Шаги приготовления') for l in block_lines if l]
+        steps = [re.sub(r'^[-–\d.\s]*', '', s) for s in block_lines]
+        blocks['steps'] = '\n'.join(f'{idx+1}. {s}' for idx, s in enumerate(steps) if s)
+    # Советы
+    if tips_start is not None:
+        end = kbju_start or len(lines)
+        block_lines = lines[tips_start+1:end]
+        block_lines = [clean_line(l, '💡', 'Советы от шефа') for l in block_lines if l]
+        tips = [re.sub(r'^[-–\d.\s]*', '', t) for t in block_lines]
+        blocks['tips'] = '\n'.join(f'– {t}' for t in tips if t)
+    # КБЖУ
+    if kbju_start is not None:
+        end = len(lines)
+        kbju_lines = lines[kbju_start:end]
+        kbju_text = '\n'.join(kbju_lines)
+        kbju_text = re.sub(r'(?i)кбжу[:\s-]*', '', kbju_text)
+        kbju_text = re.sub(r'\n+', '\n', kbju_text)
+        blocks['kbju'] = kbju_text.strip()
+
+    # Форматирование КБЖУ по шаблону
+    def format_kbju_block(kbju_raw):
+        kbju_100g = {'cal': '', 'prot': '', 'fat': '', 'carb': ''}
+        kbju_portion = {'cal': '', 'prot': '', 'fat': '', 'carb': ''}
+        m_100g = re.search(r'([Нн]а 100 ?г[^\n]*)', kbju_raw)
+        if m_100g:
+            s = m_100g.group(1)
+            kbju_100g['cal'] = re.search(r'(\d+\s*ккал)', s) and re.search(r'(\d+\s*ккал)', s).group(1) or ''
+            kbju_100g['prot'] = re.search(r'(\d+\s*г\s*белк)', s) and re.search(r'(\d+\s*г\s*белк)', s).group(1) or ''
+            kbju_100g['fat'] = re.search(r'(\d+\s*г\s*жир)', s) and re.search(r'(\d+\s*г\s*жир)', s).group(1) or ''
+            kbju_100g['carb'] = re.search(r'(\d+\s*г\s*углевод)', s) and re.search(r'(\d+\s*г\s*углевод)', s).group(1) or ''
+        m_portion = re.search(r'([Нн]а [1-9][0-9]* ?порц[^\n]*)', kbju_raw)
+        if m_portion:
+            s = m_portion.group(1)
+            kbju_portion['cal'] = re.search(r'(\d+\s*ккал)', s) and re.search(r'(\d+\s*ккал)', s).group(1) or ''
+            kbju_portion['prot'] = re.search(r'(\d+\s*г\s*белк)', s) and re.search(r'(\d+\s*г\s*белк)', s).group(1) or ''
+            kbju_portion['fat'] = re.search(r'(\d+\s*г\s*жир)', s) and re.search(r'(\d+\s*г\s*жир)', s).group(1) or ''
+            kbju_portion['carb'] = re.search(r'(\d+\s*г\s*углевод)', s) and re.search(r'(\d+\s*г\s*углевод)', s).group(1) or ''
+        if not any(kbju_100g.values()) and not any(kbju_portion.values()):
+            return '~250 ккал, ~12 г белков, ~8 г жиров, ~20 г углеводов'
+        result = 'На 100 г:'
+        if any(kbju_100g.values()):
+            if kbju_100g['cal']:
+                result += f'\n - {kbju_100g["cal"]}'
+            if kbju_100g['prot']:
+                result += f'\n - {kbju_100g["prot"]}'
+            if kbju_100g['fat']:
+                result += f'\n - {kbju_100g["fat"]}'
+            if kbju_100g['carb']:
+                result += f'\n - {kbju_100g["carb"]}'
+        else:
+            result += '\n~250 ккал, ~12 г белков, ~8 г жиров, ~20 г углеводов'
+        result += '\nНа порцию (300 г):'
+        if any(kbju_portion.values()):
+            if kbju_portion['cal']:
+                result += f'\n - {kbju_portion["cal"]}'
+            if kbju_portion['prot']:
+                result += f'\n - {kbju_portion["prot"]}'
+            if kbju_portion['fat']:
+                result += f'\n - {kbju_portion["fat"]}'
+            if kbju_portion['carb']:
+                result += f'\n - {kbju_portion["carb"]}'
+        else:
+            result += '\n~750 ккал, ~36 г белков, ~24 г жиров, ~60 г углеводов'
+        return result
+
+    # Итоговая сборка по шаблону
+    result = ''
+    result += f'📌 {blocks["title"]}\n\n' if blocks['title'] else ''
+    result += f'⚡️ Сложность: {blocks["difficulty"]}\n\n'
+    result += f'📝 Ингредиенты:\n{blocks["ingredients"]}\n\n'
+    result += f'🔪 Подготовка ингредиентов:\n{blocks["prep"]}\n\n'
+    result += f'🥣 Шаги приготовления:\n{blocks["steps"]}\n\n'
+    result += f'💡 Советы от шефа:\n{blocks["tips"]}\n\n'
+    result += f'🍽 КБЖУ (приблизительно):\n{format_kbju_block(blocks["kbju"])}\n\n'
+    result += '👨‍🍳 Приятного аппетита от вашего шефа!'
+    result = re.sub(r'\n{3,}', '\n\n', result)
+    return result.strip()
+
+
+def load_db_samples(limit):
+    from sqlalchemy import create_engine, text
+    from dotenv import load_dotenv
+    load_dotenv()
+    url = os.getenv('DATABASE_URL', '')
+    if url.startswith('postgresql+asyncpg'):
+        url = url.replace('postgresql+asyncpg', 'postgresql+psycopg2')
+    engine = create_engine(url)
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT recipe FROM recipe_history ORDER BY id DESC LIMIT :limit"), {"limit": limit})
+        return [r[0] for r in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", action="store_true", help="добавить рецепты из recipe_history")
+    parser.add_argument("--db-limit", type=int, default=1000)
+    parser.add_argument("--dir", help="каталог с примерами *.txt")
+    parser.add_argument("-n", type=int, default=200, help="повторов корпуса")
+    args = parser.parse_args()
+
+    corpus = list(SAMPLES)
+    if args.db:
+        corpus += load_db_samples(args.db_limit)
+    if args.dir:
+        for path in sorted(glob.glob(os.path.join(args.dir, "*.txt"))):
+            with open(path, encoding="utf-8") as f:
+                corpus.append(f.read())
+
+    mismatches = [i for i, s in enumerate(corpus) if format_recipe(s) != legacy_format_recipe(s)]
+    if mismatches:
+        print(f"ВЫВОД РАЗЛИЧАЕТСЯ на примерах: {mismatches}")
+        sys.exit(1)
+    print(f"Вывод идентичен на {len(corpus)} примерах")
+
+    legacy = timeit.timeit(lambda: [legacy_format_recipe(s) for s in corpus], number=args.n)
+    current = timeit.timeit(lambda: [format_recipe(s) for s in corpus], number=args.n)
+    calls = len(corpus) * args.n
+    print(f"legacy:  {legacy / calls * 1e6:8.1f} µs/рецепт")
+    print(f"current: {current / calls * 1e6:8.1f} µs/рецепт")
+    print(f"ускорение: x{legacy / current:.2f}")
+
+
+if __name__ == "__main__":
+    main()
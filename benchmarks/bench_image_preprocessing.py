@@ -0,0 +1,110 @@
+# Бенчмарк подготовки фото для Vision: прежний путь (самый большой PhotoSize как есть)
+# против выбора размера по VISION_TARGET_SIDE и локального пересжатия.
+# Считает байты, которые не нужно скачивать и отправлять в Gemini, время подготовки
+# и оценку сэкономленного на передаче времени при заданной пропускной способности.
+#
+# Запуск:
+#   python benchmarks/bench_image_preprocessing.py                 # синтетические фото
+#   python benchmarks/bench_image_preprocessing.py --dir photos/   # + *.jpg из каталога
+#   python benchmarks/bench_image_preprocessing.py --mbps 20 --target 768
+import io
+import os
+import sys
+import glob
+import time
+import random
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from PIL import Image, ImageDraw, ImageFilter
+from image_preprocessing import ImagePreprocessor, choose_photo_size, VISION_TARGET_SIDE, VISION_MAX_BYTES
+
+# Большие стороны, которые Telegram обычно отдаёт в message.photo
+TELEGRAM_SIDES = [90, 320, 800, 1280, 2560]
+
+
+def synthetic_photo(width, height, seed):
+    """Похожая на фото картинка: градиент, пятна и шум — сжимается JPEG примерно как снимок продуктов."""
+    rnd = random.Random(seed)
+    img = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    draw = ImageDraw.Draw(img)
+    for _ in range(40):
+        x, y = rnd.randrange(width), rnd.randrange(height)
+        r = rnd.randrange(width // 20, width // 5)
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=tuple(rnd.randrange(256) for _ in range(3)))
+    img = img.filter(ImageFilter.GaussianBlur(2))
+    noise = Image.effect_noise((width, height), 40).convert('RGB')
+    return Image.blend(img, noise, 0.15)
+
+
+def encode(img, quality=90):
+    out = io.BytesIO()
+    img.save(out, format='JPEG', quality=quality)
+    return out.getvalue()
+
+
+def telegram_sizes(original):
+    """Набор PhotoSize как в апдейте Telegram плюс байты каждого размера."""
+    sizes, blobs = [], {}
+    for side in TELEGRAM_SIDES:
+        if side > max(original.size):
+            break
+        img = original.copy()
+        img.thumbnail((side, side))
+        data = encode(img, quality=87)
+        fuid = f"u{side}"
+        sizes.append({'file_id': f"f{side}", 'file_unique_id': fuid, 'width': img.width, 'height': img.height, 'file_size': len(data)})
+        blobs[fuid] = data
+    return sizes, blobs
+
+
+def samples(directory):
+    for seed, (w, h) in enumerate([(4032, 3024), (3024, 4032), (2560, 1920), (1600, 1200), (1280, 960)]):
+        yield f"synthetic {w}x{h}", synthetic_photo(w, h, seed)
+    if directory:
+        for path in sorted(glob.glob(os.path.join(directory, '*.jp*g'))):
+            with Image.open(path) as img:
+                yield os.path.basename(path), img.convert('RGB')
+
+
+async def run(directory, target, max_bytes, mbps):
+    preprocessor = ImagePreprocessor(enabled=True, target=target, max_bytes=max_bytes)
+    rows = []
+    for name, original in samples(directory):
+        sizes, blobs = telegram_sizes(original)
+        # Прежний путь: самый большой размер, отправляется как есть
+        old = blobs[sizes[-1]['file_unique_id']]
+        chosen = choose_photo_size(sizes, target)
+        downloaded = blobs[chosen['file_unique_id']]
+        started = time.perf_counter()
+        new = await preprocessor.prepare(downloaded)
+        prepare_ms = (time.perf_counter() - started) * 1000
+        rows.append((name, len(old), len(downloaded), len(new), f"{chosen['width']}x{chosen['height']}", prepare_ms))
+
+    # Байты идут дважды: скачивание из Telegram и отправка в Gemini
+    transfer_ms = lambda n: 2 * n * 8 / (mbps * 1e6) * 1000
+    print(f"target={target}px  max_bytes={max_bytes}  link={mbps} Mbit/s")
+    print(f"{'photo':<26}{'old KB':>9}{'chosen':>11}{'new KB':>9}{'prep ms':>9}{'saved ms':>10}")
+    saved = []
+    for name, old, downloaded, new, chosen, prepare_ms in rows:
+        saved_ms = transfer_ms(old) - transfer_ms(new) - prepare_ms
+        saved.append(saved_ms)
+        print(f"{name:<26}{old / 1024:9.1f}{chosen:>11}{new / 1024:9.1f}{prepare_ms:9.1f}{saved_ms:10.1f}")
+    total_old = sum(r[1] for r in rows)
+    total_new = sum(r[3] for r in rows)
+    print(f"bytes saved: {(total_old - total_new) / 1024:.1f} KB ({100 * (1 - total_new / total_old):.0f}%), "
+          f"median time saved per photo: {statistics.median(saved):.1f} ms")
+    print(preprocessor.metrics())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dir', help='каталог с реальными фото (*.jpg)')
+    parser.add_argument('--target', type=int, default=VISION_TARGET_SIDE)
+    parser.add_argument('--max-bytes', type=int, default=VISION_MAX_BYTES)
+    parser.add_argument('--mbps', type=float, default=50, help='пропускная способность канала, Мбит/с')
+    args = parser.parse_args()
+    asyncio.run(run(args.dir, args.target, args.max_bytes, args.mbps))
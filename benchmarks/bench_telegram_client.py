@@ -0,0 +1,58 @@
+# Бенчмарк: задержка вызова Bot API с новым httpx.AsyncClient на каждый запрос
+# против общего пула соединений telegram_client.
+#
+# Запуск:  python benchmarks/bench_telegram_client.py [-n 50] [--method getMe]
+# Для офлайн-замера укажите TELEGRAM_API_URL на локальный фейковый сервер.
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import httpx
+from telegram_client import telegram_client, TELEGRAM_API
+
+
+def summary(name, samples):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(f"{name:<22} mean={statistics.mean(samples):7.1f} ms  p50={statistics.median(samples):7.1f} ms  p95={p95:7.1f} ms")
+
+
+async def fresh_client_call(method):
+    async with httpx.AsyncClient() as client:
+        await client.post(f"{TELEGRAM_API}/{method}", json={})
+
+
+async def run(n, method):
+    fresh = []
+    for _ in range(n):
+        started = time.perf_counter()
+        await fresh_client_call(method)
+        fresh.append((time.perf_counter() - started) * 1000)
+
+    await telegram_client.start()
+    # Первый запрос открывает соединение — его в статистику не включаем
+    await telegram_client.post(method)
+    pooled = []
+    for _ in range(n):
+        started = time.perf_counter()
+        await telegram_client.post(method)
+        pooled.append((time.perf_counter() - started) * 1000)
+    await telegram_client.close()
+
+    print(f"{n} x {method}")
+    summary("new client per call", fresh)
+    summary("shared pooled client", pooled)
+    print(f"saved per call (p50): {statistics.median(fresh) - statistics.median(pooled):.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=50)
+    parser.add_argument("--method", default="getMe")
+    args = parser.parse_args()
+    asyncio.run(run(args.n, args.method))
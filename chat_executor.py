@@ -0,0 +1,146 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+from session_store import session_store
+from redis_scripts import script_registry
+
+load_dotenv()
+
+# local — очередь на чат внутри процесса; redis — плюс lease-лок в Redis для нескольких процессов; off — без сериализации
+CHAT_SERIALIZATION = os.getenv('CHAT_SERIALIZATION', 'local')
+CHAT_LOCK_TTL_MS = int(os.getenv('CHAT_LOCK_TTL_MS', 30000))
+CHAT_LOCK_WAIT = float(os.getenv('CHAT_LOCK_WAIT', 120))
+
+RELEASE_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+RENEW_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_LOCK = script_registry.register('chat_lock_release', RELEASE_LOCK_LUA)
+RENEW_LOCK = script_registry.register('chat_lock_renew', RENEW_LOCK_LUA)
+
+logger = logging.getLogger(__name__)
+
+
+def chat_id_of(update: dict):
+    """Достаёт chat_id из апдейта Telegram (None, если апдейт не привязан к чату)."""
+    for kind in ('message', 'edited_message'):
+        if update.get(kind):
+            return (update[kind].get('chat') or {}).get('id')
+    callback = update.get('callback_query')
+    if callback and callback.get('message'):
+        return callback['message']['chat']['id']
+    return None
+
+
+@asynccontextmanager
+async def chat_lock(chat_id):
+    """Lease-лок на чат в Redis: продлевается, пока держатель жив, и истекает, если он упал."""
+    await session_store.connect()
+    redis = session_store.redis
+    key = f"chat_lock:{chat_id}"
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + CHAT_LOCK_WAIT
+    delay = 0.01
+    while not await redis.set(key, token, nx=True, px=CHAT_LOCK_TTL_MS):
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"chat lock {key} not acquired in {CHAT_LOCK_WAIT} s")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 0.2)
+
+    async def renew():
+        while True:
+            await asyncio.sleep(CHAT_LOCK_TTL_MS / 3000)
+            if not await script_registry.run(RENEW_LOCK, [key], [token, CHAT_LOCK_TTL_MS]):
+                logger.warning(f"[CHAT] Лок {key} потерян")
+                return
+
+    renewer = asyncio.create_task(renew())
+    try:
+        yield
+    finally:
+        renewer.cancel()
+        try:
+            await script_registry.run(RELEASE_LOCK, [key], [token])
+        except Exception as e:
+            logger.error(f"Redis chat lock release error: {e}")
+
+
+class ChatExecutor:
+    """Почтовый ящик на каждый чат: апдейты одного чата выполняются строго по очереди,
+    разные чаты — параллельно."""
+
+    def __init__(self, mode: str = CHAT_SERIALIZATION):
+        self.mode = mode
+        self._mailboxes = {}
+        # Ссылки на задачи разбора очередей: event loop держит задачи только слабо
+        self._drains = set()
+        self.stats = Counter()
+
+    async def run(self, chat_id, job):
+        """Выполняет job() в очереди чата и возвращает его результат."""
+        if chat_id is None or self.mode == 'off':
+            return await job()
+        future = asyncio.get_running_loop().create_future()
+        mailbox = self._mailboxes.get(chat_id)
+        if mailbox is None:
+            mailbox = self._mailboxes[chat_id] = deque([(job, future)])
+            task = asyncio.create_task(self._drain(chat_id, mailbox))
+            self._drains.add(task)
+            task.add_done_callback(self._drains.discard)
+        else:
+            mailbox.append((job, future))
+            self.stats['queued_behind'] += 1
+        return await future
+
+    async def _execute(self, chat_id, job):
+        if self.mode == 'redis':
+            async with chat_lock(chat_id):
+                return await job()
+        return await job()
+
+    async def _drain(self, chat_id, mailbox: deque):
+        try:
+            while mailbox:
+                job, future = mailbox[0]
+                try:
+                    result = await self._execute(chat_id, job)
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+                mailbox.popleft()
+                self.stats['executed'] += 1
+        finally:
+            if self._mailboxes.get(chat_id) is mailbox:
+                del self._mailboxes[chat_id]
+            for _, future in mailbox:
+                if not future.done():
+                    future.cancel()
+
+    def metrics(self) -> dict:
+        return {
+            'mode': self.mode,
+            'active_chats': len(self._mailboxes),
+            'queued': sum(len(m) for m in self._mailboxes.values()),
+            **self.stats,
+        }
+
+
+chat_executor = ChatExecutor()
@@ -0,0 +1,81 @@
+import os
+import time
+import logging
+from collections import Counter, OrderedDict
+from typing import Optional
+from dotenv import load_dotenv
+from session_store import session_store
+
+load_dotenv()
+
+# Telegram гарантирует, что ссылка из getFile действует не меньше часа; берём с запасом
+FILE_PATH_CACHE_TTL = int(os.getenv('FILE_PATH_CACHE_TTL', 3300))
+FILE_PATH_CACHE_LOCAL_SIZE = int(os.getenv('FILE_PATH_CACHE_LOCAL_SIZE', 10000))
+
+logger = logging.getLogger(__name__)
+
+
+class FilePathCache:
+    """file_id → file_path из getFile на время действия ссылки: LRU в процессе + Redis."""
+
+    def __init__(self, max_size: int = FILE_PATH_CACHE_LOCAL_SIZE, ttl: int = FILE_PATH_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.local = OrderedDict()
+        self.stats = Counter()
+
+    def _local_set(self, file_id: str, file_path: str, expires_at: float):
+        self.local[file_id] = (expires_at, file_path)
+        self.local.move_to_end(file_id)
+        while len(self.local) > self.max_size:
+            self.local.popitem(last=False)
+
+    async def get(self, file_id: str) -> Optional[str]:
+        entry = self.local.get(file_id)
+        if entry is not None:
+            expires_at, file_path = entry
+            if expires_at >= time.monotonic():
+                self.local.move_to_end(file_id)
+                self.stats['local_hits'] += 1
+                return file_path
+            del self.local[file_id]
+        try:
+            await session_store.connect()
+            async with session_store.redis.pipeline(transaction=False) as pipe:
+                pipe.get(f"file_path:{file_id}")
+                pipe.pttl(f"file_path:{file_id}")
+                file_path, pttl = await pipe.execute()
+        except Exception as e:
+            logger.error(f"Redis file path cache get error: {e}")
+            file_path = None
+        if file_path:
+            # Локальная копия живёт не дольше, чем ссылка в Redis
+            self._local_set(file_id, file_path, time.monotonic() + max(pttl, 0) / 1000)
+            self.stats['redis_hits'] += 1
+            return file_path
+        self.stats['misses'] += 1
+        return None
+
+    async def set(self, file_id: str, file_path: str):
+        self._local_set(file_id, file_path, time.monotonic() + self.ttl)
+        try:
+            await session_store.connect()
+            await session_store.redis.set(f"file_path:{file_id}", file_path, ex=self.ttl)
+        except Exception as e:
+            logger.error(f"Redis file path cache set error: {e}")
+
+    async def invalidate(self, file_id: str):
+        """Ссылка перестала работать раньше срока — следующий запрос снова пойдёт в getFile."""
+        self.local.pop(file_id, None)
+        self.stats['invalidated'] += 1
+        try:
+            await session_store.connect()
+            await session_store.redis.delete(f"file_path:{file_id}")
+        except Exception as e:
+            logger.error(f"Redis file path cache invalidate error: {e}")
+
+    def metrics(self) -> dict:
+        return {'local_size': len(self.local), **self.stats}
+
+
+file_path_cache = FilePathCache()
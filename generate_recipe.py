@@ -20,36 +20,86 @@ RECIPE_GENERATION_PROMPT = (
 import os
 
 
+import asyncio
 import logging
-import google.generativeai as genai
 from dotenv import load_dotenv
 import re
 from user_preferences_service import get_preferences
-from typing import Optional, List
+from recipe_cache import recipe_cache, make_recipe_key
+from recipe_schema import Recipe, RECIPE_RESPONSE_SCHEMA
+from llm_gateway import llm_gateway, LLMTimeout, LLMUnavailable
+from single_flight import single_flight, flight_key
+from typing import Optional, List, AsyncIterator, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
 
 load_dotenv()
 
-GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
-genai.configure(api_key=GEMINI_API_KEY)
+# 1 — просить у Gemini JSON по RECIPE_RESPONSE_SCHEMA вместо свободного текста
+RECIPE_JSON_MODE = os.getenv('RECIPE_JSON_MODE', '0') == '1'
+
+RECIPE_ERROR_TEXT = "Извините, не удалось сгенерировать рецепт. Попробуйте позже."
+RECIPE_TIMEOUT_TEXT = "⌛ Рецепт готовится слишком долго. Попробуйте ещё раз."
+RECIPE_UNAVAILABLE_TEXT = "⏳ Сервис рецептов сейчас перегружен. Попробуйте через минуту."
+
+
+def _error_text(e: Exception) -> str:
+    if isinstance(e, LLMUnavailable):
+        return RECIPE_UNAVAILABLE_TEXT
+    if isinstance(e, LLMTimeout):
+        return RECIPE_TIMEOUT_TEXT
+    return RECIPE_ERROR_TEXT
 
 logger = logging.getLogger(__name__)
 
-def format_recipe(text: str) -> str:
-    # Удаляем markdown и лишние символы
-    text = re.sub(r'\*\*([^*]+)\*\*', r'\1', text)
-    text = text.replace('**', '').replace('*', '')
-    text = text.replace('•', '-')
-    text = text.replace('—', '-')
-    text = text.replace('__', '')
-
-    # Функция для очистки строки от emoji и заголовков
-    def clean_line(line, block_emoji, block_title):
-        # Удаляем emoji и заголовок в начале строки
-        pattern = rf'^{re.escape(block_emoji)}\s*{re.escape(block_title)}:?\s*'
-        return re.sub(pattern, '', line, flags=re.IGNORECASE).strip()
-
-    # Парсим блоки по ключевым словам
+RECIPE_SECTIONS = ['ingredients', 'prep', 'steps', 'tips', 'kbju']
+
+# Заголовки разделов: ищутся в любом месте строки, берётся первое вхождение
+_SECTION_MARKERS = (
+    ('ingredients', re.compile(r'ингредиенты', re.IGNORECASE)),
+    ('prep', re.compile(r'подготовка', re.IGNORECASE)),
+    ('steps', re.compile(r'шаги|инструкции', re.IGNORECASE)),
+    ('tips', re.compile(r'советы', re.IGNORECASE)),
+    ('kbju', re.compile(r'кбжу', re.IGNORECASE)),
+)
+# Emoji и заголовок, которые модель иногда повторяет внутри блока
+_SECTION_HEADER_RE = {
+    'ingredients': re.compile(r'^📝\s*Ингредиенты:?\s*', re.IGNORECASE),
+    'prep': re.compile(r'^🔪\s*Подготовка ингредиентов:?\s*', re.IGNORECASE),
+    'steps': re.compile(r'^🥣\s*Шаги приготовления:?\s*', re.IGNORECASE),
+    'tips': re.compile(r'^💡\s*Советы от шефа:?\s*', re.IGNORECASE),
+}
+# Быстрый фильтр: строки без единого заголовка не проверяются по каждому шаблону
+_ANY_MARKER_RE = re.compile(r'ингредиенты|подготовка|шаги|инструкции|советы|кбжу', re.IGNORECASE)
+_TITLE_RE = re.compile(r'^📌\s*')
+_DIFFICULTY_RE = re.compile(r'^Сложность[:\s]', re.IGNORECASE)
+_DIFFICULTY_PREFIX_RE = re.compile(r'^Сложность[:\s]*', re.IGNORECASE)
+_ITEM_PREFIX_RE = re.compile(r'^[-–\d.\s]*')
+_KBJU_LABEL_RE = re.compile(r'кбжу[:\s-]*', re.IGNORECASE)
+_NEWLINES_RE = re.compile(r'\n+')
+_BLANK_LINES_RE = re.compile(r'\n{3,}')
+
+_KBJU_100G_RE = re.compile(r'([Нн]а 100 ?г[^\n]*)')
+_KBJU_PORTION_RE = re.compile(r'([Нн]а [1-9][0-9]* ?порц[^\n]*)')
+_KBJU_VALUE_RES = (
+    re.compile(r'(\d+\s*ккал)'),
+    re.compile(r'(\d+\s*г\s*белк)'),
+    re.compile(r'(\d+\s*г\s*жир)'),
+    re.compile(r'(\d+\s*г\s*углевод)'),
+)
+KBJU_DEFAULT_100G = '~250 ккал, ~12 г белков, ~8 г жиров, ~20 г углеводов'
+KBJU_DEFAULT_PORTION = '~750 ккал, ~36 г белков, ~24 г жиров, ~60 г углеводов'
+
+def _block_items(lines, start, end, name):
+    header_re = _SECTION_HEADER_RE[name]
+    # Пустые элементы остаются в списке: нумерация шагов учитывает и их
+    return [_ITEM_PREFIX_RE.sub('', header_re.sub('', line).strip()) for line in lines[start + 1:end]]
+
+def _parse_recipe_blocks(text: str):
+    """Разбирает ответ модели на блоки. Возвращает (blocks, complete), где complete —
+    блоки, за которыми уже начался следующий раздел (нужно для потоковых превью)."""
+    # Удаляем markdown и лишние символы (**жирный** и *курсив* сводятся к удалению всех звёздочек)
+    text = text.replace('*', '').replace('•', '-').replace('—', '-').replace('__', '')
+
     blocks = {
         'title': '',
         'difficulty': '',
@@ -59,139 +109,173 @@ def format_recipe(text: str) -> str:
         'tips': '',
         'kbju': ''
     }
-    lines = [l.strip() for l in text.strip().split('\n') if l.strip()]
-    # 1. Название (первая строка)
+    complete = set()
+    # Один проход: собираем непустые строки, первую строку сложности и начало каждого раздела
+    lines = []
+    starts = dict.fromkeys(RECIPE_SECTIONS)
+    pending = list(_SECTION_MARKERS)
+    difficulty_line = None
+    for raw in text.strip().split('\n'):
+        line = raw.strip()
+        if not line:
+            continue
+        index = len(lines)
+        lines.append(line)
+        if difficulty_line is None and _DIFFICULTY_RE.match(line):
+            difficulty_line = line
+        if pending and _ANY_MARKER_RE.search(line):
+            for marker in [m for m in pending if m[1].search(line)]:
+                starts[marker[0]] = index
+                pending.remove(marker)
+
     if lines:
-        blocks['title'] = re.sub(r'^📌\s*', '', lines[0]).strip()
-    # 2. Сложность
-    diff_match = next((l for l in lines if re.match(r'(?i)^Сложность[:\s]', l)), None)
-    if diff_match:
-        blocks['difficulty'] = re.sub(r'(?i)^Сложность[:\s]*', '', diff_match).strip()
+        blocks['title'] = _TITLE_RE.sub('', lines[0]).strip()
+    if difficulty_line:
+        blocks['difficulty'] = _DIFFICULTY_PREFIX_RE.sub('', difficulty_line).strip()
     if not blocks['difficulty']:
         blocks['difficulty'] = 'Средний'
-    # 3. Ингредиенты
-    ing_start = next((i for i, l in enumerate(lines) if re.search(r'(?i)ингредиенты', l)), None)
-    prep_start = next((i for i, l in enumerate(lines) if re.search(r'(?i)подготовка', l)), None)
-    steps_start = next((i for i, l in enumerate(lines) if re.search(r'(?i)шаги|инструкции', l)), None)
-    tips_start = next((i for i, l in enumerate(lines) if re.search(r'(?i)советы', l)), None)
-    kbju_start = next((i for i, l in enumerate(lines) if re.search(r'(?i)кбжу', l)), None)
-
-    # Ингредиенты
+
+    # Конец раздела — начало ближайшего следующего (индекс 0 считается «нет», как и раньше)
+    ing_start, prep_start, steps_start, tips_start, kbju_start = (starts[name] for name in RECIPE_SECTIONS)
+    total = len(lines)
     if ing_start is not None:
-        end = prep_start or steps_start or tips_start or kbju_start or len(lines)
-        block_lines = lines[ing_start+1:end]
-        # Очищаем каждую строку от emoji/заголовка
-        block_lines = [clean_line(l, '📝', 'Ингредиенты') for l in block_lines if l]
-        ings = [re.sub(r'^[-–\d.\s]*', '', i) for i in block_lines]
-        blocks['ingredients'] = '\n'.join(f'– {i}' for i in ings if i)
-    # Подготовка
+        end = prep_start or steps_start or tips_start or kbju_start or total
+        if end != total:
+            complete.add('ingredients')
+        blocks['ingredients'] = '\n'.join(f'– {i}' for i in _block_items(lines, ing_start, end, 'ingredients') if i)
     if prep_start is not None:
-        end = steps_start or tips_start or kbju_start or len(lines)
-        block_lines = lines[prep_start+1:end]
-        block_lines = [clean_line(l, '🔪', 'Подготовка ингредиентов') for l in block_lines if l]
-        preps = [re.sub(r'^[-–\d.\s]*', '', i) for i in block_lines]
-        blocks['prep'] = '\n'.join(f'– {i}' for i in preps if i)
-    # Шаги
+        end = steps_start or tips_start or kbju_start or total
+        if end != total:
+            complete.add('prep')
+        blocks['prep'] = '\n'.join(f'– {i}' for i in _block_items(lines, prep_start, end, 'prep') if i)
     if steps_start is not None:
-        end = tips_start or kbju_start or len(lines)
-        block_lines = lines[steps_start+1:end]
-        block_lines = [clean_line(l, '🥣', 'Шаги приготовления') for l in block_lines if l]
-        steps = [re.sub(r'^[-–\d.\s]*', '', s) for s in block_lines]
-        blocks['steps'] = '\n'.join(f'{idx+1}. {s}' for idx, s in enumerate(steps) if s)
-    # Советы
+        end = tips_start or kbju_start or total
+        if end != total:
+            complete.add('steps')
+        blocks['steps'] = '\n'.join(f'{idx+1}. {s}' for idx, s in enumerate(_block_items(lines, steps_start, end, 'steps')) if s)
     if tips_start is not None:
-        end = kbju_start or len(lines)
-        block_lines = lines[tips_start+1:end]
-        block_lines = [clean_line(l, '💡', 'Советы от шефа') for l in block_lines if l]
-        tips = [re.sub(r'^[-–\d.\s]*', '', t) for t in block_lines]
-        blocks['tips'] = '\n'.join(f'– {t}' for t in tips if t)
-    # КБЖУ
+        end = kbju_start or total
+        if end != total:
+            complete.add('tips')
+        blocks['tips'] = '\n'.join(f'– {t}' for t in _block_items(lines, tips_start, end, 'tips') if t)
     if kbju_start is not None:
-        end = len(lines)
-        kbju_lines = lines[kbju_start:end]
-        kbju_text = '\n'.join(kbju_lines)
-        kbju_text = re.sub(r'(?i)кбжу[:\s-]*', '', kbju_text)
-        kbju_text = re.sub(r'\n+', '\n', kbju_text)
-        blocks['kbju'] = kbju_text.strip()
-
-    # Форматирование КБЖУ по шаблону
-    def format_kbju_block(kbju_raw):
-        kbju_100g = {'cal': '', 'prot': '', 'fat': '', 'carb': ''}
-        kbju_portion = {'cal': '', 'prot': '', 'fat': '', 'carb': ''}
-        m_100g = re.search(r'([Нн]а 100 ?г[^\n]*)', kbju_raw)
-        if m_100g:
-            s = m_100g.group(1)
-            kbju_100g['cal'] = re.search(r'(\d+\s*ккал)', s) and re.search(r'(\d+\s*ккал)', s).group(1) or ''
-            kbju_100g['prot'] = re.search(r'(\d+\s*г\s*белк)', s) and re.search(r'(\d+\s*г\s*белк)', s).group(1) or ''
-            kbju_100g['fat'] = re.search(r'(\d+\s*г\s*жир)', s) and re.search(r'(\d+\s*г\s*жир)', s).group(1) or ''
-            kbju_100g['carb'] = re.search(r'(\d+\s*г\s*углевод)', s) and re.search(r'(\d+\s*г\s*углевод)', s).group(1) or ''
-        m_portion = re.search(r'([Нн]а [1-9][0-9]* ?порц[^\n]*)', kbju_raw)
-        if m_portion:
-            s = m_portion.group(1)
-            kbju_portion['cal'] = re.search(r'(\d+\s*ккал)', s) and re.search(r'(\d+\s*ккал)', s).group(1) or ''
-            kbju_portion['prot'] = re.search(r'(\d+\s*г\s*белк)', s) and re.search(r'(\d+\s*г\s*белк)', s).group(1) or ''
-            kbju_portion['fat'] = re.search(r'(\d+\s*г\s*жир)', s) and re.search(r'(\d+\s*г\s*жир)', s).group(1) or ''
-            kbju_portion['carb'] = re.search(r'(\d+\s*г\s*углевод)', s) and re.search(r'(\d+\s*г\s*углевод)', s).group(1) or ''
-        if not any(kbju_100g.values()) and not any(kbju_portion.values()):
-            return '~250 ккал, ~12 г белков, ~8 г жиров, ~20 г углеводов'
-        result = 'На 100 г:'
-        if any(kbju_100g.values()):
-            if kbju_100g['cal']:
-                result += f'\n - {kbju_100g["cal"]}'
-            if kbju_100g['prot']:
-                result += f'\n - {kbju_100g["prot"]}'
-            if kbju_100g['fat']:
-                result += f'\n - {kbju_100g["fat"]}'
-            if kbju_100g['carb']:
-                result += f'\n - {kbju_100g["carb"]}'
-        else:
-            result += '\n~250 ккал, ~12 г белков, ~8 г жиров, ~20 г углеводов'
-        result += '\nНа порцию (300 г):'
-        if any(kbju_portion.values()):
-            if kbju_portion['cal']:
-                result += f'\n - {kbju_portion["cal"]}'
-            if kbju_portion['prot']:
-                result += f'\n - {kbju_portion["prot"]}'
-            if kbju_portion['fat']:
-                result += f'\n - {kbju_portion["fat"]}'
-            if kbju_portion['carb']:
-                result += f'\n - {kbju_portion["carb"]}'
-        else:
-            result += '\n~750 ккал, ~36 г белков, ~24 г жиров, ~60 г углеводов'
-        return result
-
+        kbju_text = _KBJU_LABEL_RE.sub('', '\n'.join(lines[kbju_start:]))
+        blocks['kbju'] = _NEWLINES_RE.sub('\n', kbju_text).strip()
+    return blocks, complete
+
+def _kbju_values(kbju_raw, line_re):
+    match = line_re.search(kbju_raw)
+    if not match:
+        return []
+    line = match.group(1)
+    values = []
+    for value_re in _KBJU_VALUE_RES:
+        value = value_re.search(line)
+        if value:
+            values.append(value.group(1))
+    return values
+
+# Форматирование КБЖУ по шаблону
+def format_kbju_block(kbju_raw):
+    per_100g = _kbju_values(kbju_raw, _KBJU_100G_RE)
+    per_portion = _kbju_values(kbju_raw, _KBJU_PORTION_RE)
+    if not per_100g and not per_portion:
+        return KBJU_DEFAULT_100G
+    parts = ['На 100 г:']
+    if per_100g:
+        parts.extend(f'\n - {v}' for v in per_100g)
+    else:
+        parts.append('\n' + KBJU_DEFAULT_100G)
+    parts.append('\nНа порцию (300 г):')
+    if per_portion:
+        parts.extend(f'\n - {v}' for v in per_portion)
+    else:
+        parts.append('\n' + KBJU_DEFAULT_PORTION)
+    return ''.join(parts)
+
+_SECTION_TITLES = {
+    'ingredients': '📝 Ингредиенты:',
+    'prep': '🔪 Подготовка ингредиентов:',
+    'steps': '🥣 Шаги приготовления:',
+    'tips': '💡 Советы от шефа:',
+}
+
+def _render_section(name, blocks):
+    if name == 'kbju':
+        return f'🍽 КБЖУ (приблизительно):\n{format_kbju_block(blocks["kbju"])}\n\n'
+    return f'{_SECTION_TITLES[name]}\n{blocks[name]}\n\n'
+
+def _render_header(blocks):
+    title = f'📌 {blocks["title"]}\n\n' if blocks['title'] else ''
+    return f'{title}⚡️ Сложность: {blocks["difficulty"]}\n\n'
+
+def render_recipe_blocks(blocks) -> str:
     # Итоговая сборка по шаблону
-    result = ''
-    result += f'📌 {blocks["title"]}\n\n' if blocks['title'] else ''
-    result += f'⚡️ Сложность: {blocks["difficulty"]}\n\n'
-    result += f'📝 Ингредиенты:\n{blocks["ingredients"]}\n\n'
-    result += f'🔪 Подготовка ингредиентов:\n{blocks["prep"]}\n\n'
-    result += f'🥣 Шаги приготовления:\n{blocks["steps"]}\n\n'
-    result += f'💡 Советы от шефа:\n{blocks["tips"]}\n\n'
-    result += f'🍽 КБЖУ (приблизительно):\n{format_kbju_block(blocks["kbju"])}\n\n'
-    result += '👨‍🍳 Приятного аппетита от вашего шефа!'
-    result = re.sub(r'\n{3,}', '\n\n', result)
-    return result.strip()
+    parts = [_render_header(blocks)]
+    parts.extend(_render_section(name, blocks) for name in RECIPE_SECTIONS)
+    parts.append('👨‍🍳 Приятного аппетита от вашего шефа!')
+    return _BLANK_LINES_RE.sub('\n\n', ''.join(parts)).strip()
 
-async def generate_recipe(
+def format_recipe(text: str) -> str:
+    blocks, _ = _parse_recipe_blocks(text)
+    return render_recipe_blocks(blocks)
+
+def format_recipe_partial(text: str) -> str:
+    """Превью для потоковой генерации: только полностью полученные разделы."""
+    complete_text = text[:text.rfind('\n') + 1]
+    blocks, complete = _parse_recipe_blocks(complete_text)
+    if not blocks['title']:
+        return ''
+    parts = [f'📌 {blocks["title"]}\n\n']
+    for name in RECIPE_SECTIONS:
+        if name not in complete:
+            break
+        if name == 'ingredients':
+            parts = [_render_header(blocks)]
+        parts.append(_render_section(name, blocks))
+    parts.append('⏳ Пишу рецепт…')
+    return _BLANK_LINES_RE.sub('\n\n', ''.join(parts)).strip()
+
+def render_recipe(recipe: Recipe) -> str:
+    """Собирает из типизированного рецепта тот же текст, что и format_recipe."""
+    blocks = {
+        'title': recipe.title,
+        'difficulty': recipe.difficulty or 'Средний',
+        'ingredients': '\n'.join(f'– {i}' for i in recipe.ingredients),
+        'prep': '\n'.join(f'– {i}' for i in recipe.prep),
+        'steps': '\n'.join(f'{idx+1}. {s}' for idx, s in enumerate(recipe.steps)),
+        'tips': '\n'.join(f'– {t}' for t in recipe.tips),
+        'kbju': recipe.kbju_text(),
+    }
+    return render_recipe_blocks(blocks)
+
+def _prompt_extra(healthy_profile: bool, preferred_cuisine: str, temp_difficulty: Optional[str]) -> str:
+    prompt_extra = ''
+    if healthy_profile:
+        prompt_extra += (
+            'Режим здорового питания активен — выбери только полезные способы готовки и добавь краткое описание пользы блюда (в одном предложении).\n'
+        )
+    if preferred_cuisine and preferred_cuisine != 'Любая':
+        prompt_extra += (
+            f'Приготовь это блюдо в стиле {preferred_cuisine} кухни.\n'
+        )
+    if temp_difficulty:
+        if temp_difficulty.lower().startswith('проще'):
+            prompt_extra += 'Сделай рецепт простым и минималистичным. Только базовые шаги и продукты.\n'
+        elif temp_difficulty.lower().startswith('сложнее'):
+            prompt_extra += 'Сделай рецепт более изысканным. Добавь нестандартные шаги и оригинальную подачу.\n'
+    return prompt_extra
+
+def build_recipe_prompt(
     ingredients: List[str],
-    user_id: int,
-    session: AsyncSession = None,
+    healthy_profile: bool = False,
+    preferred_cuisine: str = 'Любая',
     temp_difficulty: Optional[str] = None,
     query: Optional[str] = None
 ) -> str:
-    """
-    Генерирует рецепт по списку ингредиентов или по пользовательскому запросу через Gemini Vision API с учётом настроек пользователя.
-    """
-    try:
-        prefs = None
-        if user_id and session:
-            prefs = await get_preferences(session, user_id)
-        healthy_profile = getattr(prefs, 'healthy_profile', False) if prefs else False
-        preferred_cuisine = getattr(prefs, 'preferred_cuisine', 'Любая') if prefs else 'Любая'
-
-        if query:
-            prompt = f"""
+    """Собирает промпт для Gemini по ингредиентам или запросу пользователя."""
+    if query:
+        prompt = f"""
 Ты — профессиональный кулинарный помощник SnapChef.
 
 Составь подробный, современный рецепт по запросу пользователя: \"{query}\".
@@ -235,23 +319,10 @@ async def generate_recipe(
 - {('Готовь только полезными способами, не используй жарку, минимизируй жиры, делай рецепт максимально здоровым.' if healthy_profile else '')}
 - {f'Оформи рецепт в стиле {preferred_cuisine} кухни.' if preferred_cuisine and preferred_cuisine != 'Любая' else ''}
 """
-        else:
-            prompt_extra = ''
-            if healthy_profile:
-                prompt_extra += (
-                    'Режим здорового питания активен — выбери только полезные способы готовки и добавь краткое описание пользы блюда (в одном предложении).\n'
-                )
-            if preferred_cuisine and preferred_cuisine != 'Любая':
-                prompt_extra += (
-                    f'Приготовь это блюдо в стиле {preferred_cuisine} кухни.\n'
-                )
-            if temp_difficulty:
-                if temp_difficulty.lower().startswith('проще'):
-                    prompt_extra += 'Сделай рецепт простым и минималистичным. Только базовые шаги и продукты.\n'
-                elif temp_difficulty.lower().startswith('сложнее'):
-                    prompt_extra += 'Сделай рецепт более изысканным. Добавь нестандартные шаги и оригинальную подачу.\n'
-
-            prompt = f"""
+    else:
+        prompt_extra = _prompt_extra(healthy_profile, preferred_cuisine, temp_difficulty)
+
+        prompt = f"""
 Ты — профессиональный кулинарный помощник SnapChef.
 
 🔧 ЗАДАЧА:
@@ -297,15 +368,188 @@ async def generate_recipe(
 - Всегда указывай КБЖУ (даже примерные значения, если точных нет).
 - Используй только эти ингредиенты: {ingredients}
 """
+    return prompt
+
+def build_recipe_json_prompt(
+    ingredients: List[str],
+    healthy_profile: bool = False,
+    preferred_cuisine: str = 'Любая',
+    temp_difficulty: Optional[str] = None,
+    query: Optional[str] = None
+) -> str:
+    """Промпт для RECIPE_JSON_MODE: структуру задаёт response_schema, в тексте — только содержание."""
+    if query:
+        task = f'Составь подробный, современный рецепт по запросу пользователя: "{query}".'
+    else:
+        task = (
+            f'На основе списка ингредиентов {ingredients} сгенерируй рецепт. Используй все продукты из списка. '
+            'Не добавляй ничего лишнего, кроме базовых специй (соль, перец, масло и т.п.).'
+        )
+    return f"""
+Ты — профессиональный кулинарный помощник SnapChef.
+
+{task}
+
+{_prompt_extra(healthy_profile, preferred_cuisine, temp_difficulty)}
+
+Заполни поля ответа:
+- title — название блюда с заглавной буквы;
+- difficulty — Легкий, Средний или Сложный;
+- ingredients — продукты с количеством, по одному на элемент;
+- prep — подготовка ингредиентов (помыть, почистить, нарезать и т.д.);
+- steps — шаги приготовления по порядку, без нумерации;
+- tips — 1–3 совета от шефа;
+- per_100g и per_portion (порция 300 г) — ккал, белки, жиры и углеводы целыми числами, даже если значения примерные.
+
+Без HTML, markdown и emoji внутри значений, без вводных фраз.
+"""
+
+async def _load_preferences(user_id: int, session: AsyncSession = None):
+    # Настройки приходят из кэша уже приведёнными; сессия нужна только при промахе
+    if not user_id:
+        return False, 'Любая'
+    prefs = await get_preferences(session, user_id)
+    return prefs.healthy_profile, prefs.preferred_cuisine
+
+async def _generate_structured(prompt: str) -> Recipe:
+    text = await llm_gateway.generate(prompt, response_schema=RECIPE_RESPONSE_SCHEMA)
+    logger.info(f"Recipe generated (json): {text}")
+    return Recipe.from_json(text)
+
+async def generate_recipe_result(
+    ingredients: List[str],
+    user_id: int,
+    session: AsyncSession = None,
+    temp_difficulty: Optional[str] = None,
+    query: Optional[str] = None,
+    variant: int = 0
+) -> Tuple[str, Optional[Recipe]]:
+    """
+    Как generate_recipe, но дополнительно возвращает типизированный рецепт.
+    В режиме RECIPE_JSON_MODE рецепт приходит от Gemini готовым JSON и регулярки не нужны;
+    в текстовом режиме вторым элементом возвращается None.
+    """
+    try:
+        healthy_profile, preferred_cuisine = await _load_preferences(user_id, session)
+
+        cache_key = make_recipe_key(ingredients, healthy_profile, preferred_cuisine, temp_difficulty, query, structured=RECIPE_JSON_MODE)
+        cached = await recipe_cache.get_variant(cache_key, variant)
+        if cached:
+            logger.info(f"Recipe cache hit: {cache_key}#{variant}")
+            if RECIPE_JSON_MODE:
+                recipe = Recipe.from_json(cached)
+                return render_recipe(recipe), recipe
+            return cached, None
+
+        if RECIPE_JSON_MODE:
+            prompt = build_recipe_json_prompt(ingredients, healthy_profile, preferred_cuisine, temp_difficulty, query)
+            logger.info(f"[Prompt]: {prompt}")
+
+            async def produce_json():
+                recipe = await _generate_structured(prompt)
+                await recipe_cache.add_variant(cache_key, recipe.to_json())
+                return recipe.to_json()
+
+            # Одинаковые одновременные запросы (двойное нажатие, одинаковые продукты) ждут один вызов Gemini
+            recipe = Recipe.from_json(await single_flight.do(flight_key(prompt, 'json', variant), produce_json))
+            return render_recipe(recipe), recipe
+
+        prompt = build_recipe_prompt(ingredients, healthy_profile, preferred_cuisine, temp_difficulty, query)
+        logger.info(f"[Prompt]: {prompt}")
+
+        async def produce():
+            text = await llm_gateway.generate(prompt)
+            logger.info(f"[Response]: {text}")
+            logger.info(f"Recipe generated: {text}")
+            recipe_text = format_recipe(text)
+            await recipe_cache.add_variant(cache_key, recipe_text)
+            return recipe_text
+
+        return await single_flight.do(flight_key(prompt, variant), produce), None
+    except Exception as e:
+        logger.error(f"Recipe generation error: {e}")
+        return _error_text(e), None
+
+async def generate_recipe(
+    ingredients: List[str],
+    user_id: int,
+    session: AsyncSession = None,
+    temp_difficulty: Optional[str] = None,
+    query: Optional[str] = None,
+    variant: int = 0
+) -> str:
+    """
+    Генерирует рецепт по списку ингредиентов или по пользовательскому запросу через Gemini Vision API с учётом настроек пользователя.
+    variant — номер варианта для «Другой рецепт»: закэшированные варианты отдаются без обращения к Gemini.
+    """
+    recipe_text, _ = await generate_recipe_result(ingredients, user_id, session, temp_difficulty, query, variant)
+    return recipe_text
+
+async def generate_recipe_stream(
+    ingredients: List[str],
+    user_id: int,
+    session: AsyncSession = None,
+    temp_difficulty: Optional[str] = None,
+    query: Optional[str] = None,
+    variant: int = 0
+) -> AsyncIterator[Tuple[str, bool]]:
+    """
+    Потоковый вариант generate_recipe: отдаёт пары (текст, финальный ли он).
+    Промежуточные тексты содержат только полностью полученные разделы,
+    финальный совпадает с format_recipe от полного ответа.
+    В режиме RECIPE_JSON_MODE частичный JSON не показываем — отдаётся сразу финальный текст.
+    """
+    if RECIPE_JSON_MODE:
+        recipe_text, _ = await generate_recipe_result(ingredients, user_id, session, temp_difficulty, query, variant)
+        yield recipe_text, True
+        return
+    try:
+        healthy_profile, preferred_cuisine = await _load_preferences(user_id, session)
+
+        cache_key = make_recipe_key(ingredients, healthy_profile, preferred_cuisine, temp_difficulty, query)
+        cached = await recipe_cache.get_variant(cache_key, variant)
+        if cached:
+            logger.info(f"Recipe cache hit: {cache_key}#{variant}")
+            yield cached, True
+            return
+
+        prompt = build_recipe_prompt(ingredients, healthy_profile, preferred_cuisine, temp_difficulty, query)
         logger.info(f"[Prompt]: {prompt}")
-        model = genai.GenerativeModel('gemini-1.5-flash-latest')
-        response = await model.generate_content_async(prompt)
-        logger.info(f"[Response]: {response.text}")
-        logger.info(f"Recipe generated: {response.text}")
-        return format_recipe(response.text)
+        previews = asyncio.Queue()
+
+        async def produce():
+            raw = ''
+            preview = ''
+            async for chunk in llm_gateway.stream(prompt):
+                raw += chunk
+                partial = format_recipe_partial(raw)
+                if partial and partial != preview:
+                    preview = partial
+                    previews.put_nowait(preview)
+            logger.info(f"Recipe generated (stream): {raw}")
+            recipe_text = format_recipe(raw)
+            await recipe_cache.add_variant(cache_key, recipe_text)
+            return recipe_text
+
+        # Если такой же рецепт уже генерируется, produce не запустится: ждём общий итог без промежуточных правок
+        flight = asyncio.ensure_future(single_flight.do(flight_key(prompt, variant), produce))
+        try:
+            while True:
+                getter = asyncio.ensure_future(previews.get())
+                await asyncio.wait({getter, flight}, return_when=asyncio.FIRST_COMPLETED)
+                if not getter.done():
+                    getter.cancel()
+                    break
+                if flight.done():
+                    break
+                yield getter.result(), False
+            recipe_text = await flight
+        finally:
+            flight.cancel()
+        yield recipe_text, True
     except Exception as e:
         logger.error(f"Recipe generation error: {e}")
-        return "Извините, не удалось сгенерировать рецепт. Попробуйте позже."
+        yield _error_text(e), True
 
 # --- UNIT TEST ---
 import pytest
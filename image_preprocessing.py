@@ -0,0 +1,107 @@
+import io
+import os
+import time
+import asyncio
+import logging
+from collections import Counter
+from typing import List, Optional
+from dotenv import load_dotenv
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # без Pillow фото уходят в Vision как есть
+    Image = None
+
+load_dotenv()
+
+# 1 — уменьшать и пересжимать фото перед отправкой в Vision
+VISION_PREPROCESS = os.getenv('VISION_PREPROCESS', '1') == '1'
+# Целевая длина большей стороны, px: для распознавания продуктов больше не нужно
+VISION_TARGET_SIDE = int(os.getenv('VISION_TARGET_SIDE', 1024))
+# Потолок размера JPEG, который уходит в Vision, байты
+VISION_MAX_BYTES = int(os.getenv('VISION_MAX_BYTES', 350000))
+VISION_JPEG_QUALITY = int(os.getenv('VISION_JPEG_QUALITY', 85))
+# Ниже этого качества не пересжимаем — дальше уменьшаем размер
+VISION_JPEG_MIN_QUALITY = 50
+
+logger = logging.getLogger(__name__)
+
+
+def choose_photo_size(sizes: List[dict], target: int = VISION_TARGET_SIDE) -> Optional[dict]:
+    """
+    Самый маленький PhotoSize, у которого большая сторона не меньше target.
+    Если все меньше — самый большой. Telegram присылает размеры по возрастанию, но на это не полагаемся.
+    """
+    if not sizes:
+        return None
+    ordered = sorted(sizes, key=lambda s: (max(s.get('width', 0), s.get('height', 0)), s.get('file_size', 0)))
+    return next((s for s in ordered if max(s.get('width', 0), s.get('height', 0)) >= target), ordered[-1])
+
+
+def _encode(img, quality: int) -> bytes:
+    out = io.BytesIO()
+    # Метаданные (EXIF с геометкой, ICC, миниатюры) в новый файл не переносятся
+    img.save(out, format='JPEG', quality=quality, optimize=True)
+    return out.getvalue()
+
+
+def _prepare(image_bytes: bytes, target: int, max_bytes: int) -> tuple:
+    """Синхронная часть: (байты для Vision, что было сделано). Выполняется в пуле потоков."""
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        clean = img.format == 'JPEG' and not img.info.get('exif') and not img.info.get('icc_profile')
+        if clean and max(img.size) <= target and len(image_bytes) <= max_bytes:
+            return bytes(image_bytes), 'passthrough'
+        # Поворот из EXIF применяем до того, как EXIF будет отброшен
+        img = ImageOps.exif_transpose(img).convert('RGB')
+    action = 'recompressed'
+    if max(img.size) > target:
+        img.thumbnail((target, target), Image.LANCZOS)
+        action = 'resized'
+    quality = VISION_JPEG_QUALITY
+    data = _encode(img, quality)
+    while len(data) > max_bytes:
+        if quality > VISION_JPEG_MIN_QUALITY:
+            quality = max(VISION_JPEG_MIN_QUALITY, quality - 10)
+        else:
+            img = img.resize((max(1, img.width * 3 // 4), max(1, img.height * 3 // 4)), Image.LANCZOS)
+            action = 'resized'
+        data = _encode(img, quality)
+    return data, action
+
+
+class ImagePreprocessor:
+    """
+    Подготовка фото к отправке в Vision: уменьшение до VISION_TARGET_SIDE, пересжатие в JPEG
+    без метаданных и потолок VISION_MAX_BYTES. Работа с пикселями идёт в пуле потоков (asyncio.to_thread),
+    чтобы не блокировать event loop. При ошибке или без Pillow возвращаются исходные байты.
+    """
+
+    def __init__(self, enabled: bool = VISION_PREPROCESS, target: int = VISION_TARGET_SIDE, max_bytes: int = VISION_MAX_BYTES):
+        self.enabled = enabled and Image is not None
+        self.target = target
+        self.max_bytes = max_bytes
+        self.stats = Counter()
+
+    async def prepare(self, image_bytes) -> bytes:
+        """image_bytes — bytes или буфер скачивания (bytearray); в bytes он превращается, только если уходит в Vision как есть."""
+        if not self.enabled or not image_bytes:
+            return bytes(image_bytes)
+        started = time.perf_counter()
+        try:
+            data, action = await asyncio.to_thread(_prepare, image_bytes, self.target, self.max_bytes)
+        except Exception as e:
+            logger.error(f"Image preprocessing error: {e}")
+            self.stats['errors'] += 1
+            return bytes(image_bytes)
+        self.stats[action] += 1
+        self.stats['bytes_in'] += len(image_bytes)
+        self.stats['bytes_out'] += len(data)
+        self.stats['prepare_ms'] += int((time.perf_counter() - started) * 1000)
+        return data
+
+    def metrics(self) -> dict:
+        saved = self.stats['bytes_in'] - self.stats['bytes_out']
+        return {'enabled': self.enabled, 'target_side': self.target, 'max_bytes': self.max_bytes, 'bytes_saved': saved, **self.stats}
+
+
+image_preprocessor = ImagePreprocessor()
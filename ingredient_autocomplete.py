@@ -0,0 +1,182 @@
+import os
+import time
+import bisect
+import logging
+from collections import Counter, OrderedDict
+from typing import Iterable, List, Optional
+from dotenv import load_dotenv
+from session_store import session_store
+from redis_scripts import script_registry
+from ingredient_normalizer import ingredient_normalizer, fold
+
+load_dotenv()
+
+AUTOCOMPLETE_LIMIT = int(os.getenv('AUTOCOMPLETE_LIMIT', 8))
+# Запросы короче этого не дополняем: у одной буквы слишком много продолжений
+AUTOCOMPLETE_MIN_QUERY = int(os.getenv('AUTOCOMPLETE_MIN_QUERY', 2))
+# Как часто подтягивать частоты из Redis, секунды
+AUTOCOMPLETE_REFRESH_INTERVAL = float(os.getenv('AUTOCOMPLETE_REFRESH_INTERVAL', 60))
+# Сколько самых частых ингредиентов читать из Redis при обновлении
+AUTOCOMPLETE_TOP_SIZE = int(os.getenv('AUTOCOMPLETE_TOP_SIZE', 20000))
+# Ингредиент не из словаря попадает в подсказки, когда его использовали в стольких разных чатах
+AUTOCOMPLETE_MIN_COUNT = int(os.getenv('AUTOCOMPLETE_MIN_COUNT', 3))
+AUTOCOMPLETE_RESULT_CACHE_SIZE = int(os.getenv('AUTOCOMPLETE_RESULT_CACHE_SIZE', 4096))
+
+# Частота — число разных чатов, а не подтверждений: один чат не может сам вывести название в подсказки всем
+USAGE_KEY = 'ingredient_chats'
+
+# KEYS[1] — sorted set частот, KEYS[2..] — HyperLogLog чатов на каждое название; ARGV[1] — chat_id, ARGV[2..] — названия.
+# Возвращает названия, для которых чат встретился впервые
+RECORD_USAGE_LUA = """
+local counted = {}
+for i = 2, #KEYS do
+    if redis.call('PFADD', KEYS[i], ARGV[1]) == 1 then
+        redis.call('ZINCRBY', KEYS[1], 1, ARGV[i])
+        table.insert(counted, ARGV[i])
+    end
+end
+return counted
+"""
+
+RECORD_USAGE = script_registry.register('ingredient_usage_record', RECORD_USAGE_LUA)
+
+logger = logging.getLogger(__name__)
+
+
+class IngredientAutocomplete:
+    """
+    Подсказки ингредиентов по началу любого слова названия («кур» → «курица», «грудк» → «куриная грудка»).
+
+    Индекс — отсортированный список пар (хвост названия с начала слова, ключ), поиск — bisect по
+    префиксу, ранжирование — по глобальной частоте использования (sorted set ingredient_usage в Redis).
+    Новые названия вставляются в список по одному (insort), изменение частот индекс не перестраивает:
+    сбрасывается только кэш готовых ответов.
+    """
+
+    def __init__(self, limit: int = AUTOCOMPLETE_LIMIT):
+        self.limit = limit
+        self.names = {}
+        self.weights = Counter()
+        self.stats = Counter()
+        self._tokens = []
+        self._results = OrderedDict()
+        self._refreshed_at = 0.0
+        for key, canonical in ingredient_normalizer.aliases().items():
+            self.add(canonical, key)
+
+    def add(self, name: str, key: str = None) -> bool:
+        """Добавляет название (или синоним key, ведущий к name) в индекс; False — уже было."""
+        key = key or fold(name)
+        if not key or key in self.names:
+            return False
+        self.names[key] = name
+        words = key.split(' ')
+        for idx in range(len(words)):
+            bisect.insort(self._tokens, (' '.join(words[idx:]), key))
+        self._results.clear()
+        return True
+
+    def exact(self, text: str) -> Optional[str]:
+        """Название из индекса, совпадающее с text целиком (в том числе добавленное по частоте использования)."""
+        return self.names.get(fold(text or ''))
+
+    def _search(self, query: str) -> List[str]:
+        cached = self._results.get(query)
+        if cached is not None:
+            self._results.move_to_end(query)
+            self.stats['cached'] += 1
+            return cached
+        best = {}
+        tokens = self._tokens
+        idx = bisect.bisect_left(tokens, (query,))
+        while idx < len(tokens) and tokens[idx][0].startswith(query):
+            key = tokens[idx][1]
+            idx += 1
+            name = self.names[key]
+            # Совпадение с началом названия выше совпадения с середины; синонимы сводятся к одному названию
+            rank = (key.startswith(query), fold(name) == key, self.weights[name], -len(name))
+            if name not in best or rank > best[name]:
+                best[name] = rank
+        ranked = sorted(best, key=lambda n: (best[n], n), reverse=True)
+        self._results[query] = ranked
+        while len(self._results) > AUTOCOMPLETE_RESULT_CACHE_SIZE:
+            self._results.popitem(last=False)
+        return ranked
+
+    def complete(self, query: str, limit: int = None, session_ingredients: Iterable[str] = (),
+                 dictionary: bool = True, exclude: Iterable[str] = ()) -> List[str]:
+        """
+        Дополнения для введённого текста. Ингредиенты из сессии чата (session_ingredients) идут первыми;
+        dictionary=False — искать только среди них (для «➖ Убрать ингредиент»); exclude — не предлагать.
+        """
+        limit = limit or self.limit
+        query = fold(query or '')
+        if len(query) < AUTOCOMPLETE_MIN_QUERY:
+            return []
+        started = time.perf_counter()
+        skip = {fold(i) for i in exclude}
+        result = []
+        for item in session_ingredients:
+            folded = fold(item)
+            if folded not in skip and (folded.startswith(query) or f' {query}' in f' {folded}'):
+                result.append(item)
+                skip.add(folded)
+        if dictionary:
+            for name in self._search(query):
+                if len(result) >= limit:
+                    break
+                if fold(name) not in skip:
+                    result.append(name)
+        self.stats['lookups'] += 1
+        self.stats['lookup_us'] += int((time.perf_counter() - started) * 1e6)
+        return result[:limit]
+
+    async def record(self, chat_id, names: Iterable[str]):
+        """Учитывает, что чат использовал ингредиенты; повторы из того же чата частоту не увеличивают."""
+        names = list(dict.fromkeys(n for n in names if n))
+        if not names:
+            return
+        try:
+            counted = await script_registry.run(RECORD_USAGE, [USAGE_KEY] + [f"{USAGE_KEY}:{name}" for name in names], [chat_id] + names)
+        except Exception as e:
+            logger.error(f"Redis autocomplete record error: {e}")
+            return
+        if counted:
+            self.weights.update(counted)
+            self._results.clear()
+
+    async def refresh(self, force: bool = False):
+        """Подтягивает глобальные частоты из Redis не чаще AUTOCOMPLETE_REFRESH_INTERVAL."""
+        now = time.monotonic()
+        if not force and now - self._refreshed_at < AUTOCOMPLETE_REFRESH_INTERVAL:
+            return
+        self._refreshed_at = now
+        try:
+            await session_store.connect()
+            top = await session_store.redis.zrevrange(USAGE_KEY, 0, AUTOCOMPLETE_TOP_SIZE - 1, withscores=True)
+        except Exception as e:
+            logger.error(f"Redis autocomplete refresh error: {e}")
+            return
+        changed = False
+        for name, score in top:
+            count = int(score)
+            if self.weights[name] != count:
+                self.weights[name] = count
+                changed = True
+            if count >= AUTOCOMPLETE_MIN_COUNT and self.add(name):
+                self.stats['added'] += 1
+        if changed:
+            self._results.clear()
+        self.stats['refreshes'] += 1
+
+    def metrics(self) -> dict:
+        lookups = self.stats['lookups']
+        return {
+            'names': len(self.names),
+            'tokens': len(self._tokens),
+            'avg_lookup_us': round(self.stats['lookup_us'] / lookups, 1) if lookups else None,
+            **self.stats,
+        }
+
+
+ingredient_autocomplete = IngredientAutocomplete()
@@ -0,0 +1,204 @@
+import os
+import re
+import logging
+from collections import Counter
+from functools import lru_cache
+from itertools import combinations
+from typing import Iterable, List, Optional, Tuple
+from dotenv import load_dotenv
+from ingredients_dict import KNOWN_INGREDIENTS, SYNONYMS
+
+try:
+    import pymorphy3 as pymorphy
+except ImportError:
+    try:
+        import pymorphy2 as pymorphy
+    except ImportError:  # лемматизация необязательна: без неё формы слов исправляются как опечатки
+        pymorphy = None
+
+load_dotenv()
+
+INGREDIENT_LEMMATIZE = os.getenv('INGREDIENT_LEMMATIZE', '1') == '1'
+# Максимальное расстояние Дамерау–Левенштейна для исправления опечаток (для длинных слов)
+INGREDIENT_MAX_EDIT_DISTANCE = int(os.getenv('INGREDIENT_MAX_EDIT_DISTANCE', 2))
+INGREDIENT_NORMALIZE_CACHE_SIZE = int(os.getenv('INGREDIENT_NORMALIZE_CACHE_SIZE', 10000))
+
+_PARENS_RE = re.compile(r'\([^)]*\)')
+_QUANTITY_RE = re.compile(
+    r'\d+(?:[.,/]\d+)?\s*(?:%|шт|штук[аи]?|кг|гр?|мл|л|ст\.?\s*л|ч\.?\s*л|стакан(?:а|ов)?)?\.?(?=\s|$)'
+)
+_NON_WORD_RE = re.compile(r'[^а-яёa-z\s-]+')
+_SPACES_RE = re.compile(r'\s+')
+
+logger = logging.getLogger(__name__)
+
+
+def fold(text: str) -> str:
+    """Ключ сравнения: нижний регистр, ё → е, одиночные пробелы."""
+    return _SPACES_RE.sub(' ', text.lower().replace('ё', 'е')).strip()
+
+
+def clean(name: str) -> str:
+    """Убирает количества, единицы измерения, пояснения в скобках и знаки препинания."""
+    text = _PARENS_RE.sub(' ', (name or '').lower())
+    text = _QUANTITY_RE.sub(' ', text)
+    text = _NON_WORD_RE.sub(' ', text)
+    return _SPACES_RE.sub(' ', text).strip(' -')
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Расстояние Дамерау–Левенштейна (OSA); если оно больше limit, возвращает limit + 1."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        row = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            row[j] = min(prev[j] + 1, row[j - 1] + 1, prev[j - 1] + cost)
+            if prev2 is not None and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                row[j] = min(row[j], prev2[j - 2] + 1)
+        if min(row) > limit:
+            return limit + 1
+        prev2, prev = prev, row
+    return prev[-1] if prev[-1] <= limit else limit + 1
+
+
+def _deletes(word: str, distance: int) -> set:
+    """Все варианты слова с удалёнными 1..distance символами (индекс SymSpell)."""
+    variants = set()
+    for n in range(1, min(distance, len(word) - 1) + 1):
+        for positions in combinations(range(len(word)), n):
+            variants.add(''.join(c for idx, c in enumerate(word) if idx not in positions))
+    return variants
+
+
+class IngredientNormalizer:
+    """
+    Приводит названия ингредиентов к каноническим из KNOWN_INGREDIENTS:
+    нижний регистр и обрезка, лемматизация (pymorphy, если установлен), синонимы (SYNONYMS)
+    и исправление опечаток по индексу симметричных удалений (SymSpell) над словарём.
+    Неизвестные ингредиенты не выбрасываются — остаются в очищенном виде.
+    """
+
+    def __init__(self, known: Iterable[str] = KNOWN_INGREDIENTS, synonyms: Optional[dict] = None,
+                 max_distance: int = INGREDIENT_MAX_EDIT_DISTANCE, lemmatize: bool = INGREDIENT_LEMMATIZE):
+        self.synonyms = SYNONYMS if synonyms is None else synonyms
+        self.max_distance = max_distance
+        self.stats = Counter()
+        self._morph = None
+        self._lemmatize = lemmatize and pymorphy is not None
+        # ключ сравнения → каноническое название
+        self._exact = {}
+        for name in set(known) | set(self.synonyms):
+            canonical = self.synonyms.get(name, name)
+            self._exact.setdefault(fold(name), canonical)
+            if self._lemmatize:
+                self._exact.setdefault(fold(self.lemma(name)), canonical)
+        self._index = {}
+        for key in self._exact:
+            for variant in _deletes(key, max_distance):
+                self._index.setdefault(variant, set()).add(key)
+        self._resolve = lru_cache(maxsize=INGREDIENT_NORMALIZE_CACHE_SIZE)(self._resolve)
+
+    def lemma(self, phrase: str) -> str:
+        """Начальные формы слов фразы («помидоры» → «помидор»)."""
+        if not self._lemmatize:
+            return phrase
+        if self._morph is None:
+            self._morph = pymorphy.MorphAnalyzer()
+        return ' '.join(self._morph.parse(word)[0].normal_form for word in phrase.split())
+
+    def _allowed_distance(self, key: str) -> int:
+        # Короткие слова не исправляем: у «рис» и «киноа» слишком много настоящих соседей на расстоянии 1
+        if len(key) <= 5:
+            return 0
+        if len(key) <= 8:
+            return min(1, self.max_distance)
+        return self.max_distance
+
+    def is_real_word(self, phrase: str) -> bool:
+        """Все слова фразы есть в словаре pymorphy — это настоящее название, а не опечатка."""
+        if not self._lemmatize:
+            return False
+        if self._morph is None:
+            self._morph = pymorphy.MorphAnalyzer()
+        return all(self._morph.word_is_known(word) for word in phrase.split())
+
+    def correct(self, key: str) -> Optional[str]:
+        """
+        Каноническое название для ключа с опечаткой или None. Исправляем, только если кандидат
+        единственный: неизвестный продукт («киноа») не должен превращаться в похожий известный («кинза»).
+        """
+        distance = self._allowed_distance(key)
+        if not distance or self.is_real_word(key):
+            return None
+        candidates = set(self._index.get(key, ()))
+        if key in self._exact:
+            candidates.add(key)
+        for variant in _deletes(key, distance):
+            if variant in self._exact:
+                candidates.add(variant)
+            candidates.update(self._index.get(variant, ()))
+        matches = {self._exact[c] for c in candidates if edit_distance(key, c, distance) <= distance}
+        if len(matches) != 1:
+            if matches:
+                self.stats['ambiguous'] += 1
+            return None
+        return matches.pop()
+
+    def _resolve(self, name: str) -> Tuple[str, bool]:
+        """(название, найдено ли оно в словаре)."""
+        cleaned = clean(name)
+        if not cleaned:
+            return '', False
+        key = fold(cleaned)
+        if key in self._exact:
+            self.stats['exact'] += 1
+            return self._exact[key], True
+        lemma = fold(self.lemma(cleaned))
+        if lemma in self._exact:
+            self.stats['lemma'] += 1
+            return self._exact[lemma], True
+        corrected = self.correct(key) or (self.correct(lemma) if lemma != key else None)
+        if corrected:
+            self.stats['corrected'] += 1
+            logger.info(f"[INGREDIENTS] '{name}' → '{corrected}'")
+            return corrected, True
+        self.stats['unknown'] += 1
+        return cleaned, False
+
+    def normalize_one(self, name: str) -> str:
+        return self._resolve(name)[0]
+
+    def lookup(self, name: str) -> Optional[str]:
+        """Каноническое название или None, если ингредиента нет в словаре."""
+        canonical, known = self._resolve(name)
+        return canonical if known else None
+
+    def aliases(self) -> dict:
+        """Ключ сравнения (в том числе синонимы) → каноническое название."""
+        return dict(self._exact)
+
+    def normalize(self, names: Iterable[str]) -> List[str]:
+        """Канонические названия без пустых и повторов, в исходном порядке."""
+        return list(dict.fromkeys(n for n in (self.normalize_one(name) for name in names if name) if n))
+
+    def metrics(self) -> dict:
+        info = self._resolve.cache_info()
+        return {
+            'lemmatizer': self._lemmatize,
+            'dictionary': len(self._exact),
+            'index': len(self._index),
+            'cache_hits': info.hits,
+            'cache_misses': info.misses,
+            **self.stats,
+        }
+
+
+ingredient_normalizer = IngredientNormalizer()
+
+
+def normalize_ingredients(names: Iterable[str]) -> List[str]:
+    return ingredient_normalizer.normalize(names)
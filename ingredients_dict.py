@@ -70,4 +70,30 @@ KNOWN_INGREDIENTS = set([
     # Алкоголь
     'вино', 'красное вино', 'белое вино', 'пиво', 'шампанское', 'водка', 'коньяк', 'ром',
     'текила', 'джин', 'виски', 'ликёр', 'бренди', 'шнапс',
-])
\ No newline at end of file
+])
+
+# Синонимы и разговорные формы → каноническое название из KNOWN_INGREDIENTS
+SYNONYMS = {
+    'картошка': 'картофель',
+    'морковка': 'морковь',
+    'луковица': 'лук',
+    'репчатый лук': 'лук',
+    'томат': 'помидор',
+    'болгарский перец': 'перец болгарский',
+    'перец чили': 'чили',
+    'куриное филе': 'куриная грудка',
+    'грудка': 'куриная грудка',
+    'говяжий фарш': 'фарш говяжий',
+    'фарш свиной': 'свиной фарш',
+    'куриная печень': 'печень куриная',
+    'говяжья печень': 'печень говяжья',
+    'овсяные хлопья': 'овсянка',
+    'манная крупа': 'манка',
+    'гречневая крупа': 'гречка',
+    'сгущённое молоко': 'сгущёнка',
+    'подсолнечное масло': 'растительное масло',
+    'яйца': 'яйцо',
+    'куриное яйцо': 'яйцо',
+    'сахарный песок': 'сахар',
+    'поваренная соль': 'соль',
+}
@@ -0,0 +1,445 @@
+import os
+import json
+import math
+import hashlib
+import time
+import random
+import asyncio
+import logging
+from collections import Counter
+from typing import AsyncIterator, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-1.5-flash-latest')
+# gemini — настоящий API; fake — локальная заглушка с настраиваемой задержкой (без сети)
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'gemini')
+# Сколько вызовов модели одновременно может вести процесс
+LLM_CONCURRENCY = int(os.getenv('LLM_CONCURRENCY', 16))
+# Срок на весь вызов, включая ожидание в очереди и повторы, секунды
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', 60))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', 2))
+LLM_RETRY_BASE_DELAY = float(os.getenv('LLM_RETRY_BASE_DELAY', 0.5))
+LLM_RETRY_MAX_DELAY = float(os.getenv('LLM_RETRY_MAX_DELAY', 8))
+# Столько ошибок подряд размыкают предохранитель; через LLM_BREAKER_COOLDOWN секунд пропускается пробный вызов
+LLM_BREAKER_THRESHOLD = int(os.getenv('LLM_BREAKER_THRESHOLD', 5))
+LLM_BREAKER_COOLDOWN = float(os.getenv('LLM_BREAKER_COOLDOWN', 30))
+# Заглушка: медиана задержки (мс), разброс, распределение задержки, доля ошибок
+LLM_FAKE_LATENCY_MS = float(os.getenv('LLM_FAKE_LATENCY_MS', 800))
+LLM_FAKE_LATENCY_SIGMA = float(os.getenv('LLM_FAKE_LATENCY_SIGMA', 0.3))
+# lognormal — sigma логарифма; uniform — медиана ± sigma (доля); exponential — длинный хвост; fixed — всегда медиана
+LLM_FAKE_LATENCY_DIST = os.getenv('LLM_FAKE_LATENCY_DIST', 'lognormal')
+LLM_FAKE_ERROR_RATE = float(os.getenv('LLM_FAKE_ERROR_RATE', 0))
+
+try:
+    from google.api_core import exceptions as google_exceptions
+    RETRYABLE_ERRORS = (
+        google_exceptions.TooManyRequests,
+        google_exceptions.ResourceExhausted,
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.InternalServerError,
+        google_exceptions.DeadlineExceeded,
+    )
+except ImportError:  # без google-api-core повторяем только таймауты и сетевые ошибки
+    RETRYABLE_ERRORS = ()
+
+logger = logging.getLogger(__name__)
+
+
+class LLMError(Exception):
+    pass
+
+
+class LLMTimeout(LLMError):
+    """Вызов не уложился в срок (вместе с повторами)."""
+
+
+class LLMUnavailable(LLMError):
+    """Предохранитель разомкнут: бэкенд недавно отказывал подряд, вызов не выполнялся."""
+
+
+def is_retryable(error: Exception) -> bool:
+    return (
+        isinstance(error, (asyncio.TimeoutError, ConnectionError) + RETRYABLE_ERRORS)
+        or getattr(error, 'retryable', False)
+    )
+
+
+class CircuitBreaker:
+    """
+    closed → (threshold ошибок подряд) → open → (cooldown) → half_open: один пробный вызов.
+    before_call() возвращает токен пробного вызова (None для обычного); закрыть или снова разомкнуть
+    предохранитель после half_open может только вызов с этим токеном — запоздавшие ответы вызовов,
+    начатых до размыкания, его состояние не меняют.
+    """
+
+    def __init__(self, threshold: int = LLM_BREAKER_THRESHOLD, cooldown: float = LLM_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe: Optional[object] = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at < self.cooldown:
+            return 'open'
+        return 'half_open'
+
+    def before_call(self) -> Optional[object]:
+        state = self.state
+        if state == 'open' or (state == 'half_open' and self._probe is not None):
+            raise LLMUnavailable('LLM backend is unavailable (circuit open)')
+        if state == 'half_open':
+            self._probe = object()
+            return self._probe
+        return None
+
+    def _owns(self, probe: Optional[object]) -> bool:
+        return probe is not None and probe is self._probe
+
+    def abort(self, probe: Optional[object] = None):
+        """Вызов не дошёл до бэкенда или его исход не говорит о состоянии бэкенда — пробный слот освобождается."""
+        if self._owns(probe):
+            self._probe = None
+
+    def success(self, probe: Optional[object] = None):
+        if self.opened_at is not None and not self._owns(probe):
+            return
+        self.failures = 0
+        self.opened_at = None
+        self._probe = None
+
+    def failure(self, probe: Optional[object] = None):
+        if self._owns(probe):
+            self.failures += 1
+            logger.warning("[LLM] Пробный вызов не удался, предохранитель снова разомкнут")
+            self.opened_at = time.monotonic()
+            self._probe = None
+            return
+        if self.opened_at is not None:
+            return
+        self.failures += 1
+        if self.failures >= self.threshold:
+            logger.warning(f"[LLM] Предохранитель разомкнут после {self.failures} ошибок подряд")
+            self.opened_at = time.monotonic()
+
+
+class GeminiBackend:
+    """google-generativeai: один долгоживущий GenerativeModel на процесс."""
+
+    name = 'gemini'
+
+    def __init__(self, model_name: str = GEMINI_MODEL):
+        import google.generativeai as genai
+        genai.configure(api_key=GEMINI_API_KEY)
+        self.genai = genai
+        self.model = genai.GenerativeModel(model_name)
+
+    def _config(self, response_schema):
+        if response_schema is None:
+            return None
+        return self.genai.GenerationConfig(response_mime_type='application/json', response_schema=response_schema)
+
+    async def generate(self, contents, response_schema=None) -> str:
+        config = self._config(response_schema)
+        if config is None:
+            response = await self.model.generate_content_async(contents)
+        else:
+            response = await self.model.generate_content_async(contents, generation_config=config)
+        return response.text
+
+    async def stream(self, contents) -> AsyncIterator[str]:
+        response = await self.model.generate_content_async(contents, stream=True)
+        async for chunk in response:
+            yield chunk.text
+
+
+class FakeBackendError(Exception):
+    retryable = True
+
+
+# Из этих продуктов заглушка «распознаёт» набор, зависящий от байтов фото: разные фото — разные рецепты
+FAKE_INGREDIENT_POOL = [
+    'помидор', 'огурец', 'сыр', 'яйцо', 'картофель', 'морковь', 'лук', 'чеснок', 'курица', 'говядина',
+    'рис', 'гречка', 'макароны', 'молоко', 'сметана', 'перец', 'капуста', 'грибы', 'кабачок', 'яблоко',
+]
+
+FAKE_RECIPE_TEXT = (
+    'Омлет с овощами\n'
+    'Сложность: Легкий\n'
+    'Ингредиенты:\n– яйцо 3 шт\n– помидор 1 шт\n– огурец 1 шт\n– сыр 50 г\n'
+    'Подготовка ингредиентов:\n– Нарезать помидор и огурец кубиками.\n– Натереть сыр.\n'
+    'Шаги приготовления:\n1. Взбить яйца со щепоткой соли.\n2. Обжарить овощи 2 минуты.\n'
+    '3. Залить яйцами, посыпать сыром и готовить под крышкой 5 минут.\n'
+    'Советы от шефа:\n– Подавайте сразу, пока сыр тянется 🍳\n'
+    'КБЖУ (приблизительно):\nНа 100 г: 140 ккал, 9 г белков, 10 г жиров, 3 г углеводов\n'
+    'На порцию (300 г): 420 ккал, 27 г белков, 30 г жиров, 9 г углеводов'
+)
+
+FAKE_RECIPE_JSON = {
+    'title': 'Омлет с овощами',
+    'difficulty': 'Легкий',
+    'ingredients': ['яйцо 3 шт', 'помидор 1 шт', 'огурец 1 шт', 'сыр 50 г'],
+    'prep': ['Нарезать помидор и огурец кубиками.', 'Натереть сыр.'],
+    'steps': ['Взбить яйца со щепоткой соли.', 'Обжарить овощи 2 минуты.', 'Залить яйцами, посыпать сыром и готовить под крышкой 5 минут.'],
+    'tips': ['Подавайте сразу, пока сыр тянется 🍳'],
+    'per_100g': {'calories': 140, 'protein': 9, 'fat': 10, 'carbs': 3},
+    'per_portion': {'calories': 420, 'protein': 27, 'fat': 30, 'carbs': 9},
+}
+
+
+class FakeBackend:
+    """
+    Заглушка для тестов и нагрузочных прогонов: отвечает готовыми текстами после задержки
+    с медианой latency_ms и распределением distribution, с заданной долей повторяемых ошибок.
+    responder(contents, response_schema) -> str подменяет ответы.
+    """
+
+    name = 'fake'
+
+    def __init__(self, latency_ms: float = LLM_FAKE_LATENCY_MS, sigma: float = LLM_FAKE_LATENCY_SIGMA,
+                 error_rate: float = LLM_FAKE_ERROR_RATE, responder=None, distribution: str = LLM_FAKE_LATENCY_DIST):
+        self.latency_ms = latency_ms
+        self.sigma = sigma
+        self.distribution = distribution
+        self.error_rate = error_rate
+        self.responder = responder or self.default_response
+        self.calls = Counter()
+
+    @staticmethod
+    def default_response(contents, response_schema=None) -> str:
+        if response_schema is not None:
+            return json.dumps(FAKE_RECIPE_JSON, ensure_ascii=False)
+        images = [part['data'] for part in contents if isinstance(part, dict) and 'data' in part] if isinstance(contents, list) else []
+        if images:
+            found = []
+            for data in images:
+                rnd = random.Random(hashlib.sha1(bytes(data)).digest())
+                found += rnd.sample(FAKE_INGREDIENT_POOL, rnd.randint(3, 5))
+            return ', '.join(dict.fromkeys(found))
+        return FAKE_RECIPE_TEXT
+
+    def _latency(self) -> float:
+        if self.latency_ms <= 0:
+            return 0
+        median = self.latency_ms / 1000
+        if self.distribution == 'exponential':
+            # У экспоненциального распределения медиана равна ln 2 / λ
+            return random.expovariate(math.log(2) / median)
+        if self.distribution == 'uniform':
+            spread = min(self.sigma, 1)
+            return random.uniform(median * (1 - spread), median * (1 + spread))
+        if self.distribution == 'fixed' or not self.sigma:
+            return median
+        return random.lognormvariate(0, self.sigma) * median
+
+    async def generate(self, contents, response_schema=None) -> str:
+        self.calls['generate'] += 1
+        await asyncio.sleep(self._latency())
+        if random.random() < self.error_rate:
+            raise FakeBackendError('fake backend error')
+        return self.responder(contents, response_schema)
+
+    async def stream(self, contents) -> AsyncIterator[str]:
+        self.calls['stream'] += 1
+        text = self.responder(contents, None)
+        chunks = [text[i:i + 80] for i in range(0, len(text), 80)] or ['']
+        delay = self._latency() / len(chunks)
+        for idx, chunk in enumerate(chunks):
+            await asyncio.sleep(delay)
+            if idx == 0 and random.random() < self.error_rate:
+                raise FakeBackendError('fake backend error')
+            yield chunk
+
+
+def make_backend(name: str = LLM_BACKEND):
+    if name == 'fake':
+        return FakeBackend()
+    return GeminiBackend()
+
+
+class LLMGateway:
+    """
+    Единая точка вызова модели: общий бэкенд, ограничение параллельных вызовов (LLM_CONCURRENCY),
+    срок на вызов вместе с повторами, повторы с экспоненциальной задержкой и джиттером
+    для повторяемых ошибок (429/5xx/таймаут) и предохранитель, который при деградации бэкенда
+    сразу отвечает LLMUnavailable.
+    """
+
+    def __init__(self, backend=None, concurrency: int = LLM_CONCURRENCY, timeout: float = LLM_TIMEOUT,
+                 max_retries: int = LLM_MAX_RETRIES):
+        self._backend = backend
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.breaker = CircuitBreaker()
+        self.stats = Counter()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._active = 0
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = make_backend()
+            logger.info(f"[LLM] Бэкенд: {self._backend.name}")
+        return self._backend
+
+    def use_backend(self, backend):
+        """Подменяет бэкенд (например, FakeBackend в тестах и нагрузочных прогонах)."""
+        self._backend = backend
+        self.breaker = CircuitBreaker(self.breaker.threshold, self.breaker.cooldown)
+
+    def _limit(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    @staticmethod
+    def _remaining(deadline: float) -> float:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise LLMTimeout('LLM call deadline exceeded')
+        return remaining
+
+    def _backoff(self, attempt: int, deadline: float) -> float:
+        # Full jitter: равномерно от 0 до экспоненциального потолка, но не позже срока
+        delay = random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** attempt))
+        return min(delay, max(0.0, deadline - time.monotonic()))
+
+    def _handle_error(self, e: Exception, attempt: int, retries: int, deadline: float, probe: Optional[object] = None) -> float:
+        """Решает, повторять ли вызов; возвращает задержку перед повтором или пробрасывает ошибку."""
+        if isinstance(e, LLMError):
+            self.breaker.abort(probe)
+            raise e
+        if not is_retryable(e):
+            # Ошибка запроса (например, 400 или блокировка ответа) ничего не говорит о бэкенде:
+            # счётчик и состояние предохранителя не меняем, только освобождаем пробный слот
+            self.breaker.abort(probe)
+            self.stats['errors'] += 1
+            raise e
+        self.breaker.failure(probe)
+        self.stats['retryable_errors'] += 1
+        if attempt >= retries or deadline - time.monotonic() <= 0:
+            if isinstance(e, asyncio.TimeoutError):
+                raise LLMTimeout('LLM call deadline exceeded') from e
+            raise e
+        self.stats['retries'] += 1
+        logger.warning(f"[LLM] Повтор {attempt + 1}/{retries} после ошибки: {e}")
+        return self._backoff(attempt, deadline)
+
+    async def _acquire(self, deadline: float) -> Optional[object]:
+        """Занимает слот; возвращает токен пробного вызова предохранителя (или None)."""
+        probe = self.breaker.before_call()
+        try:
+            await asyncio.wait_for(self._limit().acquire(), self._remaining(deadline))
+        except asyncio.TimeoutError:
+            # Срок истёк в очереди на слот — бэкенд тут ни при чём
+            self.breaker.abort(probe)
+            self.stats['queue_timeouts'] += 1
+            raise LLMTimeout('LLM call deadline exceeded while waiting for a slot')
+        except BaseException:
+            self.breaker.abort(probe)
+            raise
+        self._active += 1
+        return probe
+
+    def _release(self):
+        self._active -= 1
+        self._limit().release()
+
+    async def generate(self, contents, response_schema=None, timeout: Optional[float] = None,
+                       retries: Optional[int] = None) -> str:
+        """Текст ответа модели; response_schema — ответ JSON-ом по схеме."""
+        deadline = time.monotonic() + (timeout or self.timeout)
+        retries = self.max_retries if retries is None else retries
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            probe = None
+            try:
+                probe = await self._acquire(deadline)
+                try:
+                    text = await asyncio.wait_for(self.backend.generate(contents, response_schema), self._remaining(deadline))
+                finally:
+                    self._release()
+                self.breaker.success(probe)
+                self.stats['calls'] += 1
+                self.stats['latency_ms'] += int((time.monotonic() - started) * 1000)
+                return text
+            except LLMUnavailable:
+                self.stats['rejected'] += 1
+                raise
+            except asyncio.CancelledError:
+                self.breaker.abort(probe)
+                raise
+            except Exception as e:
+                delay = self._handle_error(e, attempt, retries, deadline, probe)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def stream(self, contents, timeout: Optional[float] = None, retries: Optional[int] = None) -> AsyncIterator[str]:
+        """Ответ модели по частям. Повтор возможен только до первой отданной части."""
+        deadline = time.monotonic() + (timeout or self.timeout)
+        retries = self.max_retries if retries is None else retries
+        attempt = 0
+        probe = None
+        try:
+            while True:
+                yielded = False
+                probe = None
+                try:
+                    probe = await self._acquire(deadline)
+                    try:
+                        chunks = self.backend.stream(contents).__aiter__()
+                        while True:
+                            try:
+                                chunk = await asyncio.wait_for(chunks.__anext__(), self._remaining(deadline))
+                            except StopAsyncIteration:
+                                break
+                            yielded = True
+                            yield chunk
+                    finally:
+                        self._release()
+                    self.breaker.success(probe)
+                    self.stats['streams'] += 1
+                    return
+                except LLMUnavailable:
+                    self.stats['rejected'] += 1
+                    raise
+                except Exception as e:
+                    if yielded:
+                        if is_retryable(e):
+                            self.breaker.failure(probe)
+                        raise
+                    delay = self._handle_error(e, attempt, retries, deadline, probe)
+                attempt += 1
+                await asyncio.sleep(delay)
+        finally:
+            # Исход не учтён (aclose() у потребителя, ошибка после первой части) — пробный слот освобождается.
+            # Если исход уже учтён, токен больше не действует и abort ничего не меняет
+            self.breaker.abort(probe)
+
+    def spare_capacity(self) -> int:
+        """Сколько вызовов ещё можно начать без ожидания слота (0, если предохранитель разомкнут)."""
+        if self.breaker.state != 'closed':
+            return 0
+        return max(0, self.concurrency - self._active)
+
+    def metrics(self) -> dict:
+        calls = self.stats['calls']
+        return {
+            'backend': self._backend.name if self._backend else LLM_BACKEND,
+            'breaker': self.breaker.state,
+            'active': self._active,
+            'concurrency': self.concurrency,
+            'avg_latency_ms': round(self.stats['latency_ms'] / calls) if calls else None,
+            **self.stats,
+        }
+
+
+llm_gateway = LLMGateway()
@@ -0,0 +1,152 @@
+# Драйвер нагрузки: тысячи чатов проходят настоящий FSM бота через /webhook
+# (/start → фото → подтверждение → другой рецепт → сохранение) и ждут ответы в фейковом Bot API.
+import time
+import random
+import asyncio
+from collections import Counter, defaultdict
+from typing import Callable, NamedTuple
+import httpx
+from config.texts import BUTTONS, WELCOME_TEXT
+from generate_recipe import RECIPE_ERROR_TEXT, RECIPE_TIMEOUT_TEXT, RECIPE_UNAVAILABLE_TEXT
+from loadtest.fake_telegram import FakeTelegram, expect_text
+
+# Ответы бота, после которых сценарий чата дальше не идёт
+FAILED = expect_text('⚠️ Что-то пошло не так', '❌', RECIPE_ERROR_TEXT, RECIPE_TIMEOUT_TEXT, RECIPE_UNAVAILABLE_TEXT)
+# Первые chat_id заведомо не пересекаются с настоящими пользователями в общей базе
+CHAT_ID_BASE = 9_000_000_000
+
+
+class Step(NamedTuple):
+    name: str
+    message: Callable[[dict], dict]
+    done: Callable[[str, dict], bool]
+
+
+def text(value: str) -> Callable[[dict], dict]:
+    return lambda chat: {'text': value}
+
+
+def photo(chat: dict) -> dict:
+    return {'photo': chat['photo']}
+
+
+SCENARIO = [
+    Step('start', text('/start'), expect_text(WELCOME_TEXT.split('\n')[0])),
+    Step('begin', text(BUTTONS['start']), expect_text('Пришлите фото')),
+    Step('photo', photo, expect_text('Распознанные ингредиенты')),
+    Step('confirm', text(BUTTONS['confirm']), expect_text('Что дальше?')),
+    Step('another', text('🔄 Другой рецепт'), expect_text('Приятного аппетита')),
+    Step('save', text('💾 Сохранить рецепт'), expect_text('Рецепт сохранён')),
+    Step('finish', text('🛑 Завершить готовку'), expect_text('Готовка завершена')),
+]
+
+
+def percentile(samples: list, q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class LoadDriver:
+    """
+    Каждый чат проходит SCENARIO: апдейт уходит POST'ом на /webhook, шаг считается завершённым,
+    когда бот прислал в фейковый Bot API ожидаемый ответ (sendMessage или правку). Задержка шага —
+    от отправки апдейта до этого ответа. Одновременно идут не больше concurrency чатов.
+    """
+
+    def __init__(self, telegram: FakeTelegram, webhook_url: str, chats: int, concurrency: int,
+                 think_ms: float = 0, step_timeout: float = 120, photo_pool: int = 100):
+        self.telegram = telegram
+        self.webhook_url = webhook_url
+        self.chats = chats
+        self.concurrency = concurrency
+        self.think_ms = think_ms
+        self.step_timeout = step_timeout
+        self.photo_pool = max(1, min(photo_pool, chats))
+        self.latencies = defaultdict(list)
+        self.scenario_ms = []
+        self.outcomes = Counter()
+        self._update_id = 0
+        self._photos = {}
+
+    def prepare(self):
+        """Фото генерируются заранее, чтобы не влиять на замер; размер пула задаёт долю попаданий в кэш Vision."""
+        for seed in range(self.photo_pool):
+            self._photos[seed] = self.telegram.add_photo(seed)
+
+    def update(self, chat_id: int, message: dict) -> dict:
+        self._update_id += 1
+        return {'update_id': self._update_id, 'message': {
+            'message_id': self._update_id, 'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': f"load{chat_id - CHAT_ID_BASE}"},
+            **message,
+        }}
+
+    async def step(self, client: httpx.AsyncClient, chat: dict, step: Step) -> bool:
+        chat_id = chat['id']
+        future = self.telegram.expect(chat_id, lambda method, payload: step.done(method, payload) or FAILED(method, payload))
+        started = time.perf_counter()
+        try:
+            resp = await client.post(self.webhook_url, json=self.update(chat_id, step.message(chat)))
+            if resp.status_code != 200:
+                self.outcomes[(step.name, 'http_error')] += 1
+                return False
+            finished, method, payload = await asyncio.wait_for(future, self.step_timeout)
+        except asyncio.TimeoutError:
+            self.outcomes[(step.name, 'timeout')] += 1
+            return False
+        except httpx.HTTPError:
+            self.outcomes[(step.name, 'http_error')] += 1
+            return False
+        finally:
+            self.telegram.forget(chat_id, future)
+        if not step.done(method, payload):
+            self.outcomes[(step.name, 'error')] += 1
+            return False
+        self.outcomes[(step.name, 'ok')] += 1
+        self.latencies[step.name].append((finished - started) * 1000)
+        return True
+
+    async def run_chat(self, client: httpx.AsyncClient, idx: int, limit: asyncio.Semaphore):
+        chat = {'id': CHAT_ID_BASE + idx, 'photo': self._photos[idx % self.photo_pool]}
+        async with limit:
+            started = time.perf_counter()
+            for step in SCENARIO:
+                if not await self.step(client, chat, step):
+                    self.outcomes[('scenario', 'failed')] += 1
+                    return
+                if self.think_ms:
+                    await asyncio.sleep(random.expovariate(1000 / self.think_ms))
+            self.scenario_ms.append((time.perf_counter() - started) * 1000)
+            self.outcomes[('scenario', 'ok')] += 1
+
+    async def run(self) -> float:
+        """Прогоняет все чаты и возвращает длительность прогона в секундах."""
+        limit = asyncio.Semaphore(self.concurrency)
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        async with httpx.AsyncClient(limits=limits, timeout=self.step_timeout) as client:
+            started = time.perf_counter()
+            await asyncio.gather(*(self.run_chat(client, idx, limit) for idx in range(self.chats)))
+            return time.perf_counter() - started
+
+    def interactions(self) -> int:
+        return sum(count for (name, outcome), count in self.outcomes.items() if name != 'scenario' and outcome == 'ok')
+
+    def report(self, elapsed: float) -> list:
+        lines = [f"{'step':<10}{'ok':>7}{'err':>6}{'t/o':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"]
+        everything = []
+        for step in SCENARIO:
+            samples = self.latencies[step.name]
+            everything += samples
+            errors = self.outcomes[(step.name, 'error')] + self.outcomes[(step.name, 'http_error')]
+            lines.append(f"{step.name:<10}{self.outcomes[(step.name, 'ok')]:>7}{errors:>6}{self.outcomes[(step.name, 'timeout')]:>6}"
+                         f"{percentile(samples, .5):10.0f}{percentile(samples, .95):10.0f}{percentile(samples, .99):10.0f}")
+        lines.append(f"{'all steps':<10}{len(everything):>7}{'':>12}"
+                     f"{percentile(everything, .5):10.0f}{percentile(everything, .95):10.0f}{percentile(everything, .99):10.0f}")
+        lines.append(f"{'scenario':<10}{self.outcomes[('scenario', 'ok')]:>7}{self.outcomes[('scenario', 'failed')]:>6}{'':>6}"
+                     f"{percentile(self.scenario_ms, .5):10.0f}{percentile(self.scenario_ms, .95):10.0f}{percentile(self.scenario_ms, .99):10.0f}")
+        lines.append(f"throughput: {self.interactions() / elapsed:.1f} interactions/s, "
+                     f"{self.outcomes[('scenario', 'ok')] / elapsed:.2f} scenarios/s over {elapsed:.1f} s")
+        return lines
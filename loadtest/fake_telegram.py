@@ -0,0 +1,139 @@
+# Фейковый Bot API для нагрузочных прогонов: принимает вызовы бота, записывает их
+# и будит драйвер, когда в чат пришёл ожидаемый ответ. Фото отдаёт по /file/bot{token}/...
+import io
+import time
+import random
+import asyncio
+from collections import Counter, defaultdict
+from typing import Callable
+from fastapi import FastAPI, Request, Response
+from PIL import Image, ImageDraw
+
+# Размеры (большая сторона), которые бот получает в message.photo
+PHOTO_SIDES = (320, 1280)
+
+
+def make_photo(seed: int, side: int) -> bytes:
+    """Похожее на снимок продуктов изображение: фон и цветные пятна, разное для каждого seed."""
+    rnd = random.Random(seed)
+    width, height = side, side * 3 // 4
+    img = Image.new('RGB', (width, height), tuple(rnd.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x, y, r = rnd.randrange(width), rnd.randrange(height), rnd.randrange(side // 20, side // 6)
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=tuple(rnd.randrange(256) for _ in range(3)))
+    out = io.BytesIO()
+    img.save(out, format='JPEG', quality=85)
+    return out.getvalue()
+
+
+class FakeTelegram:
+    """
+    Состояние фейкового Bot API: счётчики вызовов, исходящие сообщения по чатам, фото.
+    Драйвер регистрирует ожидание (chat_id, predicate) и получает первое подходящее сообщение.
+    """
+
+    def __init__(self, latency_ms: float = 0):
+        self.latency_ms = latency_ms
+        self.calls = Counter()
+        self.files = {}
+        self.sent = Counter()
+        self._message_ids = Counter()
+        self._waiters = defaultdict(list)
+
+    def add_photo(self, seed: int) -> list:
+        """Готовит фото в нескольких размерах и возвращает PhotoSize для апдейта."""
+        sizes = []
+        for side in PHOTO_SIDES:
+            data = make_photo(seed, side)
+            file_id = f"photo-{seed}-{side}"
+            self.files[file_id] = data
+            sizes.append({'file_id': file_id, 'file_unique_id': f"u-{seed}-{side}", 'width': side,
+                          'height': side * 3 // 4, 'file_size': len(data)})
+        return sizes
+
+    def expect(self, chat_id, predicate: Callable[[str, dict], bool]) -> asyncio.Future:
+        """Future, которое завершится первым вызовом бота в чат chat_id, подходящим под predicate(method, payload)."""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[chat_id].append((predicate, future))
+        return future
+
+    def forget(self, chat_id, future: asyncio.Future):
+        self._waiters[chat_id] = [(p, f) for p, f in self._waiters[chat_id] if f is not future]
+        if not self._waiters[chat_id]:
+            del self._waiters[chat_id]
+
+    def _deliver(self, chat_id, method: str, payload: dict):
+        waiters = self._waiters.get(chat_id)
+        if not waiters:
+            return
+        for predicate, future in list(waiters):
+            if not future.done() and predicate(method, payload):
+                future.set_result((time.perf_counter(), method, payload))
+
+    def call(self, method: str, payload: dict) -> dict:
+        self.calls[method] += 1
+        chat_id = payload.get('chat_id')
+        if chat_id is not None:
+            chat_id = int(chat_id)
+        if method == 'sendMessage':
+            self._message_ids[chat_id] += 1
+            message_id = self._message_ids[chat_id]
+            self.sent[chat_id] += 1
+            self._deliver(chat_id, method, payload)
+            return {'ok': True, 'result': {'message_id': message_id, 'chat': {'id': chat_id}, 'date': int(time.time()),
+                                           'text': payload.get('text', '')}}
+        if method == 'editMessageText':
+            self._deliver(chat_id, method, payload)
+            return {'ok': True, 'result': {'message_id': payload.get('message_id'), 'chat': {'id': chat_id},
+                                           'text': payload.get('text', '')}}
+        if method == 'getFile':
+            file_id = payload.get('file_id')
+            if file_id not in self.files:
+                return {'ok': False, 'error_code': 400, 'description': 'Bad Request: invalid file_id'}
+            return {'ok': True, 'result': {'file_id': file_id, 'file_unique_id': file_id, 'file_size': len(self.files[file_id]),
+                                           'file_path': f"photos/{file_id}.jpg"}}
+        if method == 'getUpdates':
+            return {'ok': True, 'result': []}
+        return {'ok': True, 'result': True}
+
+    def metrics(self) -> dict:
+        return dict(self.calls)
+
+
+def create_app(telegram: FakeTelegram) -> FastAPI:
+    app = FastAPI()
+
+    async def delay():
+        if telegram.latency_ms:
+            await asyncio.sleep(random.expovariate(1000 / telegram.latency_ms))
+
+    @app.api_route('/bot{token}/{method}', methods=['GET', 'POST'])
+    async def bot_method(token: str, method: str, request: Request):
+        payload = dict(request.query_params)
+        if request.method == 'POST':
+            body = await request.body()
+            if body:
+                payload.update(await request.json())
+        await delay()
+        return telegram.call(method, payload)
+
+    @app.get('/file/bot{token}/photos/{name}')
+    async def file(token: str, name: str):
+        await delay()
+        data = telegram.files.get(name.rsplit('.', 1)[0])
+        if data is None:
+            return Response(status_code=404)
+        telegram.calls['download'] += 1
+        return Response(content=data, media_type='image/jpeg')
+
+    return app
+
+
+def expect_text(*fragments: str, methods=('sendMessage', 'editMessageText')) -> Callable[[str, dict], bool]:
+    """predicate: сообщение или правка, в тексте которой есть один из фрагментов."""
+    def predicate(method: str, payload: dict) -> bool:
+        text = payload.get('text') or ''
+        return method in methods and any(fragment in text for fragment in fragments)
+    return predicate
+
@@ -0,0 +1,149 @@
+# Нагрузочный прогон без сети: фейковый Bot API + FakeBackend вместо Gemini + драйвер чатов.
+#
+# Запуск (бот поднимается сам, нужны локальные Redis и Postgres, например из docker-compose):
+#   python -m loadtest.run --spawn --chats 2000 --concurrency 500
+# Бот уже запущен отдельно (TELEGRAM_API_URL=http://127.0.0.1:8081 LLM_BACKEND=fake uvicorn main:app):
+#   python -m loadtest.run --webhook http://127.0.0.1:8000/webhook --chats 1000
+import os
+import sys
+import json
+import asyncio
+import argparse
+import subprocess
+import httpx
+import uvicorn
+from sqlalchemy import text
+from session_store import session_store
+from database import engine
+from loadtest.fake_telegram import FakeTelegram, create_app
+from loadtest.driver import LoadDriver, CHAT_ID_BASE
+
+DB_COUNTERS_SQL = text(
+    "SELECT xact_commit + xact_rollback AS transactions, tup_returned + tup_fetched AS rows_read, "
+    "tup_inserted + tup_updated + tup_deleted AS rows_written "
+    "FROM pg_stat_database WHERE datname = current_database()"
+)
+DB_STATEMENTS_SQL = text(
+    "SELECT coalesce(sum(calls), 0) FROM pg_stat_statements WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())"
+)
+
+
+async def redis_counters() -> dict:
+    """Число выполненных команд Redis по INFO commandstats (всех клиентов сервера)."""
+    try:
+        stats = await session_store.client().info('commandstats')
+    except Exception as e:
+        print(f"Redis counters unavailable: {e}")
+        return {}
+    return {'commands': sum(cmd.get('calls', 0) for cmd in stats.values())}
+
+
+async def db_counters() -> dict:
+    try:
+        async with engine.connect() as conn:
+            row = (await conn.execute(DB_COUNTERS_SQL)).mappings().first()
+            counters = dict(row) if row else {}
+            try:
+                counters['statements'] = (await conn.execute(DB_STATEMENTS_SQL)).scalar()
+            except Exception:
+                # pg_stat_statements не подключён — считаем только транзакции и строки
+                pass
+            return counters
+    except Exception as e:
+        print(f"DB counters unavailable: {e}")
+        return {}
+
+
+def per_interaction(before: dict, after: dict, interactions: int) -> dict:
+    return {key: round((after[key] - before.get(key, 0)) / max(interactions, 1), 2) for key in after}
+
+
+async def wait_ready(base_url: str, timeout: float = 90):
+    async with httpx.AsyncClient() as client:
+        for _ in range(int(timeout * 4)):
+            try:
+                if (await client.get(f"{base_url}/metrics/llm")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.25)
+    raise RuntimeError(f"бот не ответил на {base_url} за {timeout} с")
+
+
+async def bot_metrics(base_url: str) -> dict:
+    result = {}
+    async with httpx.AsyncClient() as client:
+        for name in ('llm', 'outbound'):
+            try:
+                result[name] = (await client.get(f"{base_url}/metrics/{name}")).json()
+            except Exception:
+                result[name] = None
+    return result
+
+
+async def main(args):
+    telegram = FakeTelegram(latency_ms=args.api_latency_ms)
+    server = uvicorn.Server(uvicorn.Config(create_app(telegram), host='127.0.0.1', port=args.fake_port, log_level='warning'))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    base_url = args.webhook.rsplit('/', 1)[0]
+    bot = None
+    if args.spawn:
+        env = {
+            **os.environ,
+            'TELEGRAM_API_URL': f"http://127.0.0.1:{args.fake_port}",
+            'TELEGRAM_BOT_TOKEN': os.getenv('TELEGRAM_BOT_TOKEN') or 'loadtest:token',
+            'WEBHOOK_URL': args.webhook,
+            'LLM_BACKEND': 'fake',
+            'INGESTION_MODE': 'webhook',
+        }
+        port = args.webhook.split(':')[-1].split('/')[0]
+        bot = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--port', port,
+                                '--log-level', 'warning'], env=env)
+    try:
+        await wait_ready(base_url)
+        driver = LoadDriver(telegram, args.webhook, args.chats, args.concurrency, think_ms=args.think_ms,
+                            step_timeout=args.step_timeout, photo_pool=args.photo_pool)
+        driver.prepare()
+        # Прошлый прогон мог оставить чаты посреди сценария
+        await session_store.connect()
+        for idx in range(args.chats):
+            await session_store.clear_session(CHAT_ID_BASE + idx)
+        redis_before, db_before = await redis_counters(), await db_counters()
+        print(f"Прогон: {args.chats} чатов, одновременно {args.concurrency}, фото в пуле {driver.photo_pool}")
+        elapsed = await driver.run()
+        # pg_stat_database обновляется с задержкой до секунды
+        await asyncio.sleep(1.5)
+        redis_after, db_after = await redis_counters(), await db_counters()
+        interactions = driver.interactions()
+        print('\n'.join(driver.report(elapsed)))
+        if redis_after:
+            print(f"redis per interaction: {per_interaction(redis_before, redis_after, interactions)}")
+        if db_after:
+            print(f"db per interaction: {per_interaction(db_before, db_after, interactions)}")
+        print(f"bot api calls: {json.dumps(telegram.metrics())}")
+        metrics = await bot_metrics(base_url)
+        if metrics.get('llm'):
+            llm = metrics['llm']
+            print(f"llm: calls={llm.get('calls')} avg_latency_ms={llm.get('avg_latency_ms')} single_flight={llm.get('single_flight')}")
+    finally:
+        if bot:
+            bot.terminate()
+            bot.wait()
+        server.should_exit = True
+        await serving
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Нагрузочный прогон бота без сети')
+    parser.add_argument('--chats', type=int, default=1000, help='сколько чатов проходит сценарий')
+    parser.add_argument('--concurrency', type=int, default=200, help='сколько чатов идут одновременно')
+    parser.add_argument('--webhook', default='http://127.0.0.1:8000/webhook')
+    parser.add_argument('--spawn', action='store_true', help='запустить бота (uvicorn main:app) с фейковыми Telegram и Gemini')
+    parser.add_argument('--fake-port', type=int, default=8081, help='порт фейкового Bot API')
+    parser.add_argument('--api-latency-ms', type=float, default=0, help='средняя задержка ответа фейкового Bot API')
+    parser.add_argument('--think-ms', type=float, default=0, help='средняя пауза пользователя между шагами')
+    parser.add_argument('--step-timeout', type=float, default=120)
+    parser.add_argument('--photo-pool', type=int, default=100, help='сколько разных фото; меньше — больше попаданий в кэши')
+    asyncio.run(main(parser.parse_args()))
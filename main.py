@@ -2,8 +2,25 @@ import os
 import logging
 from fastapi import FastAPI, Request, BackgroundTasks
 from dotenv import load_dotenv
-from telegram_service import handle_update
-import httpx
+from telegram_service import process_update
+from update_queue import enqueue_update
+from telegram_client import telegram_client
+from outbound_dispatcher import outbound_dispatcher
+from recipe_cache import recipe_cache
+from vision_cache import vision_cache
+from image_preprocessing import image_preprocessor
+from file_path_cache import file_path_cache
+from user_resolver import user_resolver
+from preferences_cache import preferences_cache
+from chat_executor import chat_executor
+from session_store import session_store
+from redis_scripts import script_registry
+from ingredient_normalizer import ingredient_normalizer
+from ingredient_autocomplete import ingredient_autocomplete
+from llm_gateway import llm_gateway
+from single_flight import single_flight
+from media_group import media_group_collector
+from recipe_prefetch import recipe_prefetch
 import subprocess
 from database import get_async_session
 
@@ -11,6 +28,10 @@ load_dotenv()
 
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+# background — обработка в процессе веб-сервера, stream — через Redis Stream и worker.py
+UPDATE_QUEUE_MODE = os.getenv('UPDATE_QUEUE_MODE', 'background')
+# webhook — апдейты приходят на /webhook; polling — их забирает poller.py, вебхук не ставим
+INGESTION_MODE = os.getenv('INGESTION_MODE', 'webhook')
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -21,11 +42,47 @@ app = FastAPI()
 async def startup():
     # Автоматически применяем миграции Alembic
     subprocess.run(["alembic", "upgrade", "head"])
+    # Redis подключаем один раз, Lua-скрипты загружаем заранее (дальше — только EVALSHA).
+    # Без Redis приложение всё равно стартует: скрипты загрузятся при первом вызове (NOSCRIPT)
+    try:
+        await session_store.connect()
+        await script_registry.load()
+        await session_store.start_near_cache()
+    except Exception as e:
+        logger.error(f"Redis startup error: {e}")
+    # Поднимаем общий пул соединений к Bot API
+    await telegram_client.start()
+    await outbound_dispatcher.start()
+    if INGESTION_MODE == 'polling':
+        logger.info('INGESTION_MODE=polling: вебхук не ставим, апдейты забирает poller.py')
+        return
     # Ставим вебхук
-    url = f'https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/setWebhook'
-    async with httpx.AsyncClient() as client:
-        r = await client.post(url, json={'url': WEBHOOK_URL})
-        logger.info(f'Webhook set: {r.text}')
+    r = await telegram_client.post('setWebhook', {'url': WEBHOOK_URL})
+    logger.info(f'Webhook set: {r.text}')
+
+@app.on_event('shutdown')
+async def shutdown():
+    await session_store.stop_near_cache()
+    await outbound_dispatcher.stop()
+    await telegram_client.close()
+
+@app.get('/metrics/outbound')
+async def outbound_metrics():
+    return outbound_dispatcher.metrics()
+
+@app.get('/metrics/chats')
+async def chat_metrics():
+    return chat_executor.metrics()
+
+@app.get('/metrics/llm')
+async def llm_metrics():
+    return {**llm_gateway.metrics(), 'single_flight': single_flight.metrics(), 'prefetch': recipe_prefetch.metrics()}
+
+@app.get('/metrics/cache')
+async def cache_metrics():
+    return {'recipes': recipe_cache.metrics(), 'vision': dict(vision_cache.stats), 'images': image_preprocessor.metrics(), 'file_paths': file_path_cache.metrics(), 'users': user_resolver.metrics(), 'preferences': preferences_cache.metrics(), 'scripts': dict(script_registry.stats),
+            'sessions': session_store.near_cache.metrics() if session_store.near_cache else None, 'ingredients': ingredient_normalizer.metrics(),
+            'autocomplete': ingredient_autocomplete.metrics(), 'albums': media_group_collector.metrics()}
 
 @app.post('/webhook')
 async def telegram_webhook(request: Request, background_tasks: BackgroundTasks):
@@ -33,9 +90,12 @@ async def telegram_webhook(request: Request, background_tasks: BackgroundTasks):
     logger.info(">>> /webhook endpoint called")
     update = await request.json()
     logger.info(f'Update: {update}')
-    if 'callback_query' in update:
-        from telegram_service import handle_callback_query
-        background_tasks.add_task(handle_callback_query, update['callback_query'])
-    else:
-        background_tasks.add_task(handle_update, update)
+    if UPDATE_QUEUE_MODE == 'stream':
+        # Обработку выполняют воркеры (worker.py); здесь только надёжно сохраняем апдейт
+        try:
+            await enqueue_update(update)
+            return {"ok": True}
+        except Exception as e:
+            logger.error(f'Не удалось поставить апдейт в очередь, обрабатываем локально: {e}')
+    background_tasks.add_task(process_update, update)
     return {"ok": True} 
\ No newline at end of file
@@ -0,0 +1,102 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+from collections import Counter
+from typing import Optional
+from dotenv import load_dotenv
+from session_store import session_store
+
+load_dotenv()
+
+# Альбом считается собранным, если за столько секунд не пришло ни одной новой части
+MEDIA_GROUP_WINDOW = float(os.getenv('MEDIA_GROUP_WINDOW', 0.8))
+# Дольше этого альбом не ждём, даже если части продолжают приходить
+MEDIA_GROUP_MAX_WAIT = float(os.getenv('MEDIA_GROUP_MAX_WAIT', 5))
+# В альбоме Telegram не больше 10 элементов
+MEDIA_GROUP_MAX_PARTS = 10
+MEDIA_GROUP_KEY_TTL_MS = 60000
+
+logger = logging.getLogger(__name__)
+
+
+def media_group_id_of(update: dict) -> Optional[str]:
+    message = update.get('message')
+    return message.get('media_group_id') if message else None
+
+
+def merge_media_group(parts: list) -> dict:
+    """Склеивает апдейты альбома в один: message первой части, все фото — в message['album']."""
+    parts = sorted(parts, key=lambda u: u['message'].get('message_id', 0))
+    message = dict(parts[0]['message'])
+    message['album'] = [p['message']['photo'] for p in parts if p['message'].get('photo')]
+    if message['album']:
+        message['photo'] = message['album'][0]
+    caption = next((p['message']['caption'] for p in parts if p['message'].get('caption')), None)
+    if caption:
+        message['caption'] = caption
+    return {**parts[0], 'message': message}
+
+
+class MediaGroupCollector:
+    """
+    Сборка альбомов: части одного media_group_id складываются в список Redis, первая часть
+    становится владельцем (SET NX) и ждёт, пока части перестанут приходить, остальные сразу
+    завершаются. Владелец возвращает один склеенный апдейт — одна обработка, один вызов Vision, один ответ.
+    Через Redis части собираются, даже если попали в разные процессы worker.py.
+    """
+
+    def __init__(self, window: float = MEDIA_GROUP_WINDOW, max_wait: float = MEDIA_GROUP_MAX_WAIT):
+        self.window = window
+        self.max_wait = max_wait
+        self.stats = Counter()
+
+    async def collect(self, update: dict) -> Optional[dict]:
+        """Склеенный альбом для владельца, None для остальных частей.
+        Если Redis недоступен, часть обрабатывается отдельно, как раньше."""
+        message = update['message']
+        key = f"media_group:{message['chat']['id']}:{message['media_group_id']}"
+        owner_key = f"{key}:owner"
+        try:
+            await session_store.connect()
+            async with session_store.redis.pipeline(transaction=True) as pipe:
+                pipe.rpush(key, json.dumps(update, ensure_ascii=False))
+                pipe.pexpire(key, MEDIA_GROUP_KEY_TTL_MS)
+                pipe.set(owner_key, uuid.uuid4().hex, nx=True, px=MEDIA_GROUP_KEY_TTL_MS)
+                seen, _, owner = await pipe.execute()
+        except Exception as e:
+            logger.error(f"Redis media group error: {e}")
+            self.stats['fallback'] += 1
+            return update
+        if not owner:
+            self.stats['absorbed'] += 1
+            return None
+        deadline = time.monotonic() + self.max_wait
+        try:
+            while seen < MEDIA_GROUP_MAX_PARTS and time.monotonic() < deadline:
+                await asyncio.sleep(self.window)
+                count = await session_store.redis.llen(key)
+                if count == seen:
+                    break
+                seen = count
+            async with session_store.redis.pipeline(transaction=True) as pipe:
+                pipe.lrange(key, 0, -1)
+                pipe.delete(key, owner_key)
+                raw, _ = await pipe.execute()
+        except Exception as e:
+            logger.error(f"Redis media group error: {e}")
+            self.stats['fallback'] += 1
+            return update
+        parts = [json.loads(item) for item in raw] or [update]
+        self.stats['groups'] += 1
+        self.stats['parts'] += len(parts)
+        logger.info(f"[ALBUM] {key}: собрано частей: {len(parts)}")
+        return merge_media_group(parts)
+
+    def metrics(self) -> dict:
+        return dict(self.stats)
+
+
+media_group_collector = MediaGroupCollector()
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, func, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, func, Boolean, Numeric, Index
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from database import Base
 
@@ -17,8 +18,23 @@ class RecipeHistory(Base):
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     ingredients = Column(Text, nullable=False)
     recipe = Column(Text, nullable=False)
+    title = Column(String, nullable=True)
+    difficulty = Column(String, nullable=True)
+    recipe_ingredients = Column(JSONB, nullable=True)
+    calories_100g = Column(Numeric, nullable=True)
+    protein_100g = Column(Numeric, nullable=True)
+    fat_100g = Column(Numeric, nullable=True)
+    carbs_100g = Column(Numeric, nullable=True)
+    calories_portion = Column(Numeric, nullable=True)
+    protein_portion = Column(Numeric, nullable=True)
+    fat_portion = Column(Numeric, nullable=True)
+    carbs_portion = Column(Numeric, nullable=True)
     created_at = Column(DateTime, server_default=func.now())
     user = relationship('User', back_populates='recipes')
+    # Под keyset-пагинацию «Сохранённых»: WHERE user_id = ? AND (created_at, id) < (?, ?)
+    __table_args__ = (
+        Index('ix_recipe_history_user_created', user_id, created_at.desc(), id.desc()),
+    )
 
 class UserPreferences(Base):
     __tablename__ = 'user_preferences'
@@ -26,4 +42,5 @@ class UserPreferences(Base):
     user_id = Column(Integer, ForeignKey('users.id'), unique=True, nullable=False)
     healthy_profile = Column(Boolean, default=False)
     preferred_cuisine = Column(String, default='Любая')
+    difficulty = Column(String, nullable=True)
     user = relationship('User', back_populates='preferences') 
\ No newline at end of file
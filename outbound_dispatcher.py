@@ -0,0 +1,279 @@
+import os
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Optional
+import httpx
+from dotenv import load_dotenv
+from telegram_client import telegram_client
+
+load_dotenv()
+
+# Лимиты Telegram: ~30 сообщений/с на бота и ~1 сообщение/с в один чат
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', 30))
+TELEGRAM_CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', 1))
+TELEGRAM_CHAT_BURST = float(os.getenv('TELEGRAM_CHAT_BURST', 3))
+TELEGRAM_MAX_RETRIES = int(os.getenv('TELEGRAM_MAX_RETRIES', 5))
+# 429 с таким retry_after (или 429 в разные чаты подряд) — это лимит на бота: останавливается вся отправка
+TELEGRAM_GLOBAL_BLOCK_AFTER = float(os.getenv('TELEGRAM_GLOBAL_BLOCK_AFTER', 10))
+# Окно, в котором 429 в два разных чата считаются общим лимитом, секунды
+GLOBAL_429_WINDOW = 1.0
+
+# Меньше — раньше: ответы с рецептом идут перед служебными уведомлениями
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+PRIORITY_NAMES = {PRIORITY_HIGH: 'high', PRIORITY_NORMAL: 'normal', PRIORITY_LOW: 'low'}
+
+CHAT_BUCKETS_SOFT_LIMIT = 1024
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Сколько секунд ждать до появления токена (0 — можно отправлять)."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, seconds: float):
+        """Блокирует отправку на retry_after секунд после ответа 429."""
+        now = time.monotonic()
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0
+        self.updated = now
+
+    def idle(self, now: float) -> bool:
+        return now >= self.blocked_until and now - self.updated >= self.capacity / self.rate
+
+
+class DispatcherStopped(Exception):
+    """Диспетчер остановлен раньше, чем сообщение было отправлено."""
+
+
+@dataclass(order=True)
+class OutboundMessage:
+    priority: int
+    seq: int
+    chat_id: int = field(compare=False)
+    method: str = field(compare=False)
+    payload: dict = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    attempts: int = field(default=0, compare=False)
+
+
+class OutboundDispatcher:
+    """Очередь исходящих вызовов Bot API с приоритетами, лимитами и повтором 429."""
+
+    def __init__(self):
+        self._heap = []
+        self._seq = itertools.count()
+        self._global = TokenBucket(TELEGRAM_GLOBAL_RATE, TELEGRAM_GLOBAL_RATE)
+        self._chats = {}
+        self._busy_chats = set()
+        self._inflight = set()
+        self._last_429 = (None, 0.0)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats = Counter()
+
+    async def start(self):
+        if self._task and not self._task.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Outbound dispatcher started (global={TELEGRAM_GLOBAL_RATE}/s, chat={TELEGRAM_CHAT_RATE}/s)")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        inflight = list(self._inflight)
+        for task in inflight:
+            task.cancel()
+        await asyncio.gather(*inflight, return_exceptions=True)
+        # Кто ещё ждёт ответа на send_message, получает ошибку, а не висит вечно
+        stopped = DispatcherStopped('outbound dispatcher stopped')
+        for msg in self._heap:
+            if not msg.future.done():
+                msg.future.set_exception(stopped)
+        self._heap.clear()
+        logger.info("Outbound dispatcher stopped")
+
+    async def submit(self, chat_id, method: str, payload: dict, priority: int = PRIORITY_NORMAL, wait: bool = True) -> Optional[dict]:
+        """Ставит вызов в очередь; при wait=True ждёт ответ Telegram."""
+        await self.start()
+        if priority == PRIORITY_HIGH:
+            self._supersede_low(chat_id)
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, OutboundMessage(priority, next(self._seq), chat_id, method, payload, future))
+        self.stats['queued'] += 1
+        self._wakeup.set()
+        if not wait:
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            return None
+        return await future
+
+    def _supersede_low(self, chat_id):
+        # Уведомление «Думаю…», которое ещё не ушло, после готового ответа уже не нужно
+        for msg in self._heap:
+            if msg.chat_id == chat_id and msg.priority == PRIORITY_LOW and not msg.future.done():
+                msg.future.cancel()
+                self.stats['superseded'] += 1
+
+    def metrics(self) -> dict:
+        depth = Counter(PRIORITY_NAMES.get(m.priority, str(m.priority)) for m in self._heap)
+        return {
+            'queue_depth': len(self._heap),
+            'queue_depth_by_priority': {name: depth.get(name, 0) for name in PRIORITY_NAMES.values()},
+            'in_flight': len(self._inflight),
+            'chats_tracked': len(self._chats),
+            **self.stats,
+        }
+
+    def _block_global(self, chat_id, retry_after: float):
+        """Telegram не говорит, какой лимит превышен. Долгий retry_after или 429 сразу в нескольких
+        чатах — признак лимита на бота: тогда ждут все чаты, а не только этот."""
+        now = time.monotonic()
+        last_chat, last_at = self._last_429
+        self._last_429 = (chat_id, now)
+        if retry_after >= TELEGRAM_GLOBAL_BLOCK_AFTER or (last_chat != chat_id and now - last_at <= GLOBAL_429_WINDOW):
+            self._global.block(retry_after)
+            self.stats['global_blocks'] += 1
+            logger.warning(f"[OUTBOUND] Лимит на бота: вся отправка приостановлена на {retry_after} с")
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST)
+        return bucket
+
+    def _prune_buckets(self, now: float):
+        if len(self._chats) <= CHAT_BUCKETS_SOFT_LIMIT:
+            return
+        for chat_id in [c for c, b in self._chats.items() if c not in self._busy_chats and b.idle(now)]:
+            del self._chats[chat_id]
+
+    def _dispatch_ready(self) -> Optional[float]:
+        """Отправляет всё, что разрешают лимиты; возвращает время до следующей попытки."""
+        now = time.monotonic()
+        skipped = []
+        wait = None
+        while self._heap:
+            global_delay = self._global.delay(now)
+            if global_delay > 0:
+                wait = global_delay
+                break
+            msg = heapq.heappop(self._heap)
+            if msg.future.done():
+                continue
+            if msg.chat_id in self._busy_chats:
+                # Не больше одного запроса в чат одновременно — сохраняем порядок сообщений
+                skipped.append(msg)
+                continue
+            bucket = self._chat_bucket(msg.chat_id)
+            chat_delay = bucket.delay(now)
+            if chat_delay > 0:
+                skipped.append(msg)
+                wait = chat_delay if wait is None else min(wait, chat_delay)
+                continue
+            self._global.take(now)
+            bucket.take(now)
+            self._busy_chats.add(msg.chat_id)
+            task = asyncio.create_task(self._send(msg))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+        for msg in skipped:
+            heapq.heappush(self._heap, msg)
+        self._prune_buckets(now)
+        return wait
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            wait = self._dispatch_ready()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _send(self, msg: OutboundMessage):
+        retry_after = None
+        try:
+            resp = await telegram_client.post(msg.method, msg.payload)
+            data = resp.json()
+            if resp.status_code == 429 or data.get('error_code') == 429:
+                retry_after = float((data.get('parameters') or {}).get('retry_after', 1))
+                logger.warning(f"[OUTBOUND] 429 для чата {msg.chat_id}, повтор через {retry_after} с")
+            else:
+                if not data.get('ok'):
+                    self.stats['failed'] += 1
+                    logger.error(f"[OUTBOUND] {msg.method} для чата {msg.chat_id}: {data}")
+                else:
+                    self.stats['sent'] += 1
+                if not msg.future.done():
+                    msg.future.set_result(data)
+                return
+        except (httpx.TransportError, ValueError) as e:
+            retry_after = 1.0
+            logger.warning(f"[OUTBOUND] Ошибка отправки в чат {msg.chat_id}: {e}")
+            if msg.attempts + 1 > TELEGRAM_MAX_RETRIES and not msg.future.done():
+                self.stats['failed'] += 1
+                msg.future.set_exception(e)
+                return
+        except asyncio.CancelledError:
+            # Диспетчер останавливается: вызов прерван, ждущий получает ошибку
+            if not msg.future.done():
+                msg.future.set_exception(DispatcherStopped('outbound dispatcher stopped'))
+            raise
+        except Exception as e:
+            self.stats['failed'] += 1
+            logger.error(f"[OUTBOUND] {msg.method} для чата {msg.chat_id}: {e}")
+            if not msg.future.done():
+                msg.future.set_exception(e)
+            return
+        finally:
+            self._busy_chats.discard(msg.chat_id)
+            if retry_after is not None and not msg.future.done():
+                msg.attempts += 1
+                if msg.attempts > TELEGRAM_MAX_RETRIES:
+                    self.stats['failed'] += 1
+                    msg.future.set_result({'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retries exhausted'})
+                else:
+                    self.stats['retried'] += 1
+                    self._chat_bucket(msg.chat_id).block(retry_after)
+                    self._block_global(msg.chat_id, retry_after)
+                    heapq.heappush(self._heap, msg)
+            self._wakeup.set()
+
+
+outbound_dispatcher = OutboundDispatcher()
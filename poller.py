@@ -0,0 +1,181 @@
+# Приём апдейтов long polling'ом (getUpdates) вместо вебхука: не нужен публичный адрес,
+# и после простоя накопившиеся апдейты выбираются пачками по 100.
+# Запуск: INGESTION_MODE=polling python poller.py  (один процесс на бота — так требует Telegram)
+import os
+import json
+import signal
+import asyncio
+import logging
+from collections import Counter
+from typing import Optional
+from dotenv import load_dotenv
+from session_store import session_store
+from redis_scripts import script_registry
+from telegram_client import telegram_client
+from outbound_dispatcher import outbound_dispatcher
+from telegram_service import process_update
+from update_queue import enqueue_update
+
+load_dotenv()
+
+# webhook — апдейты приходят на /webhook (main.py); polling — их забирает poller.py
+INGESTION_MODE = os.getenv('INGESTION_MODE', 'webhook')
+UPDATE_QUEUE_MODE = os.getenv('UPDATE_QUEUE_MODE', 'background')
+# Сколько апдейтов за один getUpdates (Telegram отдаёт не больше 100)
+POLL_BATCH_SIZE = min(int(os.getenv('POLL_BATCH_SIZE', 100)), 100)
+# Сколько секунд Telegram держит запрос, если апдейтов нет
+POLL_TIMEOUT = int(os.getenv('POLL_TIMEOUT', 30))
+# Не больше стольких апдейтов в обработке одновременно; дальше новые не забираем
+POLL_MAX_INFLIGHT = int(os.getenv('POLL_MAX_INFLIGHT', 1000))
+POLL_OFFSET_KEY = os.getenv('POLL_OFFSET_KEY', 'telegram:poll_offset')
+POLL_MAX_BACKOFF = 30
+ALLOWED_UPDATES = ['message', 'callback_query', 'inline_query']
+
+logger = logging.getLogger(__name__)
+
+
+class UpdatePoller:
+    """
+    Цикл getUpdates: каждая пачка раздаётся на обработку сразу, не дожидаясь предыдущей.
+    Апдейты одного чата выполняются по порядку — process_update ставит их в очередь chat_executor
+    в порядке update_id, разные чаты идут параллельно. При UPDATE_QUEUE_MODE=stream пачка только
+    дописывается в Redis Stream, а обрабатывают её воркеры (worker.py).
+
+    Offset хранится в Redis: вызов getUpdates с offset подтверждает Telegram всё, что было до него,
+    поэтому после перезапуска (или переезда на другой хост) уже полученные апдейты не повторяются.
+    """
+
+    def __init__(self, batch_size: int = POLL_BATCH_SIZE, timeout: int = POLL_TIMEOUT, max_inflight: int = POLL_MAX_INFLIGHT):
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.max_inflight = max_inflight
+        self.offset: Optional[int] = None
+        self.stats = Counter()
+        self._inflight = set()
+        self._fetching: Optional[asyncio.Task] = None
+        self._stopping: Optional[asyncio.Event] = None
+
+    async def load_offset(self):
+        raw = await session_store.redis.get(POLL_OFFSET_KEY)
+        self.offset = int(raw) if raw else None
+        logger.info(f"[POLL] Продолжаем с offset {self.offset}")
+
+    async def save_offset(self):
+        try:
+            await session_store.redis.set(POLL_OFFSET_KEY, self.offset)
+        except Exception as e:
+            logger.error(f"Redis poll offset save error: {e}")
+
+    async def fetch(self) -> list:
+        payload = {'limit': self.batch_size, 'timeout': self.timeout, 'allowed_updates': ALLOWED_UPDATES}
+        if self.offset is not None:
+            payload['offset'] = self.offset
+        # Ответ на long poll приходит не раньше чем через timeout секунд — читаем с запасом
+        r = await telegram_client.post('getUpdates', payload, timeout=self.timeout + 10)
+        body = r.json()
+        if not body.get('ok'):
+            raise RuntimeError(f"getUpdates {r.status_code}: {body.get('description')}")
+        return body['result']
+
+    async def handle(self, update: dict):
+        try:
+            await process_update(update)
+            self.stats['processed'] += 1
+        except Exception as e:
+            self.stats['failed'] += 1
+            logger.exception(f"[POLL] Не удалось обработать апдейт {update.get('update_id')}: {e}")
+
+    async def dispatch(self, updates: list):
+        if UPDATE_QUEUE_MODE == 'stream':
+            # Пачка сохраняется до того, как следующий getUpdates подтвердит её Telegram
+            for update in updates:
+                await enqueue_update(update)
+            self.stats['enqueued'] += len(updates)
+            return
+        for update in updates:
+            # Задачи стартуют в порядке создания, значит и в очередь чата апдейты встают по порядку
+            task = asyncio.create_task(self.handle(update))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def wait_for_capacity(self):
+        while len(self._inflight) >= self.max_inflight:
+            self.stats['throttled'] += 1
+            await asyncio.wait(self._inflight, return_when=asyncio.FIRST_COMPLETED)
+
+    async def poll(self):
+        backoff = 1
+        while not self._stopping.is_set():
+            await self.wait_for_capacity()
+            if self._stopping.is_set():
+                return
+            self._fetching = asyncio.ensure_future(self.fetch())
+            try:
+                updates = await self._fetching
+            except asyncio.CancelledError:
+                if self._stopping.is_set():
+                    return
+                raise
+            except Exception as e:
+                # 409 — вебхук ещё стоит или запущен второй poller
+                logger.error(f"[POLL] getUpdates error: {e}")
+                self.stats['errors'] += 1
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=backoff)
+                except asyncio.TimeoutError:
+                    pass
+                backoff = min(backoff * 2, POLL_MAX_BACKOFF)
+                continue
+            backoff = 1
+            self.stats['polls'] += 1
+            updates = [u for u in updates if self.offset is None or u['update_id'] >= self.offset]
+            if not updates:
+                continue
+            await self.dispatch(updates)
+            self.stats['updates'] += len(updates)
+            self.offset = updates[-1]['update_id'] + 1
+            await self.save_offset()
+            logger.info(f"[POLL] Получено апдейтов: {len(updates)}, в обработке: {len(self._inflight)}, offset {self.offset}")
+
+    async def run(self):
+        if INGESTION_MODE != 'polling':
+            logger.error("[POLL] INGESTION_MODE не polling — poller снял бы вебхук, не запускаемся")
+            return
+        self._stopping = asyncio.Event()
+        await session_store.connect()
+        await script_registry.load()
+        await session_store.start_near_cache()
+        await telegram_client.start()
+        await outbound_dispatcher.start()
+        # Пока стоит вебхук, getUpdates отвечает 409; накопившиеся апдейты не сбрасываем
+        r = await telegram_client.post('deleteWebhook', {'drop_pending_updates': False})
+        logger.info(f"[POLL] deleteWebhook: {r.text}")
+        await self.load_offset()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self._stopping.set)
+            except NotImplementedError:
+                pass
+        logger.info(f"[POLL] Запущен: пачка {self.batch_size}, long poll {self.timeout} с, очередь {UPDATE_QUEUE_MODE}")
+        poll = asyncio.create_task(self.poll())
+        await self._stopping.wait()
+        # Текущий long poll не ждём: апдейты из него ещё не подтверждены и придут при следующем запуске.
+        # Уже полученную пачку poll() доводит до конца и сохраняет offset
+        if self._fetching and not self._fetching.done():
+            self._fetching.cancel()
+        logger.info(f"[POLL] Останавливается, дожидаемся {len(self._inflight)} апдейтов…")
+        await asyncio.gather(poll, return_exceptions=True)
+        await asyncio.gather(*self._inflight, return_exceptions=True)
+        logger.info(f"[POLL] Итог: {json.dumps(self.metrics())}")
+        await outbound_dispatcher.stop()
+        await telegram_client.close()
+        await session_store.stop_near_cache()
+
+    def metrics(self) -> dict:
+        return {'offset': self.offset, 'inflight': len(self._inflight), **self.stats}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(UpdatePoller().run())
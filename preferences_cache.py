@@ -0,0 +1,98 @@
+import os
+import json
+import time
+import logging
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+from dotenv import load_dotenv
+from session_store import session_store
+
+load_dotenv()
+
+PREFERENCES_CACHE_TTL = int(os.getenv('PREFERENCES_CACHE_TTL', 86400))
+PREFERENCES_CACHE_LOCAL_TTL = int(os.getenv('PREFERENCES_CACHE_LOCAL_TTL', 60))
+PREFERENCES_CACHE_LOCAL_SIZE = int(os.getenv('PREFERENCES_CACHE_LOCAL_SIZE', 10000))
+
+CUISINE_OPTIONS = ["Любая", "Европейская", "Азиатская", "Мексиканская", "Восточная", "Индийская"]
+DIFFICULTY_OPTIONS = ["Любая", "Простые", "Средние", "Сложные"]
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Preferences:
+    """Настройки пользователя, уже приведённые к допустимым значениям."""
+    healthy_profile: bool = False
+    preferred_cuisine: str = 'Любая'
+    difficulty: str = 'Любая'
+
+    @classmethod
+    def resolve(cls, healthy_profile, preferred_cuisine, difficulty) -> 'Preferences':
+        return cls(
+            healthy_profile=bool(healthy_profile),
+            preferred_cuisine=preferred_cuisine if preferred_cuisine in CUISINE_OPTIONS else 'Любая',
+            difficulty=difficulty if difficulty in DIFFICULTY_OPTIONS else 'Любая',
+        )
+
+    def dumps(self) -> str:
+        # Компактно: [1, "Любая", "Средние"]
+        return json.dumps([int(self.healthy_profile), self.preferred_cuisine, self.difficulty], ensure_ascii=False)
+
+    @classmethod
+    def loads(cls, raw: str) -> 'Preferences':
+        return cls.resolve(*json.loads(raw))
+
+
+class PreferencesCache:
+    """Настройки по user_id: короткоживущий LRU в процессе + Redis; обновляется при записи."""
+
+    def __init__(self, max_size: int = PREFERENCES_CACHE_LOCAL_SIZE, ttl: int = PREFERENCES_CACHE_TTL, local_ttl: int = PREFERENCES_CACHE_LOCAL_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self.local = OrderedDict()
+        self.stats = Counter()
+
+    def _local_set(self, user_id: int, prefs: Preferences):
+        self.local[user_id] = (time.monotonic() + self.local_ttl, prefs)
+        self.local.move_to_end(user_id)
+        while len(self.local) > self.max_size:
+            self.local.popitem(last=False)
+
+    async def get(self, user_id: int) -> Optional[Preferences]:
+        entry = self.local.get(user_id)
+        if entry is not None:
+            expires_at, prefs = entry
+            if expires_at >= time.monotonic():
+                self.local.move_to_end(user_id)
+                self.stats['local_hits'] += 1
+                return prefs
+            del self.local[user_id]
+        try:
+            await session_store.connect()
+            raw = await session_store.redis.get(f"prefs:{user_id}")
+        except Exception as e:
+            logger.error(f"Redis preferences cache get error: {e}")
+            raw = None
+        if raw:
+            prefs = Preferences.loads(raw)
+            self._local_set(user_id, prefs)
+            self.stats['redis_hits'] += 1
+            return prefs
+        self.stats['misses'] += 1
+        return None
+
+    async def set(self, user_id: int, prefs: Preferences):
+        self._local_set(user_id, prefs)
+        try:
+            await session_store.connect()
+            await session_store.redis.set(f"prefs:{user_id}", prefs.dumps(), ex=self.ttl)
+        except Exception as e:
+            logger.error(f"Redis preferences cache set error: {e}")
+
+    def metrics(self) -> dict:
+        return {'local_size': len(self.local), **self.stats}
+
+
+preferences_cache = PreferencesCache()
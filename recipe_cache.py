@@ -0,0 +1,118 @@
+import os
+import json
+import time
+import hashlib
+import logging
+from collections import Counter, OrderedDict
+from typing import List, Optional
+from dotenv import load_dotenv
+from session_store import session_store
+
+load_dotenv()
+
+RECIPE_CACHE_TTL = int(os.getenv('RECIPE_CACHE_TTL', 3600))
+RECIPE_CACHE_LOCAL_SIZE = int(os.getenv('RECIPE_CACHE_LOCAL_SIZE', 1024))
+# Сколько разных рецептов храним на один набор ингредиентов для «🔄 Другой рецепт»
+RECIPE_CACHE_VARIANTS = int(os.getenv('RECIPE_CACHE_VARIANTS', 3))
+
+logger = logging.getLogger(__name__)
+
+
+def make_recipe_key(
+    ingredients: List[str],
+    healthy_profile: bool = False,
+    preferred_cuisine: Optional[str] = None,
+    temp_difficulty: Optional[str] = None,
+    query: Optional[str] = None,
+    structured: bool = False
+) -> str:
+    """Ключ кэша: отсортированные нормализованные ингредиенты + настройки генерации.
+    structured — в кэше лежит JSON рецепта (RECIPE_JSON_MODE), а не готовый текст."""
+    normalized = sorted({i.strip().lower() for i in ingredients or [] if i and i.strip()})
+    parts = [normalized, bool(healthy_profile), preferred_cuisine or 'Любая', temp_difficulty or '', (query or '').strip().lower()]
+    if structured:
+        parts.append('json')
+    raw = json.dumps(parts, ensure_ascii=False)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+class RecipeCache:
+    """Двухуровневый кэш рецептов: LRU в процессе + Redis, несколько вариантов на ключ."""
+
+    def __init__(self, max_size: int = RECIPE_CACHE_LOCAL_SIZE, ttl: int = RECIPE_CACHE_TTL, variants: int = RECIPE_CACHE_VARIANTS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.variants = variants
+        self.local = OrderedDict()
+        self.stats = Counter()
+
+    def _local_get(self, key: str) -> Optional[list]:
+        entry = self.local.get(key)
+        if entry is None:
+            return None
+        expires_at, variants = entry
+        if expires_at < time.monotonic():
+            del self.local[key]
+            self.stats['expired'] += 1
+            return None
+        self.local.move_to_end(key)
+        return variants
+
+    def _local_set(self, key: str, variants: list):
+        self.local[key] = (time.monotonic() + self.ttl, variants)
+        self.local.move_to_end(key)
+        while len(self.local) > self.max_size:
+            self.local.popitem(last=False)
+            self.stats['evicted'] += 1
+
+    async def get_variant(self, key: str, index: int = 0) -> Optional[str]:
+        """Возвращает закэшированный вариант рецепта с номером index или None."""
+        variants = self._local_get(key)
+        if variants is not None and index < len(variants):
+            self.stats['local_hits'] += 1
+            return variants[index]
+        try:
+            await session_store.connect()
+            variants = await session_store.redis.lrange(f"recipe_cache:{key}", 0, self.variants - 1)
+        except Exception as e:
+            logger.error(f"Redis recipe cache get error: {e}")
+            variants = []
+        if variants:
+            self._local_set(key, variants)
+            if index < len(variants):
+                self.stats['redis_hits'] += 1
+                return variants[index]
+        self.stats['misses'] += 1
+        return None
+
+    async def add_variant(self, key: str, recipe_text: str):
+        """Добавляет новый вариант, если для ключа ещё не набрано RECIPE_CACHE_VARIANTS."""
+        variants = list(self._local_get(key) or [])
+        if len(variants) >= self.variants:
+            return
+        try:
+            await session_store.connect()
+            redis_key = f"recipe_cache:{key}"
+            async with session_store.redis.pipeline(transaction=True) as pipe:
+                pipe.rpush(redis_key, recipe_text)
+                pipe.ltrim(redis_key, 0, self.variants - 1)
+                pipe.expire(redis_key, self.ttl)
+                pipe.lrange(redis_key, 0, -1)
+                *_, variants = await pipe.execute()
+        except Exception as e:
+            logger.error(f"Redis recipe cache set error: {e}")
+            variants.append(recipe_text)
+        self._local_set(key, variants[:self.variants])
+        self.stats['stored'] += 1
+
+    def metrics(self) -> dict:
+        lookups = self.stats['local_hits'] + self.stats['redis_hits'] + self.stats['misses']
+        hits = self.stats['local_hits'] + self.stats['redis_hits']
+        return {
+            'local_size': len(self.local),
+            'hit_ratio': round(hits / lookups, 3) if lookups else 0.0,
+            **self.stats,
+        }
+
+
+recipe_cache = RecipeCache()
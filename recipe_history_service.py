@@ -1,24 +1,75 @@
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+from sqlalchemy import tuple_
 from sqlalchemy.future import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from models import RecipeHistory
+from recipe_schema import Recipe
 
-async def add_recipe_history(session: AsyncSession, user_id: int, ingredients: str, recipe: str) -> RecipeHistory:
-    entry = RecipeHistory(user_id=user_id, ingredients=ingredients, recipe=recipe)
+async def add_recipe_history(session: AsyncSession, user_id: int, ingredients: str, recipe: str, structured: Recipe = None) -> RecipeHistory:
+    columns = structured.to_columns() if structured else {}
+    entry = RecipeHistory(user_id=user_id, ingredients=ingredients, recipe=recipe, **columns)
     session.add(entry)
     await session.commit()
     await session.refresh(entry)
     return entry
 
-async def save_user_recipe(session: AsyncSession, user_id: int, recipe_text: str, ingredients):
+async def save_user_recipe(session: AsyncSession, user_id: int, recipe_text: str, ingredients, recipe: Recipe = None):
     # ingredients может быть списком или строкой
     if isinstance(ingredients, list):
         ingredients_str = ", ".join(ingredients)
     else:
         ingredients_str = str(ingredients)
-    await add_recipe_history(session, user_id, ingredients_str, recipe_text)
+    await add_recipe_history(session, user_id, ingredients_str, recipe_text, structured=recipe)
 
 async def get_user_history(session: AsyncSession, user_id: int, limit: int = 10):
     result = await session.execute(
         select(RecipeHistory).where(RecipeHistory.user_id == user_id).order_by(RecipeHistory.created_at.desc()).limit(limit)
     )
-    return result.scalars().all() 
\ No newline at end of file
+    return result.scalars().all() 
+
+SAVED_PAGE_SIZE = 10
+_EPOCH = datetime(1970, 1, 1)
+
+def encode_cursor(created_at: datetime, recipe_id: int) -> str:
+    """Курсор keyset-пагинации для callback_data: микросекунды created_at и id."""
+    return f"{(created_at - _EPOCH) // timedelta(microseconds=1)}_{recipe_id}"
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    micros, recipe_id = cursor.split("_", 1)
+    return _EPOCH + timedelta(microseconds=int(micros)), int(recipe_id)
+
+async def list_user_recipes(
+    session: AsyncSession,
+    user_id: int,
+    cursor: Optional[str] = None,
+    backward: bool = False,
+    limit: int = SAVED_PAGE_SIZE
+) -> Tuple[List, bool]:
+    """
+    Страница сохранённых рецептов (id, title, created_at) от новых к старым, без текста рецептов.
+    cursor — граница страницы; backward=True — страница новее курсора (кнопка «◀»).
+    Возвращает строки и признак, что в этом направлении есть ещё записи.
+    """
+    key = tuple_(RecipeHistory.created_at, RecipeHistory.id)
+    query = select(RecipeHistory.id, RecipeHistory.title, RecipeHistory.created_at).where(RecipeHistory.user_id == user_id)
+    if cursor:
+        created_at, recipe_id = decode_cursor(cursor)
+        query = query.where(key > tuple_(created_at, recipe_id) if backward else key < tuple_(created_at, recipe_id))
+    if backward:
+        query = query.order_by(RecipeHistory.created_at.asc(), RecipeHistory.id.asc())
+    else:
+        query = query.order_by(RecipeHistory.created_at.desc(), RecipeHistory.id.desc())
+    result = await session.execute(query.limit(limit + 1))
+    rows = result.all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backward:
+        rows.reverse()
+    return rows, has_more
+
+async def get_user_recipe(session: AsyncSession, user_id: int, recipe_id: int) -> Optional[RecipeHistory]:
+    result = await session.execute(
+        select(RecipeHistory).where(RecipeHistory.id == recipe_id, RecipeHistory.user_id == user_id)
+    )
+    return result.scalars().first()
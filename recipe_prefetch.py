@@ -0,0 +1,128 @@
+import os
+import time
+import asyncio
+import logging
+from collections import Counter
+from typing import List, Optional
+from dotenv import load_dotenv
+from generate_recipe import generate_recipe_result
+from llm_gateway import llm_gateway
+from single_flight import single_flight
+
+load_dotenv()
+
+# 1 — начинать генерацию рецепта, как только бот показал список ингредиентов (CONFIRMING)
+RECIPE_PREFETCH = os.getenv('RECIPE_PREFETCH', '1') == '1'
+# 1 — после выдачи рецепта заранее готовить варианты «⬇️ Проще» и «⬆️ Сложнее»
+RECIPE_PREFETCH_VARIANTS = os.getenv('RECIPE_PREFETCH_VARIANTS', '0') == '1'
+# Бюджет: не больше стольких фоновых генераций одновременно и в минуту на процесс
+RECIPE_PREFETCH_MAX_INFLIGHT = int(os.getenv('RECIPE_PREFETCH_MAX_INFLIGHT', 8))
+RECIPE_PREFETCH_PER_MINUTE = int(os.getenv('RECIPE_PREFETCH_PER_MINUTE', 60))
+# Фоновая генерация не занимает больше этой доли слотов LLM_CONCURRENCY
+RECIPE_PREFETCH_LLM_SHARE = float(os.getenv('RECIPE_PREFETCH_LLM_SHARE', 0.5))
+
+logger = logging.getLogger(__name__)
+
+
+def prefetch_key(ingredients: List[str], user_id: int, temp_difficulty: Optional[str] = None, variant: int = 0) -> tuple:
+    # Порядок ингредиентов входит в промпт, поэтому ключ — точный список, а не множество
+    return tuple(ingredients), user_id, temp_difficulty or '', variant
+
+
+class RecipePrefetcher:
+    """
+    Спекулятивная генерация рецептов: пока пользователь проверяет список ингредиентов,
+    рецепт уже генерируется в фоне с теми же аргументами, что и при подтверждении.
+    Передача результата не требует отдельного канала: подтверждение вызывает generate_recipe
+    с тем же промптом и либо присоединяется к идущему вызову (single_flight), либо берёт
+    готовый рецепт из recipe_cache. При изменении списка фоновая генерация отменяется.
+    """
+
+    def __init__(self, enabled: bool = RECIPE_PREFETCH):
+        # Без объединения запросов подтверждение не сможет забрать идущую генерацию
+        self.enabled = enabled and single_flight.mode != 'off'
+        self.variants = self.enabled and RECIPE_PREFETCH_VARIANTS
+        self.stats = Counter()
+        self._tasks = {}
+        self._window_started = time.monotonic()
+        self._window_count = 0
+
+    def _inflight(self) -> int:
+        return sum(len(tasks) for tasks in self._tasks.values())
+
+    def _allow(self) -> bool:
+        now = time.monotonic()
+        if now - self._window_started >= 60:
+            self._window_started = now
+            self._window_count = 0
+        if self._window_count >= RECIPE_PREFETCH_PER_MINUTE or self._inflight() >= RECIPE_PREFETCH_MAX_INFLIGHT:
+            return False
+        # Фоновые генерации не должны вытеснять настоящие запросы из слотов модели
+        reserved = llm_gateway.concurrency * (1 - RECIPE_PREFETCH_LLM_SHARE)
+        return llm_gateway.spare_capacity() > reserved
+
+    def speculate(self, chat_id, ingredients: List[str], user_id: int, temp_difficulty: Optional[str] = None,
+                  variant: int = 0, replace: bool = True) -> bool:
+        """Запускает фоновую генерацию; replace — отменить генерации чата для другого набора аргументов."""
+        if not self.enabled or not ingredients or not user_id:
+            return False
+        key = prefetch_key(ingredients, user_id, temp_difficulty, variant)
+        tasks = self._tasks.get(chat_id, {})
+        if key in tasks:
+            return True
+        if replace:
+            self.cancel(chat_id)
+        if not self._allow():
+            self.stats['over_budget'] += 1
+            return False
+        self._window_count += 1
+        task = asyncio.create_task(self._run(list(ingredients), user_id, temp_difficulty, variant))
+        self._tasks.setdefault(chat_id, {})[key] = task
+        task.add_done_callback(lambda _: self._forget(chat_id, key, task))
+        self.stats['started'] += 1
+        logger.info(f"[PREFETCH] {chat_id}: фоновая генерация {len(ingredients)} ингредиентов, сложность {temp_difficulty or '—'}")
+        return True
+
+    async def _run(self, ingredients, user_id, temp_difficulty, variant):
+        started = time.monotonic()
+        await generate_recipe_result(ingredients, user_id=user_id, temp_difficulty=temp_difficulty, variant=variant)
+        self.stats['completed'] += 1
+        self.stats['completed_ms'] += int((time.monotonic() - started) * 1000)
+
+    def speculate_variants(self, chat_id, ingredients: List[str], user_id: int, difficulties: List[str]):
+        """Заранее готовит рецепты для других сложностей («⬇️ Проще»/«⬆️ Сложнее»), если бюджет позволяет."""
+        if not self.variants:
+            return
+        for difficulty in dict.fromkeys(difficulties):
+            self.speculate(chat_id, ingredients, user_id, temp_difficulty=difficulty, replace=False)
+
+    def _forget(self, chat_id, key, task):
+        tasks = self._tasks.get(chat_id)
+        if tasks and tasks.get(key) is task:
+            del tasks[key]
+            if not tasks:
+                del self._tasks[chat_id]
+
+    def claim(self, chat_id, ingredients: List[str], user_id: int, temp_difficulty: Optional[str] = None, variant: int = 0) -> bool:
+        """Отмечает, что пользователь запросил рецепт; True — фоновая генерация для него ещё идёт
+        (уже законченная отдаст рецепт через recipe_cache)."""
+        task = self._tasks.get(chat_id, {}).get(prefetch_key(ingredients, user_id, temp_difficulty, variant))
+        if task is None:
+            self.stats['missed'] += 1
+            return False
+        self.stats['claimed'] += 1
+        return True
+
+    def cancel(self, chat_id):
+        """Отменяет фоновые генерации чата (список ингредиентов изменился или готовка отменена).
+        Генерация, к которой уже присоединился пользователь, продолжается — её ждёт single_flight."""
+        for task in list(self._tasks.pop(chat_id, {}).values()):
+            if not task.done():
+                task.cancel()
+                self.stats['cancelled'] += 1
+
+    def metrics(self) -> dict:
+        return {'enabled': self.enabled, 'inflight': self._inflight(), **self.stats}
+
+
+recipe_prefetch = RecipePrefetcher()
@@ -0,0 +1,194 @@
+import re
+import json
+from dataclasses import dataclass, field, asdict
+from typing import List, Optional
+
+DIFFICULTY_LEVELS = ['Легкий', 'Средний', 'Сложный']
+
+_NUTRITION_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {
+        'calories': {'type': 'INTEGER'},
+        'protein': {'type': 'INTEGER'},
+        'fat': {'type': 'INTEGER'},
+        'carbs': {'type': 'INTEGER'},
+    },
+    'required': ['calories', 'protein', 'fat', 'carbs'],
+}
+
+# Схема ответа Gemini (response_schema) для режима структурированного JSON
+RECIPE_RESPONSE_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {
+        'title': {'type': 'STRING'},
+        'difficulty': {'type': 'STRING', 'enum': DIFFICULTY_LEVELS},
+        'ingredients': {'type': 'ARRAY', 'items': {'type': 'STRING'}},
+        'prep': {'type': 'ARRAY', 'items': {'type': 'STRING'}},
+        'steps': {'type': 'ARRAY', 'items': {'type': 'STRING'}},
+        'tips': {'type': 'ARRAY', 'items': {'type': 'STRING'}},
+        'per_100g': _NUTRITION_SCHEMA,
+        'per_portion': _NUTRITION_SCHEMA,
+    },
+    'required': ['title', 'difficulty', 'ingredients', 'steps', 'per_100g', 'per_portion'],
+}
+
+_NUTRITION_RES = {
+    'calories': re.compile(r'(?<![~\d])(\d+)\s*ккал'),
+    'protein': re.compile(r'(?<![~\d])(\d+)\s*г\s*белк'),
+    'fat': re.compile(r'(?<![~\d])(\d+)\s*г\s*жир'),
+    'carbs': re.compile(r'(?<![~\d])(\d+)\s*г\s*углевод'),
+}
+_PORTION_SPLIT_RE = re.compile(r'[Нн]а (?:порцию|[1-9][0-9]* ?порц)')
+_FORMATTED_SECTION_RE = re.compile(
+    r'^(📝 Ингредиенты|🔪 Подготовка ингредиентов|🥣 Шаги приготовления|💡 Советы от шефа|🍽 КБЖУ \(приблизительно\)):$',
+    re.MULTILINE
+)
+_FORMATTED_SECTION_NAMES = {
+    '📝 Ингредиенты': 'ingredients',
+    '🔪 Подготовка ингредиентов': 'prep',
+    '🥣 Шаги приготовления': 'steps',
+    '💡 Советы от шефа': 'tips',
+    '🍽 КБЖУ (приблизительно)': 'kbju',
+}
+_FORMATTED_ITEM_RE = re.compile(r'^(?:–|\d+\.)\s*')
+
+
+def _number(value) -> Optional[int]:
+    if value is None or value == '':
+        return None
+    try:
+        return int(round(float(value)))
+    except (TypeError, ValueError):
+        return None
+
+
+def _items(values) -> List[str]:
+    return [str(v).strip() for v in values or [] if str(v).strip()]
+
+
+@dataclass
+class Nutrition:
+    calories: Optional[int] = None
+    protein: Optional[int] = None
+    fat: Optional[int] = None
+    carbs: Optional[int] = None
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict]) -> 'Nutrition':
+        data = data or {}
+        return cls(**{name: _number(data.get(name)) for name in ('calories', 'protein', 'fat', 'carbs')})
+
+    @classmethod
+    def from_text(cls, text: str) -> 'Nutrition':
+        values = {}
+        for name, pattern in _NUTRITION_RES.items():
+            match = pattern.search(text)
+            values[name] = int(match.group(1)) if match else None
+        return cls(**values)
+
+    def is_empty(self) -> bool:
+        return all(v is None for v in (self.calories, self.protein, self.fat, self.carbs))
+
+    def to_text(self) -> str:
+        """Строка в том виде, в каком КБЖУ пишет модель в текстовом режиме."""
+        parts = []
+        if self.calories is not None:
+            parts.append(f'{self.calories} ккал')
+        if self.protein is not None:
+            parts.append(f'{self.protein} г белков')
+        if self.fat is not None:
+            parts.append(f'{self.fat} г жиров')
+        if self.carbs is not None:
+            parts.append(f'{self.carbs} г углеводов')
+        return ', '.join(parts)
+
+
+@dataclass
+class Recipe:
+    """Типизированный рецепт: разбирается из JSON-ответа Gemini или из готового текста."""
+    title: str
+    difficulty: str = 'Средний'
+    ingredients: List[str] = field(default_factory=list)
+    prep: List[str] = field(default_factory=list)
+    steps: List[str] = field(default_factory=list)
+    tips: List[str] = field(default_factory=list)
+    per_100g: Nutrition = field(default_factory=Nutrition)
+    per_portion: Nutrition = field(default_factory=Nutrition)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Recipe':
+        return cls(
+            title=str(data.get('title') or '').strip(),
+            difficulty=str(data.get('difficulty') or '').strip() or 'Средний',
+            ingredients=_items(data.get('ingredients')),
+            prep=_items(data.get('prep')),
+            steps=_items(data.get('steps')),
+            tips=_items(data.get('tips')),
+            per_100g=Nutrition.from_dict(data.get('per_100g')),
+            per_portion=Nutrition.from_dict(data.get('per_portion')),
+        )
+
+    @classmethod
+    def from_json(cls, raw: str) -> 'Recipe':
+        return cls.from_dict(json.loads(raw))
+
+    @classmethod
+    def from_text(cls, text: str) -> 'Recipe':
+        """Разбирает уже отформатированный рецепт (вывод format_recipe)."""
+        first_line = text.strip().split('\n', 1)[0]
+        title = first_line.replace('📌', '', 1).strip() if first_line.startswith('📌') else ''
+        difficulty = re.search(r'Сложность:\s*(.+)', text)
+        sections = {}
+        chunks = _FORMATTED_SECTION_RE.split(text)
+        for header, body in zip(chunks[1::2], chunks[2::2]):
+            sections[_FORMATTED_SECTION_NAMES[header]] = body.strip()
+
+        def items(name):
+            return [_FORMATTED_ITEM_RE.sub('', l).strip() for l in sections.get(name, '').split('\n') if l.strip()]
+
+        # Приблизительные значения по умолчанию («~250 ккал») не сохраняем как настоящие
+        kbju = sections.get('kbju', '')
+        parts = _PORTION_SPLIT_RE.split(kbju, maxsplit=1)
+        per_100g = parts[0]
+        per_portion = parts[1] if len(parts) > 1 else ''
+        return cls(
+            title=title,
+            difficulty=difficulty.group(1).strip() if difficulty else 'Средний',
+            ingredients=items('ingredients'),
+            prep=items('prep'),
+            steps=items('steps'),
+            tips=items('tips'),
+            per_100g=Nutrition.from_text(per_100g),
+            per_portion=Nutrition.from_text(per_portion),
+        )
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), ensure_ascii=False)
+
+    def kbju_text(self) -> str:
+        """КБЖУ в том виде, в каком его разбирает format_kbju_block."""
+        lines = []
+        if not self.per_100g.is_empty():
+            lines.append(f'На 100 г: {self.per_100g.to_text()}')
+        if not self.per_portion.is_empty():
+            lines.append(f'На 1 порцию (300 г): {self.per_portion.to_text()}')
+        return '\n'.join(lines)
+
+    def to_columns(self) -> dict:
+        """Значения для типизированных колонок RecipeHistory."""
+        return {
+            'title': self.title or None,
+            'difficulty': self.difficulty or None,
+            'recipe_ingredients': self.ingredients,
+            'calories_100g': self.per_100g.calories,
+            'protein_100g': self.per_100g.protein,
+            'fat_100g': self.per_100g.fat,
+            'carbs_100g': self.per_100g.carbs,
+            'calories_portion': self.per_portion.calories,
+            'protein_portion': self.per_portion.protein,
+            'fat_portion': self.per_portion.fat,
+            'carbs_portion': self.per_portion.carbs,
+        }
@@ -0,0 +1,46 @@
+import hashlib
+import logging
+from collections import Counter
+from redis.exceptions import NoScriptError
+from session_store import session_store
+
+logger = logging.getLogger(__name__)
+
+
+class ScriptRegistry:
+    """Lua-скрипты Redis: загружаются один раз (SCRIPT LOAD) и вызываются по SHA через EVALSHA.
+    Если Redis потерял кэш скриптов (рестарт, SCRIPT FLUSH), скрипт перезагружается и вызов повторяется."""
+
+    def __init__(self):
+        self.scripts = {}
+        self.stats = Counter()
+
+    def register(self, name: str, source: str) -> str:
+        sha = hashlib.sha1(source.encode('utf-8')).hexdigest()
+        self.scripts[name] = (source, sha)
+        return name
+
+    async def load(self):
+        """Вызывается при старте процесса."""
+        await session_store.connect()
+        for name, (source, sha) in self.scripts.items():
+            loaded = await session_store.redis.script_load(source)
+            if loaded != sha:
+                logger.warning(f"[SCRIPTS] SHA скрипта {name} не совпал: {loaded} != {sha}")
+                self.scripts[name] = (source, loaded)
+        logger.info(f"[SCRIPTS] Загружено скриптов: {len(self.scripts)}")
+
+    async def run(self, name: str, keys: list, args: list):
+        source, sha = self.scripts[name]
+        await session_store.connect()
+        try:
+            result = await session_store.redis.evalsha(sha, len(keys), *keys, *args)
+        except NoScriptError:
+            self.stats['noscript'] += 1
+            await session_store.redis.script_load(source)
+            result = await session_store.redis.evalsha(sha, len(keys), *keys, *args)
+        self.stats[name] += 1
+        return result
+
+
+script_registry = ScriptRegistry()
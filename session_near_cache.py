@@ -0,0 +1,216 @@
+import os
+import time
+import asyncio
+import logging
+from collections import Counter, OrderedDict
+from typing import List, Optional
+from redis.asyncio import Redis
+from redis.asyncio.connection import BlockingConnectionPool, Connection
+from redis.exceptions import ResponseError
+from redis.utils import str_if_bytes
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 1 — держать недавние сессии в памяти процесса, инвалидируя их через CLIENT TRACKING
+SESSION_NEAR_CACHE = os.getenv('SESSION_NEAR_CACHE', '0') == '1'
+SESSION_NEAR_CACHE_SIZE = int(os.getenv('SESSION_NEAR_CACHE_SIZE', 1000))
+# Страховочный срок жизни записи, даже если инвалидация почему-то не пришла
+SESSION_NEAR_CACHE_TTL = float(os.getenv('SESSION_NEAR_CACHE_TTL', 300))
+# Сколько отслеживаемых соединений: чаты распределяются по ним по chat_id
+SESSION_NEAR_CACHE_CONNECTIONS = int(os.getenv('SESSION_NEAR_CACHE_CONNECTIONS', 8))
+
+INVALIDATE_CHANNEL = '__redis__:invalidate'
+
+logger = logging.getLogger(__name__)
+
+
+class SessionNearCache:
+    """
+    Ближний кэш сессий с серверной инвалидацией (Redis server-assisted client-side caching).
+
+    Отдельное соединение подписано на __redis__:invalidate, а на каждом из SESSION_NEAR_CACHE_CONNECTIONS
+    «отслеживаемых» соединений включён CLIENT TRACKING ON REDIRECT <id> NOLOOP (RESP2: инвалидации
+    приходят сообщениями pub/sub, а не push-сообщениями RESP3 на том же соединении). Операции с сессией
+    чата всегда идут через одно и то же соединение (chat_id по модулю числа соединений), поэтому Redis
+    помнит, что ключи чата читало именно оно: свои записи кэш не сбрасывают (NOLOOP), а записи других
+    процессов приходят инвалидациями. Разные чаты идут по разным соединениям параллельно.
+    Пока подписка или трекинг не работают, кэш пуст и не заполняется.
+    """
+
+    def __init__(self, prefix: str, redis_kwargs: dict, max_size: int = SESSION_NEAR_CACHE_SIZE, ttl: float = SESSION_NEAR_CACHE_TTL,
+                 connections: int = SESSION_NEAR_CACHE_CONNECTIONS):
+        self.prefix = prefix
+        self.redis_kwargs = redis_kwargs
+        self.max_size = max_size
+        self.ttl = ttl
+        self.connections = max(1, connections)
+        self.entries = OrderedDict()
+        self.ready = False
+        self.tracked: List[Redis] = []
+        self.stats = Counter()
+        # Поколение меняется при каждой потере/восстановлении трекинга; эпохи — при инвалидации чата
+        self._generation = 0
+        self._epochs = {}
+        self._inflight = Counter()
+        self._conn: Optional[Connection] = None
+        self._client_id = None
+        self._listener: Optional[asyncio.Task] = None
+
+    def client(self, default: Redis, chat_id=None) -> Redis:
+        """Отслеживаемое соединение чата; без chat_id или пока кэш не готов — обычный клиент."""
+        if not self.ready or chat_id is None:
+            return default
+        return self.tracked[int(chat_id) % len(self.tracked)]
+
+    async def start(self):
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener:
+            self._listener.cancel()
+            self._listener = None
+        await self._disconnect()
+
+    def _chat_of(self, key: str) -> Optional[str]:
+        if not key.startswith(self.prefix):
+            return None
+        return key[len(self.prefix):].split(':', 1)[0]
+
+    def _reset(self):
+        self.ready = False
+        self._generation += 1
+        self.entries.clear()
+        for chat in self._inflight:
+            self._epochs[chat] = self._epochs.get(chat, 0) + 1
+
+    def _invalidate(self, keys):
+        if keys is None:
+            # FLUSHDB/FLUSHALL: сбрасываем всё
+            self.entries.clear()
+            for chat in self._inflight:
+                self._epochs[chat] = self._epochs.get(chat, 0) + 1
+            self.stats['flushes'] += 1
+            return
+        for key in keys:
+            chat = self._chat_of(key)
+            if chat is None:
+                continue
+            if self.entries.pop(chat, None) is not None:
+                self.stats['invalidations'] += 1
+            if chat in self._inflight:
+                self._epochs[chat] = self._epochs.get(chat, 0) + 1
+
+    async def _disconnect(self):
+        self._reset()
+        if self._conn is not None:
+            try:
+                await self._conn.disconnect()
+            except Exception:
+                pass
+            self._conn = None
+        for tracked in self.tracked:
+            try:
+                await tracked.connection_pool.disconnect()
+            except Exception:
+                pass
+        self.tracked = []
+
+    async def _on_tracked_connect(self, connection):
+        """Вызывается при каждом (пере)подключении отслеживаемого соединения.
+        С разрывом Redis забывает, какие ключи читало соединение, и инвалидации могли потеряться —
+        поэтому кэш сбрасывается."""
+        await connection.on_connect()
+        self._reset()
+        await connection.send_command('CLIENT', 'TRACKING', 'ON', 'REDIRECT', self._client_id, 'NOLOOP')
+        if str_if_bytes(await connection.read_response()) != 'OK':
+            raise ResponseError('CLIENT TRACKING failed')
+        self._generation += 1
+        self.ready = True
+
+    async def _arm(self):
+        self._conn = Connection(**self.redis_kwargs)
+        await self._conn.connect()
+        await self._conn.send_command('CLIENT', 'ID')
+        self._client_id = await self._conn.read_response()
+        await self._conn.send_command('SUBSCRIBE', INVALIDATE_CHANNEL)
+        await self._conn.read_response()
+        # У каждого клиента пул из одного соединения: трекинг привязан к соединению, и запросы чата
+        # (в том числе конвейеры) должны идти через то же соединение, что читало его ключи
+        self.tracked = [
+            Redis(connection_pool=BlockingConnectionPool(
+                max_connections=1, timeout=None, redis_connect_func=self._on_tracked_connect, **self.redis_kwargs
+            ))
+            for _ in range(self.connections)
+        ]
+        # Подключение включает трекинг; последнее открывает кэш
+        for tracked in self.tracked:
+            await tracked.ping()
+        logger.info(f"[NEAR-CACHE] Трекинг включён на {len(self.tracked)} соединениях, redirect → client {self._client_id}")
+
+    async def _listen(self):
+        delay = 1
+        while True:
+            try:
+                await self._arm()
+                delay = 1
+                while True:
+                    message = await self._conn.read_response()
+                    if isinstance(message, list) and len(message) == 3 and message[0] == 'message':
+                        self._invalidate(message[2])
+            except asyncio.CancelledError:
+                raise
+            except ResponseError as e:
+                # Redis < 6 или трекинг запрещён — работаем без ближнего кэша
+                logger.warning(f"[NEAR-CACHE] CLIENT TRACKING недоступен, ближний кэш выключен: {e}")
+                await self._disconnect()
+                return
+            except Exception as e:
+                logger.error(f"[NEAR-CACHE] Подписка на инвалидации потеряна: {e}")
+            await self._disconnect()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+
+    def get(self, chat_id) -> Optional[dict]:
+        if not self.ready:
+            return None
+        chat = str(chat_id)
+        entry = self.entries.get(chat)
+        if entry is None:
+            self.stats['misses'] += 1
+            return None
+        expires_at, data = entry
+        if expires_at < time.monotonic():
+            del self.entries[chat]
+            self.stats['misses'] += 1
+            return None
+        self.entries.move_to_end(chat)
+        self.stats['hits'] += 1
+        return {**data, 'ingredients': list(data['ingredients'])}
+
+    def begin(self, chat_id):
+        """Отмечает начало чтения из Redis; токен потом передаётся в finish."""
+        chat = str(chat_id)
+        self._inflight[chat] += 1
+        return self.ready, self._generation, self._epochs.get(chat, 0)
+
+    def finish(self, chat_id, token, data: Optional[dict] = None):
+        """Кладёт прочитанную сессию в кэш, если за время чтения не было инвалидаций."""
+        chat = str(chat_id)
+        ready, generation, epoch = token
+        if data is not None and ready and self.ready and generation == self._generation and epoch == self._epochs.get(chat, 0):
+            self.entries[chat] = (time.monotonic() + self.ttl, {**data, 'ingredients': list(data['ingredients'])})
+            self.entries.move_to_end(chat)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        self._inflight[chat] -= 1
+        if self._inflight[chat] <= 0:
+            del self._inflight[chat]
+            self._epochs.pop(chat, None)
+
+    def drop(self, chat_id):
+        self.entries.pop(str(chat_id), None)
+
+    def metrics(self) -> dict:
+        return {'ready': self.ready, 'size': len(self.entries), 'connections': len(self.tracked), **self.stats}
@@ -1,122 +1,318 @@
 import os
 import json
+import time
 import logging
-from typing import Optional
+from typing import Optional, Tuple
 from redis.asyncio import Redis
 from dotenv import load_dotenv
+from session_near_cache import SessionNearCache, SESSION_NEAR_CACHE
 
 load_dotenv()
 
 REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
 REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
 REDIS_DB = int(os.getenv('REDIS_DB', 0))
+# Скользящий TTL: сессия неактивного чата удаляется через столько секунд после последнего обращения
+SESSION_TTL = int(os.getenv('SESSION_TTL', 7 * 86400))
 
 logger = logging.getLogger(__name__)
 
+# Поля хэша сессии, которые хранятся числами
+_INT_FIELDS = ('recipe_variant',)
+
+
+class SessionTransition:
+    """
+    Набор изменений сессии, который выполняется одной транзакцией (MULTI/EXEC) за один round trip:
+    запись полей и ингредиентов, продление TTL и чтение итоговой сессии.
+
+        session = await session_store.transition(chat_id).set(state="CONFIRMING").add_ingredients(items).execute()
+    """
+
+    def __init__(self, store: 'SessionStore', chat_id: int):
+        self.store = store
+        self.chat_id = chat_id
+        self._ops = []
+
+    def set(self, **fields) -> 'SessionTransition':
+        """HSET полей; значение None удаляет поле."""
+        mapping, removed = self.store._encode_fields(fields)
+        key = self.store._keys(self.chat_id)[0]
+        if mapping:
+            self._ops.append(lambda pipe: pipe.hset(key, mapping=mapping))
+        if removed:
+            self._ops.append(lambda pipe: pipe.hdel(key, *removed))
+        return self
+
+    def add_ingredients(self, ingredients: list) -> 'SessionTransition':
+        ingredients = [i for i in ingredients if i]
+        if ingredients:
+            key = self.store._keys(self.chat_id)[1]
+            scores = self.store._scores(ingredients)
+            self._ops.append(lambda pipe: pipe.zadd(key, scores, nx=True))
+        return self
+
+    def remove_ingredients(self, ingredients: list) -> 'SessionTransition':
+        if ingredients:
+            key = self.store._keys(self.chat_id)[1]
+            self._ops.append(lambda pipe: pipe.zrem(key, *ingredients))
+        return self
+
+    def clear_ingredients(self) -> 'SessionTransition':
+        key = self.store._keys(self.chat_id)[1]
+        self._ops.append(lambda pipe: pipe.delete(key))
+        return self
+
+    def set_last_recipe(self, text: str, data: Optional[dict] = None) -> 'SessionTransition':
+        key = self.store._keys(self.chat_id)[2]
+        self._ops.append(lambda pipe: self.store._set_last_recipe(pipe, key, text, data))
+        return self
+
+    async def execute(self) -> dict:
+        """Применяет изменения и возвращает сессию после них (поля и ингредиенты)."""
+        await self.store.connect()
+        key, ingredients_key, _ = self.store._keys(self.chat_id)
+        near_cache = self.store.near_cache
+        token = near_cache.begin(self.chat_id) if near_cache else None
+        session = None
+        try:
+            async with self.store.client(self.chat_id).pipeline(transaction=True) as pipe:
+                for op in self._ops:
+                    op(pipe)
+                self.store._touch(pipe, self.chat_id)
+                pipe.hgetall(key)
+                pipe.zrange(ingredients_key, 0, -1)
+                *_, fields, ingredients = await pipe.execute()
+            session = self.store._decode(fields, ingredients)
+        finally:
+            if near_cache:
+                # Итоговая сессия прочитана в той же транзакции — её можно сразу положить в ближний кэш
+                near_cache.finish(self.chat_id, token, session)
+        logger.info(f"Session transition for {self.chat_id}: {len(self._ops)} ops")
+        return session
+
+
 class SessionStore:
+    """
+    Сессия v2: скалярные поля — хэш session:v2:{chat_id}, ингредиенты — sorted set
+    session:v2:{chat_id}:ingredients (score — порядок добавления, дубликаты невозможны),
+    последний рецепт — отдельный хэш session:v2:{chat_id}:recipe, который читается только при сохранении.
+    Старые JSON-сессии session:{chat_id} переносятся в v2 при первом чтении.
+    """
+
     def __init__(self):
         self.redis: Optional[Redis] = None
+        self.near_cache: Optional[SessionNearCache] = None
+        if SESSION_NEAR_CACHE:
+            self.near_cache = SessionNearCache(
+                'session:v2:', dict(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, decode_responses=True)
+            )
 
     async def connect(self):
         if not self.redis:
             self.redis = Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, decode_responses=True)
             logger.info('Redis connected')
 
+    def client(self, chat_id=None) -> Redis:
+        """Соединение для операций с сессией чата: отслеживаемое, если ближний кэш включён и готов."""
+        return self.near_cache.client(self.redis, chat_id) if self.near_cache else self.redis
+
+    async def start_near_cache(self):
+        if self.near_cache:
+            await self.connect()
+            await self.near_cache.start()
+
+    async def stop_near_cache(self):
+        if self.near_cache:
+            await self.near_cache.stop()
+
+    @staticmethod
+    def _keys(chat_id: int) -> Tuple[str, str, str]:
+        base = f"session:v2:{chat_id}"
+        return base, f"{base}:ingredients", f"{base}:recipe"
+
+    def _touch(self, pipe, chat_id: int):
+        for key in self._keys(chat_id):
+            pipe.expire(key, SESSION_TTL)
+
+    @staticmethod
+    def _encode_fields(fields: dict) -> Tuple[dict, list]:
+        mapping, removed = {}, []
+        for name, value in fields.items():
+            if value is None:
+                removed.append(name)
+            else:
+                mapping[name] = value
+        return mapping, removed
+
+    @staticmethod
+    def _decode(fields: dict, ingredients: list) -> dict:
+        data = dict(fields)
+        for name in _INT_FIELDS:
+            if name in data:
+                data[name] = int(data[name])
+        data['ingredients'] = list(ingredients)
+        return data
+
+    @staticmethod
+    def _scores(ingredients: list) -> dict:
+        # Время в микросекундах + номер в пачке: порядок добавления сохраняется
+        base = time.time_ns() // 1000
+        return {item: base + idx for idx, item in enumerate(ingredients)}
+
     async def set_session(self, chat_id: int, data: dict):
+        """Полностью перезаписывает сессию (используется при миграции и сбросе)."""
         try:
             await self.connect()
-            await self.redis.set(f"session:{chat_id}", json.dumps(data))
-            logger.info(f"Session set for {chat_id}: {data}")
+            key, ingredients_key, recipe_key = self._keys(chat_id)
+            data = dict(data)
+            ingredients = [i for i in data.pop('ingredients', None) or [] if i]
+            last_recipe = data.pop('last_recipe', None)
+            last_recipe_data = data.pop('last_recipe_data', None)
+            mapping, _ = self._encode_fields(data)
+            if self.near_cache:
+                self.near_cache.drop(chat_id)
+            async with self.client(chat_id).pipeline(transaction=True) as pipe:
+                pipe.delete(key, ingredients_key)
+                if mapping:
+                    pipe.hset(key, mapping=mapping)
+                if ingredients:
+                    pipe.zadd(ingredients_key, self._scores(ingredients), nx=True)
+                if last_recipe:
+                    self._set_last_recipe(pipe, recipe_key, last_recipe, last_recipe_data)
+                self._touch(pipe, chat_id)
+                await pipe.execute()
+            logger.info(f"Session set for {chat_id}: {mapping}, {len(ingredients)} ingredients")
         except Exception as e:
             logger.error(f"Redis set_session error: {e}")
 
     async def get_session(self, chat_id: int) -> Optional[dict]:
+        """Скалярные поля и ингредиенты; текст последнего рецепта — через get_last_recipe."""
+        if self.near_cache:
+            cached = self.near_cache.get(chat_id)
+            if cached is not None:
+                return cached
+        token = self.near_cache.begin(chat_id) if self.near_cache else None
+        session = None
         try:
             await self.connect()
-            raw = await self.redis.get(f"session:{chat_id}")
-            if raw:
-                logger.info(f"Session get for {chat_id}: {raw}")
-                return json.loads(raw)
+            key, ingredients_key, _ = self._keys(chat_id)
+            async with self.client(chat_id).pipeline(transaction=False) as pipe:
+                pipe.hgetall(key)
+                pipe.zrange(ingredients_key, 0, -1)
+                self._touch(pipe, chat_id)
+                fields, ingredients, *_ = await pipe.execute()
+            if fields or ingredients:
+                logger.info(f"Session get for {chat_id}: {fields}, {len(ingredients)} ingredients")
+                session = self._decode(fields, ingredients)
+                return session
+            return await self._migrate_legacy(chat_id)
         except Exception as e:
             logger.error(f"Redis get_session error: {e}")
+        finally:
+            if self.near_cache:
+                self.near_cache.finish(chat_id, token, session)
         return None
 
-    UPDATE_INGREDIENTS_LUA = """
-    local key = KEYS[1]
-    local add = cjson.decode(ARGV[1])
-    local session = redis.call('GET', key)
-    if not session then
-        session = {ingredients = {}}
-    else
-        session = cjson.decode(session)
-    end
-    local set = {}
-    for _, v in ipairs(session.ingredients or {}) do set[v] = true end
-    for _, v in ipairs(add) do set[v] = true end
-    local result = {}
-    for k, _ in pairs(set) do table.insert(result, k) end
-    session.ingredients = result
-    redis.call('SET', key, cjson.encode(session))
-    return cjson.encode(session)
-    """
+    async def _migrate_legacy(self, chat_id: int) -> Optional[dict]:
+        legacy_key = f"session:{chat_id}"
+        raw = await self.redis.get(legacy_key)
+        if not raw:
+            return None
+        legacy = json.loads(raw)
+        await self.set_session(chat_id, legacy)
+        await self.redis.delete(legacy_key)
+        logger.info(f"Session for {chat_id} migrated to v2")
+        legacy.pop('last_recipe', None)
+        legacy.pop('last_recipe_data', None)
+        legacy['ingredients'] = list(dict.fromkeys(i for i in legacy.get('ingredients') or [] if i))
+        return legacy
 
-    async def update_ingredients(self, chat_id: int, new_ingredients: list):
+    def transition(self, chat_id: int) -> SessionTransition:
+        return SessionTransition(self, chat_id)
+
+    async def set_fields(self, chat_id: int, **fields):
+        """HSET отдельных скалярных полей; значение None удаляет поле."""
         try:
-            await self.connect()
-            key = f"session:{chat_id}"
-            result = await self.redis.eval(self.UPDATE_INGREDIENTS_LUA, 1, key, json.dumps(new_ingredients))
-            logger.info(f"Session updated for {chat_id}: {result}")
+            await self.transition(chat_id).set(**fields).execute()
         except Exception as e:
-            logger.error(f"Redis update_ingredients error: {e}")
-
-    REMOVE_INGREDIENTS_LUA = """
-    local key = KEYS[1]
-    local remove = cjson.decode(ARGV[1])
-    local session = redis.call('GET', key)
-    if not session then return nil end
-    session = cjson.decode(session)
-    local ingredients = {}
-    for _, v in ipairs(session.ingredients or {}) do
-        local found = false
-        for _, r in ipairs(remove) do
-            if v == r then found = true break end
-        end
-        if not found then table.insert(ingredients, v) end
-    end
-    session.ingredients = ingredients
-    redis.call('SET', key, cjson.encode(session))
-    return cjson.encode(session)
-    """
+            logger.error(f"Redis set_fields error: {e}")
 
-    async def remove_ingredients(self, chat_id: int, remove_ingredients: list):
+    async def add_ingredients(self, chat_id: int, new_ingredients: list) -> list:
+        """Добавляет ингредиенты без дубликатов и возвращает итоговый список."""
         try:
-            await self.connect()
-            key = f"session:{chat_id}"
-            result = await self.redis.eval(self.REMOVE_INGREDIENTS_LUA, 1, key, json.dumps(remove_ingredients))
-            logger.info(f"Session ingredients removed for {chat_id}: {result}")
+            session = await self.transition(chat_id).add_ingredients(new_ingredients).execute()
+            return session['ingredients']
+        except Exception as e:
+            logger.error(f"Redis add_ingredients error: {e}")
+            return []
+
+    # Прежнее имя метода
+    update_ingredients = add_ingredients
+
+    async def remove_ingredients(self, chat_id: int, remove_ingredients: list) -> list:
+        """ZREM ингредиентов; возвращает оставшийся список."""
+        try:
+            session = await self.transition(chat_id).remove_ingredients(remove_ingredients).execute()
+            return session['ingredients']
         except Exception as e:
             logger.error(f"Redis remove_ingredients error: {e}")
+            return []
 
-    async def set_state(self, chat_id: int, state: str):
+    async def clear_ingredients(self, chat_id: int):
+        try:
+            await self.transition(chat_id).clear_ingredients().execute()
+        except Exception as e:
+            logger.error(f"Redis clear_ingredients error: {e}")
+
+    @staticmethod
+    def _set_last_recipe(pipe, recipe_key: str, text: str, data: Optional[dict]):
+        pipe.delete(recipe_key)
+        mapping = {'text': text}
+        if data:
+            mapping['data'] = json.dumps(data, ensure_ascii=False)
+        pipe.hset(recipe_key, mapping=mapping)
+
+    async def set_last_recipe(self, chat_id: int, text: str, data: Optional[dict] = None):
+        try:
+            await self.transition(chat_id).set_last_recipe(text, data).execute()
+        except Exception as e:
+            logger.error(f"Redis set_last_recipe error: {e}")
+
+    async def get_last_recipe(self, chat_id: int) -> Tuple[str, Optional[dict]]:
+        """Текст и структура последнего рецепта: ('', None), если рецепта нет."""
         try:
             await self.connect()
-            session = await self.get_session(chat_id) or {}
-            session['state'] = state
-            await self.set_session(chat_id, session)
-            logger.info(f"State set for {chat_id}: {state}")
+            stored = await self.redis.hgetall(self._keys(chat_id)[2])
         except Exception as e:
-            logger.error(f"Redis set_state error: {e}")
+            logger.error(f"Redis get_last_recipe error: {e}")
+            stored = {}
+        data = json.loads(stored['data']) if stored.get('data') else None
+        return stored.get('text', ''), data
+
+    async def set_state(self, chat_id: int, state: str):
+        await self.set_fields(chat_id, state=state)
 
     async def get_state(self, chat_id: int) -> str:
-        session = await self.get_session(chat_id) or {}
-        return session.get('state', 'idle')
+        try:
+            await self.connect()
+            state = await self.redis.hget(self._keys(chat_id)[0], 'state')
+        except Exception as e:
+            logger.error(f"Redis get_state error: {e}")
+            state = None
+        if state is None:
+            session = await self.get_session(chat_id) or {}
+            state = session.get('state')
+        return state or 'idle'
 
     async def clear_session(self, chat_id: int):
         try:
             await self.connect()
-            await self.redis.delete(f"session:{chat_id}")
+            if self.near_cache:
+                self.near_cache.drop(chat_id)
+            await self.client(chat_id).delete(*self._keys(chat_id), f"session:{chat_id}")
             logger.info(f"Session cleared for {chat_id}")
         except Exception as e:
             logger.error(f"Redis clear_session error: {e}")
 
-session_store = SessionStore() 
\ No newline at end of file
+session_store = SessionStore()
@@ -0,0 +1,135 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+from collections import Counter
+from typing import Awaitable, Callable
+from dotenv import load_dotenv
+from session_store import session_store
+from redis_scripts import script_registry
+
+load_dotenv()
+
+# local — одинаковые запросы объединяются внутри процесса; redis — и между процессами; off — без объединения
+SINGLE_FLIGHT_MODE = os.getenv('SINGLE_FLIGHT_MODE', 'local')
+# Аренда лидера в Redis: дольше, чем вызов модели со всеми повторами (LLM_TIMEOUT)
+SINGLE_FLIGHT_LEASE_MS = int(os.getenv('SINGLE_FLIGHT_LEASE_MS', 90000))
+# Сколько живёт результат для ожидающих в других процессах
+SINGLE_FLIGHT_RESULT_TTL_MS = int(os.getenv('SINGLE_FLIGHT_RESULT_TTL_MS', 30000))
+
+# Результат пишется, только если аренда ещё наша (иначе лидер уже другой и результат — его); аренда снимается той же командой
+FINISH_FLIGHT_LUA = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+if ARGV[2] ~= '' then
+    redis.call('SET', KEYS[2], ARGV[2], 'PX', ARGV[3])
+end
+redis.call('DEL', KEYS[1])
+return 1
+"""
+
+FINISH_FLIGHT = script_registry.register('single_flight_finish', FINISH_FLIGHT_LUA)
+
+logger = logging.getLogger(__name__)
+
+
+def flight_key(*parts) -> str:
+    """Ключ полёта: sha1 от частей (полного промпта, хэша изображения и т. п.)."""
+    raw = '\0'.join(str(p) for p in parts)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+class _Flight:
+    __slots__ = ('task', 'waiters')
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Объединение одинаковых запросов, выполняющихся одновременно: первый вызывающий выполняет работу,
+    остальные ждут тот же результат. Работа отменяется, только когда её перестали ждать все.
+    В режиме redis лидер выбирается через SET NX с арендой, результат (JSON) передаётся через Redis
+    ожидающим в других процессах; если лидер упал, его место занимает один из ожидающих.
+    """
+
+    def __init__(self, mode: str = SINGLE_FLIGHT_MODE):
+        self.mode = mode
+        self._flights = {}
+        self.stats = Counter()
+
+    async def do(self, key: str, fn: Callable[[], Awaitable]):
+        """Результат fn() — общий для всех одновременных вызовов с тем же key."""
+        if self.mode == 'off':
+            return await fn()
+        flight = self._flights.get(key)
+        if flight is None:
+            work = self._distributed(key, fn) if self.mode == 'redis' else fn()
+            flight = self._flights[key] = _Flight(asyncio.ensure_future(work))
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+            self.stats['leaders'] += 1
+        else:
+            self.stats['coalesced'] += 1
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Результат больше никому не нужен
+                flight.task.cancel()
+                self.stats['cancelled'] += 1
+
+    def _forget(self, key: str, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def running(self, key: str) -> bool:
+        return key in self._flights
+
+    async def _distributed(self, key: str, fn: Callable[[], Awaitable]):
+        await session_store.connect()
+        redis = session_store.redis
+        lease_key, result_key = f"single_flight:{key}", f"single_flight:{key}:result"
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + SINGLE_FLIGHT_LEASE_MS / 1000
+        delay = 0.05
+        while True:
+            if await redis.set(lease_key, token, nx=True, px=SINGLE_FLIGHT_LEASE_MS):
+                break
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.get(result_key)
+                pipe.exists(lease_key)
+                result, leased = await pipe.execute()
+            if result is not None:
+                self.stats['remote_results'] += 1
+                return json.loads(result)
+            if not leased:
+                # Лидер закончил без результата или упал — пробуем стать лидером сами
+                continue
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"single flight {key} not finished in {SINGLE_FLIGHT_LEASE_MS} ms")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.5)
+        result = None
+        try:
+            result = await fn()
+            return result
+        finally:
+            payload = json.dumps(result, ensure_ascii=False) if result is not None else ''
+            try:
+                await script_registry.run(FINISH_FLIGHT, [lease_key, result_key], [token, payload, SINGLE_FLIGHT_RESULT_TTL_MS])
+            except Exception as e:
+                logger.error(f"Redis single flight finish error: {e}")
+
+    def metrics(self) -> dict:
+        return {'mode': self.mode, 'in_flight': len(self._flights), **self.stats}
+
+
+single_flight = SingleFlight()
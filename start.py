@@ -10,6 +10,8 @@ WEBHOOK_PATH = "/webhook"
 PORT = 8000
 ENV_PATH = ".env"
 STATIC_NGROK_DOMAIN = "moccasin-sunny-bat.ngrok-free.app"
+# polling — без ngrok: апдейты забирает poller.py, FastAPI остаётся для метрик
+INGESTION_MODE = os.getenv("INGESTION_MODE", "webhook")
 
 async def set_webhook():
     webhook_url = f"https://{STATIC_NGROK_DOMAIN}{WEBHOOK_PATH}"
@@ -56,8 +58,17 @@ def update_env(webhook_url):
 
 if __name__ == "__main__":
     import asyncio
-    asyncio.run(set_webhook())
-    asyncio.run(clear_old_updates())
-    print("⚙️ Запускаем FastAPI...")
     import subprocess
-    subprocess.call(["uvicorn", "main:app", "--host", "0.0.0.0", "--port", str(PORT)])
+    if INGESTION_MODE == "polling":
+        print("📥 Запускаем poller.py и FastAPI...")
+        poller = subprocess.Popen(["python", "poller.py"])
+        try:
+            subprocess.call(["uvicorn", "main:app", "--host", "0.0.0.0", "--port", str(PORT)])
+        finally:
+            poller.terminate()
+            poller.wait()
+    else:
+        asyncio.run(set_webhook())
+        asyncio.run(clear_old_updates())
+        print("⚙️ Запускаем FastAPI...")
+        subprocess.call(["uvicorn", "main:app", "--host", "0.0.0.0", "--port", str(PORT)])
@@ -0,0 +1,125 @@
+import os
+import asyncio
+import logging
+from typing import Optional
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")
+TELEGRAM_API = f"{TELEGRAM_API_URL}/bot{TELEGRAM_BOT_TOKEN}"
+TELEGRAM_FILE_API = f"{TELEGRAM_API_URL}/file/bot{TELEGRAM_BOT_TOKEN}"
+
+# Параметры пула соединений и таймаутов (секунды)
+TELEGRAM_HTTP2 = os.getenv("TELEGRAM_HTTP2", "0") == "1"
+TELEGRAM_MAX_CONNECTIONS = int(os.getenv("TELEGRAM_MAX_CONNECTIONS", 100))
+TELEGRAM_MAX_KEEPALIVE = int(os.getenv("TELEGRAM_MAX_KEEPALIVE", 20))
+TELEGRAM_KEEPALIVE_EXPIRY = float(os.getenv("TELEGRAM_KEEPALIVE_EXPIRY", 60))
+TELEGRAM_CONNECT_TIMEOUT = float(os.getenv("TELEGRAM_CONNECT_TIMEOUT", 5))
+TELEGRAM_READ_TIMEOUT = float(os.getenv("TELEGRAM_READ_TIMEOUT", 15))
+TELEGRAM_WRITE_TIMEOUT = float(os.getenv("TELEGRAM_WRITE_TIMEOUT", 15))
+TELEGRAM_POOL_TIMEOUT = float(os.getenv("TELEGRAM_POOL_TIMEOUT", 5))
+# Скачивание файлов: потолок размера (байты) и общий таймаут всего скачивания (секунды)
+TELEGRAM_DOWNLOAD_MAX_BYTES = int(os.getenv("TELEGRAM_DOWNLOAD_MAX_BYTES", 10 * 1024 * 1024))
+TELEGRAM_DOWNLOAD_TIMEOUT = float(os.getenv("TELEGRAM_DOWNLOAD_TIMEOUT", 20))
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadTooLarge(Exception):
+    """Файл больше допустимого размера; скачивание прервано."""
+
+
+class TelegramClient:
+    """Общий на процесс HTTP-клиент Bot API с keep-alive пулом соединений."""
+
+    def __init__(self):
+        self.client: Optional[httpx.AsyncClient] = None
+
+    async def start(self):
+        if self.client:
+            return
+        http2 = TELEGRAM_HTTP2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("TELEGRAM_HTTP2=1, но пакет h2 не установлен — используем HTTP/1.1")
+                http2 = False
+        self.client = httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=TELEGRAM_MAX_CONNECTIONS,
+                max_keepalive_connections=TELEGRAM_MAX_KEEPALIVE,
+                keepalive_expiry=TELEGRAM_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(
+                connect=TELEGRAM_CONNECT_TIMEOUT,
+                read=TELEGRAM_READ_TIMEOUT,
+                write=TELEGRAM_WRITE_TIMEOUT,
+                pool=TELEGRAM_POOL_TIMEOUT,
+            ),
+        )
+        logger.info(f"Telegram client started (http2={http2}, max_connections={TELEGRAM_MAX_CONNECTIONS})")
+
+    async def close(self):
+        if self.client:
+            await self.client.aclose()
+            self.client = None
+            logger.info("Telegram client closed")
+
+    async def http(self) -> httpx.AsyncClient:
+        # Ленивая инициализация для скриптов, которые не вызывают start()
+        await self.start()
+        return self.client
+
+    async def post(self, method: str, payload: Optional[dict] = None, **kwargs) -> httpx.Response:
+        client = await self.http()
+        return await client.post(f"{TELEGRAM_API}/{method}", json=payload or {}, **kwargs)
+
+    async def get(self, method: str, params: Optional[dict] = None, **kwargs) -> httpx.Response:
+        client = await self.http()
+        return await client.get(f"{TELEGRAM_API}/{method}", params=params or {}, **kwargs)
+
+    async def download(self, file_path: str, max_bytes: int = TELEGRAM_DOWNLOAD_MAX_BYTES,
+                       expected_size: Optional[int] = None, timeout: float = TELEGRAM_DOWNLOAD_TIMEOUT) -> bytearray:
+        """
+        Потоковое скачивание файла через общий пул в заранее выделенный буфер.
+        Файл больше max_bytes прерывается сразу (по Content-Length или по ходу чтения) — DownloadTooLarge.
+        Возвращается сам буфер без копирования: его можно сразу отдавать на обработку.
+        """
+        if expected_size and expected_size > max_bytes:
+            raise DownloadTooLarge(f"{file_path}: {expected_size} > {max_bytes} bytes")
+        client = await self.http()
+        return await asyncio.wait_for(self._stream(client, file_path, max_bytes, expected_size), timeout)
+
+    async def _stream(self, client: httpx.AsyncClient, file_path: str, max_bytes: int, expected_size: Optional[int]) -> bytearray:
+        async with client.stream("GET", f"{TELEGRAM_FILE_API}/{file_path}") as resp:
+            resp.raise_for_status()
+            length = int(resp.headers.get("content-length") or 0) or expected_size or 0
+            if length > max_bytes:
+                raise DownloadTooLarge(f"{file_path}: {length} > {max_bytes} bytes")
+            buffer = bytearray(length)
+            view = memoryview(buffer)
+            size = 0
+            async for chunk in resp.aiter_bytes():
+                end = size + len(chunk)
+                if end > max_bytes:
+                    raise DownloadTooLarge(f"{file_path}: more than {max_bytes} bytes")
+                if end <= len(buffer):
+                    view[size:end] = chunk
+                else:
+                    # Размер был неизвестен или занижен — буфер растёт
+                    view.release()
+                    del buffer[size:]
+                    buffer += chunk
+                    view = memoryview(buffer)
+                size = end
+            view.release()
+            del buffer[size:]
+            return buffer
+
+
+telegram_client = TelegramClient()
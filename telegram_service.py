@@ -1,19 +1,32 @@
 # telegram_service.py (новая версия)
 import os
+import time
+import asyncio
 import logging
-import httpx
 from session_store import session_store
-from vision_service import download_photo, extract_ingredients_from_image
-from generate_recipe import generate_recipe
+from chat_executor import chat_executor, chat_id_of
+from media_group import media_group_collector, media_group_id_of
+from outbound_dispatcher import outbound_dispatcher, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from vision_service import fetch_photo, extract_ingredients_from_image, extract_ingredients_from_images
+from image_preprocessing import choose_photo_size
+from vision_cache import vision_cache
+from ingredient_normalizer import ingredient_normalizer, normalize_ingredients, fold
+from ingredient_autocomplete import ingredient_autocomplete
+from recipe_prefetch import recipe_prefetch
+from telegram_client import telegram_client
+from generate_recipe import generate_recipe_result, generate_recipe_stream, RECIPE_JSON_MODE
+from recipe_schema import Recipe
 from database import get_async_session
-from user_service import get_user_by_telegram_id
+from user_resolver import user_resolver
 from user_preferences_service import get_preferences, update_preference
-from recipe_history_service import save_user_recipe, get_user_history
+from recipe_history_service import save_user_recipe, list_user_recipes, get_user_recipe, encode_cursor
 from config.texts import BUTTONS, WELCOME_TEXT, HELP_TEXT, SETTING_STATUS_TEMPLATE, HEALTHY_ON_TEXT, HEALTHY_OFF_TEXT, CUISINE_OPTIONS, CUISINE_SET_TEXT
 import json
 
-TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-TELEGRAM_API = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}"
+# Потоковая выдача рецепта правками сообщения; интервал между правками — в секундах
+RECIPE_STREAMING = os.getenv("RECIPE_STREAMING", "1") == "1"
+RECIPE_STREAM_EDIT_INTERVAL = float(os.getenv("RECIPE_STREAM_EDIT_INTERVAL", 1.0))
+
 logger = logging.getLogger(__name__)
 
 STATES = {
@@ -55,23 +68,93 @@ def build_keyboard(state):
         }
     return {"keyboard": [[{"text": btn} for btn in row] for row in MENU.get(state, [])], "resize_keyboard": True}
 
-async def send_message(chat_id, text, reply_markup=None):
+# Кнопка «добавить как написано», если ни одна подсказка не подошла
+ADD_AS_IS_PREFIX = "✏️ "
+
+def build_suggestions_keyboard(names, as_is=None):
+    rows = [[{"text": name} for name in names[i:i + 2]] for i in range(0, len(names), 2)]
+    if as_is:
+        rows.append([{"text": f"{ADD_AS_IS_PREFIX}{as_is}"}])
+    return {"keyboard": rows, "resize_keyboard": True, "one_time_keyboard": True}
+
+async def send_message(chat_id, text, reply_markup=None, priority=PRIORITY_NORMAL):
     payload = {"chat_id": chat_id, "text": text, "parse_mode": "HTML"}
     if reply_markup:
         payload["reply_markup"] = reply_markup
-    async with httpx.AsyncClient() as client:
-        await client.post(f"{TELEGRAM_API}/sendMessage", json=payload)
+    # Служебные уведомления не ждём: их вытеснит готовый ответ с высоким приоритетом
+    return await outbound_dispatcher.submit(chat_id, "sendMessage", payload, priority, wait=priority != PRIORITY_LOW)
+
+async def deliver_recipe(chat_id, thinking_text, ingredients, **generate_kwargs):
+    """Генерирует и отправляет рецепт, возвращает (итоговый текст, типизированный рецепт или None).
+    В потоковом режиме текст появляется правками сообщения «Думаю…» по мере готовности разделов."""
+    if not RECIPE_STREAMING or RECIPE_JSON_MODE:
+        await send_message(chat_id, thinking_text, priority=PRIORITY_LOW)
+        recipe_text, recipe = await generate_recipe_result(ingredients, **generate_kwargs)
+        await send_message(chat_id, recipe_text, reply_markup=build_keyboard("AFTER_RECIPE"), priority=PRIORITY_HIGH)
+        return recipe_text, recipe
+    placeholder = await send_message(chat_id, thinking_text)
+    message_id = ((placeholder or {}).get("result") or {}).get("message_id")
+    recipe_text = ""
+    last_edit = 0.0
+    async for text, final in generate_recipe_stream(ingredients, **generate_kwargs):
+        recipe_text = text
+        if message_id is None:
+            continue
+        now = time.monotonic()
+        if final or now - last_edit >= RECIPE_STREAM_EDIT_INTERVAL:
+            await edit_message_text(chat_id, message_id, text, priority=PRIORITY_HIGH if final else PRIORITY_NORMAL)
+            last_edit = now
+    if message_id is None:
+        # Заглушку отправить не удалось — отдаём рецепт обычным сообщением
+        await send_message(chat_id, recipe_text, reply_markup=build_keyboard("AFTER_RECIPE"), priority=PRIORITY_HIGH)
+    return recipe_text, None
+
+async def apply_transition(transition, session_data=None):
+    """Выполняет изменения сессии; session_data обновляется сессией, прочитанной в той же транзакции.
+    Ошибка Redis только логируется: ответ пользователю к этому моменту уже отправлен."""
+    try:
+        session = await transition.execute()
+    except Exception as e:
+        logger.error(f"Redis session transition error: {e}")
+        return
+    if session_data is not None and session:
+        session_data.update(session)
 
 # --- FSM переход ---
-async def to_state(chat_id, new_state, message_text, session_data=None):
-    """Переход FSM в новое состояние с логированием и комментарием."""
-    if session_data is None:
-        session_data = await session_store.get_session(chat_id) or {"state": "MAIN", "ingredients": []}
-    logger.info(f"[FSM] {chat_id} переход: {session_data['state']} -> {new_state}")
-    # Комментарий: сохраняем новое состояние пользователя
-    session_data["state"] = new_state
+async def to_state(chat_id, new_state, message_text, session_data=None, transition=None, **fields):
+    """Переход FSM в новое состояние с логированием и комментарием.
+    fields — другие скалярные поля сессии, которые записываются вместе с состоянием;
+    transition — уже собранные изменения сессии, они уходят в Redis той же транзакцией."""
+    old_state = (session_data or {}).get("state")
+    logger.info(f"[FSM] {chat_id} переход: {old_state} -> {new_state}")
+    if session_data is not None:
+        session_data["state"] = new_state
     await send_message(chat_id, message_text, reply_markup=build_keyboard(new_state))
-    await session_store.set_session(chat_id, session_data)
+    # Весь переход — одна транзакция Redis: поля, ингредиенты и продление TTL
+    transition = transition or session_store.transition(chat_id)
+    await apply_transition(transition.set(state=new_state, **fields), session_data)
+    if new_state == "CONFIRMING" and session_data is not None:
+        # Пока пользователь проверяет список, рецепт уже генерируется; изменение списка отменит генерацию
+        recipe_prefetch.speculate(chat_id, session_data.get("ingredients", []), await user_resolver.resolve(chat_id))
+
+DIFFICULTY_ORDER = ["Простые", "Средние", "Сложные"]
+
+def current_difficulty(session_data, prefs):
+    """Временная сложность из сессии, иначе сложность из профиля."""
+    current = session_data.get("temp_difficulty")
+    if not current:
+        current = getattr(prefs, "difficulty", "Средние")
+        if current not in DIFFICULTY_ORDER:
+            current = "Средние"
+    return current
+
+def shift_difficulty(current, text):
+    idx = DIFFICULTY_ORDER.index(current)
+    if text == "⬇️ Проще" and idx > 0:
+        return DIFFICULTY_ORDER[idx - 1]
+    if text == "⬆️ Сложнее" and idx < len(DIFFICULTY_ORDER) - 1:
+        return DIFFICULTY_ORDER[idx + 1]
+    return current
 
 # --- FSM handle_update ---
 async def handle_update(update, session=None):
@@ -84,7 +167,7 @@ async def handle_update(update, session=None):
     chat_id = message["chat"]["id"]
     text = message.get("text", "").strip()
     session_data = await session_store.get_session(chat_id) or {"state": "MAIN", "ingredients": []}
-    state = session_data["state"]
+    state = session_data.get("state", "MAIN")
 
     # FSM: допустимые команды для каждого состояния
     FSM_COMMANDS = {
@@ -102,6 +185,8 @@ async def handle_update(update, session=None):
         if text not in FSM_COMMANDS["MAIN"]:
             return
         if text == "/start":
+            # Заводим пользователя сразу, чтобы настройки и «Сохранённые» работали с первого нажатия
+            await user_resolver.resolve(chat_id, name=(message.get("from") or {}).get("first_name"))
             await to_state(chat_id, "MAIN", WELCOME_TEXT, session_data)
             return
         if text == "🍳 Начать готовку":
@@ -110,31 +195,18 @@ async def handle_update(update, session=None):
         if text == "⚙️ Настройки":
             await to_state(chat_id, "SETTINGS", "Настройки профиля. Выберите, что хотите изменить:", session_data)
             async for db_session in get_async_session():
-                user = await get_user_by_telegram_id(db_session, str(chat_id))
-                if user:
-                    await send_settings(chat_id, db_session, user.id)
+                user_id = await user_resolver.resolve(chat_id, db_session)
+                await send_settings(chat_id, db_session, user_id)
                 break
             return
         if text == "💾 Сохранённые":
             async for db_session in get_async_session():
-                user = await get_user_by_telegram_id(db_session, str(chat_id))
-                if not user:
-                    await send_message(chat_id, "Пользователь не найден.", reply_markup=build_keyboard("MAIN"))
-                    break
-                recipes = await get_user_history(db_session, user.id, limit=10)
-                if not recipes:
+                user_id = await user_resolver.resolve(chat_id, db_session)
+                keyboard = await build_saved_keyboard(db_session, user_id)
+                if not keyboard:
                     await send_message(chat_id, "У вас пока нет сохранённых рецептов.", reply_markup=build_keyboard("MAIN"))
                     break
-                msg = "<b>Ваши сохранённые рецепты:</b>\n\n"
-                keyboard = {"inline_keyboard": []}
-                for r in recipes:
-                    title = r.recipe.split("\n")[0][:40]  # первые 40 символов первой строки
-                    date = r.created_at.strftime("%d.%m.%Y") if hasattr(r, 'created_at') else ""
-                    btn_text = f"{title} ({date})"
-                    keyboard["inline_keyboard"].append([
-                        {"text": btn_text, "callback_data": f"show_recipe_{r.id}"}
-                    ])
-                await send_message(chat_id, msg, reply_markup=keyboard)
+                await send_message(chat_id, "<b>Ваши сохранённые рецепты:</b>\n\n", reply_markup=keyboard)
             return
         if text == "❓ Помощь":
             await send_message(chat_id, HELP_TEXT, reply_markup=build_keyboard("MAIN"))
@@ -144,13 +216,10 @@ async def handle_update(update, session=None):
     if state == "SETTINGS":
         if text in ["Любая", "Простые", "Средние", "Сложные"]:
             async for db_session in get_async_session():
-                user = await get_user_by_telegram_id(db_session, str(chat_id))
-                if not user:
-                    await send_message(chat_id, "Пользователь не найден.", reply_markup=build_keyboard("SETTINGS"))
-                    break
-                await update_preference(db_session, user.id, 'difficulty', text)
+                user_id = await user_resolver.resolve(chat_id, db_session)
+                prefs = await update_preference(db_session, user_id, 'difficulty', text)
                 logger.info(f"[FSM] {chat_id} выбрал сложность: {text}")
-                await send_settings(chat_id, db_session, user.id)
+                await send_settings(chat_id, db_session, user_id, prefs=prefs)
             return
         if text not in FSM_COMMANDS["SETTINGS"]:
             if message.get("photo"):
@@ -174,12 +243,16 @@ async def handle_update(update, session=None):
             return
         # Только фото или текст — ингредиенты
         if message.get("photo") or (text and text not in BUTTONS.values()):
-            if message.get("photo"):
-                await send_message(chat_id, "📷 Фото получено! Сейчас гляну…")
+            if len(message.get("album") or []) > 1:
+                await send_message(chat_id, f"📷 Получил {len(message['album'])} фото! Сейчас гляну…", priority=PRIORITY_LOW)
+            elif message.get("photo"):
+                await send_message(chat_id, "📷 Фото получено! Сейчас гляну…", priority=PRIORITY_LOW)
             new_ings = await extract_ingredients(message)
             if new_ings:
-                session_data["ingredients"].extend(new_ings)
-                await to_state(chat_id, "CONFIRMING", "Распознанные ингредиенты:\n" + "\n".join(f"– {i}" for i in session_data["ingredients"]) + "\nВсё ли верно? Выберите действие:", session_data)
+                # Тот же порядок и дедупликация, что даёт ZADD NX в Redis
+                session_data["ingredients"] = list(dict.fromkeys(session_data["ingredients"] + new_ings))
+                await to_state(chat_id, "CONFIRMING", "Распознанные ингредиенты:\n" + "\n".join(f"– {i}" for i in session_data["ingredients"]) + "\nВсё ли верно? Выберите действие:", session_data,
+                               transition=session_store.transition(chat_id).add_ingredients(new_ings))
             else:
                 await send_message(chat_id, "❌ Хмм, не вижу съедобного. Попробуй другое фото.", reply_markup=build_keyboard("WAIT_INGREDIENTS"))
             return
@@ -189,23 +262,42 @@ async def handle_update(update, session=None):
     # ADD
     if state == "ADD":
         if text and text not in BUTTONS.values():
-            session_data["ingredients"].append(text)
-            await to_state(chat_id, "CONFIRMING", "Ингредиент добавлен.\n" + "\n".join(f"– {i}" for i in session_data["ingredients"]) + "\nВсё ли верно? Выберите действие:", session_data)
+            added = None
+            if text.startswith(ADD_AS_IS_PREFIX):
+                text = text[len(ADD_AS_IS_PREFIX):].strip()
+            elif ingredient_normalizer.lookup(text) is None:
+                await ingredient_autocomplete.refresh()
+                # Название из подсказок целиком (в том числе не из словаря) добавляем сразу — иначе подсказка предлагала бы саму себя
+                exact = ingredient_autocomplete.exact(text)
+                if exact:
+                    added = [exact]
+                else:
+                    # Похоже на начало названия — предлагаем варианты кнопками вместо добавления «как есть»
+                    suggestions = ingredient_autocomplete.complete(text, exclude=session_data["ingredients"])
+                    if suggestions:
+                        await send_message(chat_id, "Возможно, вы имели в виду:", reply_markup=build_suggestions_keyboard(suggestions, as_is=text))
+                        return
+            added = added or normalize_ingredients([text]) or [text]
+            session_data["ingredients"] = list(dict.fromkeys(session_data["ingredients"] + added))
+            await to_state(chat_id, "CONFIRMING", "Ингредиент добавлен.\n" + "\n".join(f"– {i}" for i in session_data["ingredients"]) + "\nВсё ли верно? Выберите действие:", session_data,
+                           transition=session_store.transition(chat_id).add_ingredients(added))
         return
 
     # REMOVE
     if state == "REMOVE":
         if text and text not in BUTTONS.values():
-            ing_lower = text.lower()
-            found = False
-            for i in session_data["ingredients"]:
-                if i.lower() == ing_lower:
-                    session_data["ingredients"].remove(i)
-                    found = True
-                    break
+            # Сравниваем и с тем, что ввели, и с каноническим названием («картошка» удалит «картофель»)
+            targets = {fold(text)} | {fold(i) for i in normalize_ingredients([text])}
+            found = next((i for i in session_data["ingredients"] if fold(i) in targets), None)
             if found:
-                await to_state(chat_id, "CONFIRMING", f"Ингредиент '{text}' удалён.\n" + "\n".join(f"– {i}" for i in session_data["ingredients"]) + "\nВсё ли верно? Выберите действие:", session_data)
+                session_data["ingredients"] = [i for i in session_data["ingredients"] if i != found]
+                await to_state(chat_id, "CONFIRMING", f"Ингредиент '{text}' удалён.\n" + "\n".join(f"– {i}" for i in session_data["ingredients"]) + "\nВсё ли верно? Выберите действие:", session_data,
+                               transition=session_store.transition(chat_id).remove_ingredients([found]))
             else:
+                suggestions = ingredient_autocomplete.complete(text, session_ingredients=session_data["ingredients"], dictionary=False)
+                if suggestions:
+                    await send_message(chat_id, "Какой ингредиент убрать?", reply_markup=build_suggestions_keyboard(suggestions))
+                    return
                 await to_state(chat_id, "CONFIRMING", f"Ингредиент '{text}' не найден в списке.\n" + "\n".join(f"– {i}" for i in session_data["ingredients"]) + "\nВсё ли верно? Выберите действие:", session_data)
         return
 
@@ -215,35 +307,49 @@ async def handle_update(update, session=None):
             await send_message(chat_id, "Пожалуйста, выберите вариант из меню ниже или загрузите продукты. 👇", reply_markup=build_keyboard("CONFIRMING"))
             return
         if text == BUTTONS["add"]:
-            session_data["state"] = "ADD"
+            recipe_prefetch.cancel(chat_id)
             logger.info(f"[FSM] {chat_id} -> ADD (добавление ингредиента)")
             await send_message(chat_id, "Пришлите ингредиент для добавления…", reply_markup=build_keyboard("ADD"))
-            await session_store.set_session(chat_id, session_data)
+            await session_store.set_state(chat_id, "ADD")
             return
         if text == BUTTONS["remove"]:
-            session_data["state"] = "REMOVE"
+            recipe_prefetch.cancel(chat_id)
             logger.info(f"[FSM] {chat_id} -> REMOVE (удаление ингредиента)")
             await send_message(chat_id, "Напишите ингредиент для удаления…", reply_markup=build_keyboard("REMOVE"))
-            await session_store.set_session(chat_id, session_data)
+            await session_store.set_state(chat_id, "REMOVE")
             return
         if text == "✅ Всё верно, готовим!":
-            await send_message(chat_id, "👨‍🍳 Думаю… Сейчас придумаем что-то вкусненькое!")
+            await ingredient_autocomplete.record(chat_id, session_data["ingredients"])
             try:
-                recipe_text = await generate_recipe(
+                user_id = await user_resolver.resolve(chat_id)
+                # Если фоновая генерация уже идёт, deliver_recipe присоединится к ней или возьмёт рецепт из кэша
+                recipe_prefetch.claim(chat_id, session_data["ingredients"], user_id)
+                recipe_text, recipe = await deliver_recipe(
+                    chat_id,
+                    "👨‍🍳 Думаю… Сейчас придумаем что-то вкусненькое!",
                     session_data["ingredients"],
-                    user_id=chat_id,
+                    user_id=user_id,
                     session=session
                 )
-                session_data["last_recipe"] = recipe_text
-                await send_message(chat_id, recipe_text, reply_markup=build_keyboard("AFTER_RECIPE"))
-                await to_state(chat_id, "AFTER_RECIPE", "Что дальше? Выберите действие:", session_data)
             except Exception as e:
                 logger.error(f"Ошибка генерации рецепта: {e}")
                 await send_message(chat_id, "⚠️ Что-то пошло не так. Попробуйте ещё раз.", reply_markup=build_keyboard("CONFIRMING"))
+                return
+            await to_state(chat_id, "AFTER_RECIPE", "Что дальше? Выберите действие:", session_data, recipe_variant=0,
+                           transition=session_store.transition(chat_id).set_last_recipe(recipe_text, recipe.to_dict() if recipe else None))
+            if recipe_prefetch.variants:
+                # Рецепт уже у пользователя: сбой подготовки соседних сложностей только логируется
+                try:
+                    current = current_difficulty(session_data, await get_preferences(session, user_id))
+                    recipe_prefetch.speculate_variants(chat_id, session_data["ingredients"], user_id,
+                                                       [shift_difficulty(current, t) for t in ("⬇️ Проще", "⬆️ Сложнее")])
+                except Exception as e:
+                    logger.error(f"[PREFETCH] Не удалось запустить варианты сложности: {e}")
             return
         if text == "🛑 Передумал готовить":
-            session_data["ingredients"] = []
-            await to_state(chat_id, "MAIN", "Готовка отменена. Вы в главном меню.", session_data)
+            recipe_prefetch.cancel(chat_id)
+            await to_state(chat_id, "MAIN", "Готовка отменена. Вы в главном меню.", session_data,
+                           transition=session_store.transition(chat_id).clear_ingredients())
             return
 
     # AFTER_RECIPE
@@ -253,63 +359,58 @@ async def handle_update(update, session=None):
             return
         if text == "💾 Сохранить рецепт":
             try:
-                await save_recipe(chat_id, session_data.get("ingredients", []), session_data.get("last_recipe", ""))
+                last_recipe, last_recipe_data = await session_store.get_last_recipe(chat_id)
+                await save_recipe(chat_id, session_data.get("ingredients", []), last_recipe, last_recipe_data)
                 await send_message(chat_id, "✅ Рецепт сохранён в ваши избранные.", reply_markup=build_keyboard("AFTER_RECIPE"))
             except Exception as e:
                 logger.error(f"Ошибка сохранения рецепта: {e}")
                 await send_message(chat_id, "⚠️ Что-то пошло не так. Попробуйте ещё раз.", reply_markup=build_keyboard("AFTER_RECIPE"))
             return
         if text == "🔄 Другой рецепт":
-            await send_message(chat_id, "👨‍🍳 Думаю… Сейчас придумаем что-то вкусненькое!")
             try:
-                recipe_text = await generate_recipe(
+                # Сначала перебираем закэшированные варианты, потом генерируем новый
+                variant = session_data.get("recipe_variant", 0) + 1
+                recipe_text, recipe = await deliver_recipe(
+                    chat_id,
+                    "👨‍🍳 Думаю… Сейчас придумаем что-то вкусненькое!",
                     session_data["ingredients"],
-                    user_id=chat_id,
-                    session=session
+                    user_id=await user_resolver.resolve(chat_id),
+                    session=session,
+                    variant=variant
                 )
-                session_data["last_recipe"] = recipe_text
-                await send_message(chat_id, recipe_text, reply_markup=build_keyboard("AFTER_RECIPE"))
             except Exception as e:
                 logger.error(f"Ошибка генерации рецепта: {e}")
                 await send_message(chat_id, "⚠️ Что-то пошло не так. Попробуйте ещё раз.", reply_markup=build_keyboard("AFTER_RECIPE"))
+                return
+            await apply_transition(session_store.transition(chat_id).set_last_recipe(recipe_text, recipe.to_dict() if recipe else None).set(recipe_variant=variant), session_data)
             return
         if text in ["⬇️ Проще", "⬆️ Сложнее"]:
             # Получаем текущую сложность (приоритет temp_difficulty, затем из профиля)
-            DIFFICULTY_ORDER = ["Простые", "Средние", "Сложные"]
             async for db_session in get_async_session():
-                user = await get_user_by_telegram_id(db_session, str(chat_id))
-                prefs = await get_preferences(db_session, user.id) if user else None
-                current = session_data.get("temp_difficulty")
-                if not current:
-                    current = getattr(prefs, "difficulty", "Средние")
-                    if current not in DIFFICULTY_ORDER:
-                        current = "Средние"
-                idx = DIFFICULTY_ORDER.index(current)
-                if text == "⬇️ Проще" and idx > 0:
-                    new_difficulty = DIFFICULTY_ORDER[idx - 1]
-                elif text == "⬆️ Сложнее" and idx < len(DIFFICULTY_ORDER) - 1:
-                    new_difficulty = DIFFICULTY_ORDER[idx + 1]
-                else:
-                    new_difficulty = current
-                session_data["temp_difficulty"] = new_difficulty
-                await send_message(chat_id, f"👨‍🍳 Думаю… Сейчас придумаем что-то вкусненькое! (Сложность: {new_difficulty})")
+                user_id = await user_resolver.resolve(chat_id, db_session)
+                prefs = await get_preferences(db_session, user_id)
+                new_difficulty = shift_difficulty(current_difficulty(session_data, prefs), text)
+                recipe_prefetch.claim(chat_id, session_data["ingredients"], user_id, temp_difficulty=new_difficulty)
                 try:
-                    recipe_text = await generate_recipe(
+                    recipe_text, recipe = await deliver_recipe(
+                        chat_id,
+                        f"👨‍🍳 Думаю… Сейчас придумаем что-то вкусненькое! (Сложность: {new_difficulty})",
                         session_data["ingredients"],
-                        user_id=chat_id,
+                        user_id=user_id,
                         session=session,
                         temp_difficulty=new_difficulty
                     )
-                    session_data["last_recipe"] = recipe_text
-                    await send_message(chat_id, recipe_text, reply_markup=build_keyboard("AFTER_RECIPE"))
                 except Exception as e:
                     logger.error(f"Ошибка генерации рецепта: {e}")
                     await send_message(chat_id, "⚠️ Что-то пошло не так. Попробуйте ещё раз.", reply_markup=build_keyboard("AFTER_RECIPE"))
+                    break
+                await apply_transition(session_store.transition(chat_id).set_last_recipe(recipe_text, recipe.to_dict() if recipe else None).set(temp_difficulty=new_difficulty, recipe_variant=0), session_data)
                 break
             return
         if text == "🛑 Завершить готовку":
-            session_data["ingredients"] = []
-            await to_state(chat_id, "MAIN", "Готовка завершена. Вы в главном меню.", session_data)
+            recipe_prefetch.cancel(chat_id)
+            await to_state(chat_id, "MAIN", "Готовка завершена. Вы в главном меню.", session_data,
+                           transition=session_store.transition(chat_id).clear_ingredients())
             return
 
     # Если состояние неизвестно — вернуть в MAIN
@@ -323,17 +424,41 @@ async def handle_update(update, session=None):
         return
 
 async def extract_ingredients(msg):
+    if len(msg.get("album") or []) > 1:
+        return await extract_album_ingredients(msg["album"])
     if msg.get("photo"):
-        file_id = msg["photo"][-1]["file_id"]
-        async with httpx.AsyncClient() as client:
-            r = await client.get(f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/getFile", params={"file_id": file_id})
-            path = r.json()["result"]["file_path"]
-        photo = await download_photo(path, TELEGRAM_BOT_TOKEN)
-        return await extract_ingredients_from_image(photo)
+        # Самый маленький размер, которого хватает для распознавания, а не всегда самый большой
+        photo_size = choose_photo_size(msg["photo"])
+        file_unique_id = photo_size.get("file_unique_id")
+        # Уже распознанное фото не скачиваем повторно
+        cached = await vision_cache.get(file_unique_id=file_unique_id)
+        if cached is not None:
+            return normalize_ingredients(cached)
+        photo = await fetch_photo(photo_size)
+        return normalize_ingredients(await extract_ingredients_from_image(photo, file_unique_id=file_unique_id))
     if msg.get("text"):
-        return [i.strip() for i in msg["text"].split(",") if i.strip()]
+        return normalize_ingredients(msg["text"].split(","))
     return []
 
+async def extract_album_ingredients(album):
+    """Альбом: распознанные ранее фото берутся из кэша, остальные скачиваются параллельно и распознаются одним вызовом."""
+    found, missing = [], []
+    for photo in album:
+        photo_size = choose_photo_size(photo)
+        cached = await vision_cache.get(file_unique_id=photo_size.get("file_unique_id"))
+        if cached is not None:
+            found += cached
+        else:
+            missing.append(photo_size)
+
+    async def fetch(photo_size):
+        return await fetch_photo(photo_size), photo_size.get("file_unique_id")
+
+    if missing:
+        images = await asyncio.gather(*(fetch(photo_size) for photo_size in missing))
+        found += await extract_ingredients_from_images(images)
+    return normalize_ingredients(found)
+
 def build_settings_inline_keyboard(healthy_profile, cuisine, difficulty):
     return {
         "inline_keyboard": [
@@ -358,17 +483,12 @@ def build_settings_inline_keyboard(healthy_profile, cuisine, difficulty):
         ]
     }
 
-async def send_settings(chat_id, db_session, user_id, message_id=None):
-    CUISINE_OPTIONS = ["Любая", "Европейская", "Азиатская", "Мексиканская", "Восточная", "Индийская"]
-    DIFFICULTY_OPTIONS = ["Любая", "Простые", "Средние", "Сложные"]
-    prefs = await get_preferences(db_session, user_id)
-    healthy_profile = getattr(prefs, 'healthy_profile', False)
-    cuisine = getattr(prefs, 'preferred_cuisine', 'Любая')
-    difficulty = getattr(prefs, 'difficulty', 'Любая')
-    if cuisine not in CUISINE_OPTIONS:
-        cuisine = "Любая"
-    if difficulty not in DIFFICULTY_OPTIONS:
-        difficulty = "Любая"
+async def send_settings(chat_id, db_session, user_id, message_id=None, prefs=None):
+    # prefs передаётся сразу после update_preference, иначе берётся из кэша
+    prefs = prefs or await get_preferences(db_session, user_id)
+    healthy_profile = prefs.healthy_profile
+    cuisine = prefs.preferred_cuisine
+    difficulty = prefs.difficulty
     healthy_text = 'Вкл' if healthy_profile else 'Выкл'
     msg = f"<b>🥗 Здоровое питание:</b> {healthy_text}\n<b>🍱 Кухня:</b> {cuisine}\n<b>🎚️ Сложность:</b> {difficulty}"
     keyboard = build_settings_inline_keyboard(healthy_profile, cuisine, difficulty)
@@ -377,7 +497,7 @@ async def send_settings(chat_id, db_session, user_id, message_id=None):
     else:
         await send_message(chat_id, msg, reply_markup=keyboard)
 
-async def edit_message_text(chat_id, message_id, text, reply_markup=None):
+async def edit_message_text(chat_id, message_id, text, reply_markup=None, priority=PRIORITY_NORMAL):
     payload = {
         "chat_id": chat_id,
         "message_id": message_id,
@@ -386,15 +506,39 @@ async def edit_message_text(chat_id, message_id, text, reply_markup=None):
     }
     if reply_markup:
         payload["reply_markup"] = reply_markup
-    async with httpx.AsyncClient() as client:
-        await client.post(f"{TELEGRAM_API}/editMessageText", json=payload)
+    return await outbound_dispatcher.submit(chat_id, "editMessageText", payload, priority)
 
-async def save_recipe(chat_id, ingredients, recipe_text):
+async def save_recipe(chat_id, ingredients, recipe_text, recipe_data=None):
+    # В JSON-режиме структура уже есть; иначе разбираем готовый текст один раз — при сохранении
+    recipe = Recipe.from_dict(recipe_data) if recipe_data else Recipe.from_text(recipe_text)
     async for db_session in get_async_session():
-        user = await get_user_by_telegram_id(db_session, str(chat_id))
-        if not user:
-            return
-        await save_user_recipe(db_session, user.id, recipe_text, ingredients)
+        user_id = await user_resolver.resolve(chat_id, db_session)
+        await save_user_recipe(db_session, user_id, recipe_text, ingredients, recipe=recipe)
+
+async def build_saved_keyboard(db_session, user_id, cursor=None, backward=False):
+    """Inline-клавиатура страницы «Сохранённых» с кнопками «◀ / ▶»; None, если страница пуста.
+    Курсоры страниц лежат прямо в callback_data, текст рецепта загружается только по show_recipe_."""
+    rows, has_more = await list_user_recipes(db_session, user_id, cursor=cursor, backward=backward)
+    if not rows:
+        return None
+    keyboard = {"inline_keyboard": []}
+    for r in rows:
+        title = (r.title or "Без названия")[:40]
+        date = r.created_at.strftime("%d.%m.%Y") if r.created_at else ""
+        keyboard["inline_keyboard"].append([
+            {"text": f"{title} ({date})", "callback_data": f"show_recipe_{r.id}"}
+        ])
+    # Назад есть, если пришли вперёд по курсору; вперёд — если пришли назад
+    has_prev = has_more if backward else cursor is not None
+    has_next = cursor is not None if backward else has_more
+    nav = []
+    if has_prev:
+        nav.append({"text": "◀", "callback_data": f"saved_prev_{encode_cursor(rows[0].created_at, rows[0].id)}"})
+    if has_next:
+        nav.append({"text": "▶", "callback_data": f"saved_next_{encode_cursor(rows[-1].created_at, rows[-1].id)}"})
+    if nav:
+        keyboard["inline_keyboard"].append(nav)
+    return keyboard
 
 # Обработка callback-запросов для inline-кнопок
 async def handle_callback_query(callback_query, session=None):
@@ -404,32 +548,32 @@ async def handle_callback_query(callback_query, session=None):
     if data.startswith("show_recipe_"):
         recipe_id = int(data.replace("show_recipe_", ""))
         async for db_session in get_async_session():
-            user = await get_user_by_telegram_id(db_session, str(chat_id))
-            if not user:
-                await send_message(chat_id, "Пользователь не найден.")
-                break
-            from sqlalchemy.future import select
-            from models import RecipeHistory
-            result = await db_session.execute(select(RecipeHistory).where(RecipeHistory.id == recipe_id, RecipeHistory.user_id == user.id))
-            recipe = result.scalars().first()
+            user_id = await user_resolver.resolve(chat_id, db_session)
+            recipe = await get_user_recipe(db_session, user_id, recipe_id)
             if not recipe:
                 await send_message(chat_id, "Рецепт не найден.")
                 break
-            await send_message(chat_id, f"<b>Полный рецепт:</b>\n\n{recipe.recipe}")
+            await send_message(chat_id, f"<b>Полный рецепт:</b>\n\n{recipe.recipe}", priority=PRIORITY_HIGH)
+        return
+    if data.startswith("saved_next_") or data.startswith("saved_prev_"):
+        backward = data.startswith("saved_prev_")
+        cursor = data[len("saved_next_"):]
+        async for db_session in get_async_session():
+            user_id = await user_resolver.resolve(chat_id, db_session)
+            keyboard = await build_saved_keyboard(db_session, user_id, cursor=cursor, backward=backward)
+            if keyboard:
+                await edit_message_text(chat_id, message_id, "<b>Ваши сохранённые рецепты:</b>\n\n", keyboard)
         return
     if data == "toggle_healthy_profile":
         async for db_session in get_async_session():
-            user = await get_user_by_telegram_id(db_session, str(chat_id))
-            if not user:
-                await edit_message_text(chat_id, message_id, "Пользователь не найден.")
-                break
-            prefs = await get_preferences(db_session, user.id)
+            user_id = await user_resolver.resolve(chat_id, db_session)
+            prefs = await get_preferences(db_session, user_id)
             new_val = not getattr(prefs, 'healthy_profile', False)
-            await update_preference(db_session, user.id, 'healthy_profile', new_val)
+            prefs = await update_preference(db_session, user_id, 'healthy_profile', new_val)
             logger.info(f"[SETTINGS] {chat_id} переключил здоровое питание: {new_val}")
             text = "Режим здорового питания включён." if new_val else "Режим здорового питания выключен."
             await edit_message_text(chat_id, message_id, text)
-            await send_settings(chat_id, db_session, user.id)
+            await send_settings(chat_id, db_session, user_id, prefs=prefs)
         return
     if data == "choose_cuisine":
         CUISINE_OPTIONS = ["Любая", "Европейская", "Азиатская", "Мексиканская", "Восточная", "Индийская"]
@@ -448,15 +592,12 @@ async def handle_callback_query(callback_query, session=None):
         if cuisine not in CUISINE_OPTIONS:
             cuisine = "Любая"
         async for db_session in get_async_session():
-            user = await get_user_by_telegram_id(db_session, str(chat_id))
-            if not user:
-                await edit_message_text(chat_id, message_id, "Пользователь не найден.")
-                break
-            await update_preference(db_session, user.id, 'preferred_cuisine', cuisine)
+            user_id = await user_resolver.resolve(chat_id, db_session)
+            prefs = await update_preference(db_session, user_id, 'preferred_cuisine', cuisine)
             logger.info(f"[SETTINGS] {chat_id} выбрал кухню: {cuisine}")
             text = f"Вы выбрали кухню: {cuisine}."
             await edit_message_text(chat_id, message_id, text)
-            await send_settings(chat_id, db_session, user.id)
+            await send_settings(chat_id, db_session, user_id, prefs=prefs)
         return
     if data == "settings_back":
         await edit_message_text(chat_id, message_id, "Вы вернулись в главное меню.")
@@ -478,13 +619,48 @@ async def handle_callback_query(callback_query, session=None):
         if difficulty not in DIFFICULTY_OPTIONS:
             difficulty = "Любая"
         async for db_session in get_async_session():
-            user = await get_user_by_telegram_id(db_session, str(chat_id))
-            if not user:
-                await edit_message_text(chat_id, message_id, "Пользователь не найден.")
-                break
-            await update_preference(db_session, user.id, 'difficulty', difficulty)
+            user_id = await user_resolver.resolve(chat_id, db_session)
+            prefs = await update_preference(db_session, user_id, 'difficulty', difficulty)
             logger.info(f"[SETTINGS] {chat_id} выбрал сложность: {difficulty}")
             text = f"Вы выбрали сложность: {difficulty}."
             await edit_message_text(chat_id, message_id, text)
-            await send_settings(chat_id, db_session, user.id)
+            await send_settings(chat_id, db_session, user_id, prefs=prefs)
         return
+
+async def handle_inline_query(inline_query):
+    """Подсказки ингредиентов в inline-режиме («@бот кур»): выбранный вариант уходит в чат обычным сообщением."""
+    user_id = inline_query["from"]["id"]
+    # В личном чате chat_id совпадает с id пользователя
+    session_data = await session_store.get_session(user_id) or {}
+    ingredients = session_data.get("ingredients", [])
+    await ingredient_autocomplete.refresh()
+    results = []
+    for idx, name in enumerate(ingredient_autocomplete.complete(inline_query.get("query", ""), session_ingredients=ingredients)):
+        result = {"type": "article", "id": str(idx), "title": name, "input_message_content": {"message_text": name}}
+        if name in ingredients:
+            result["description"] = "Уже в списке"
+        results.append(result)
+    try:
+        await telegram_client.post("answerInlineQuery", {
+            "inline_query_id": inline_query["id"], "results": results, "cache_time": 0, "is_personal": True
+        })
+    except Exception as e:
+        logger.error(f"answerInlineQuery error: {e}")
+
+# Единая точка входа для апдейта из любого источника (вебхук, очередь воркеров)
+async def process_update(update):
+    # Части альбома приходят отдельными апдейтами: обрабатывается один склеенный апдейт
+    if media_group_id_of(update):
+        update = await media_group_collector.collect(update)
+        if update is None:
+            return
+    # Апдейты одного чата обрабатываются строго по очереди, чтобы не затирать сессию друг друга
+    await chat_executor.run(chat_id_of(update), lambda: _dispatch_update(update))
+
+async def _dispatch_update(update):
+    if 'callback_query' in update:
+        await handle_callback_query(update['callback_query'])
+    elif 'inline_query' in update:
+        await handle_inline_query(update['inline_query'])
+    else:
+        await handle_update(update)
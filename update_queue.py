@@ -0,0 +1,53 @@
+import os
+import json
+import socket
+import logging
+from dotenv import load_dotenv
+from redis.exceptions import ResponseError
+from session_store import session_store
+
+load_dotenv()
+
+UPDATE_STREAM = os.getenv('UPDATE_STREAM', 'updates')
+UPDATE_DEAD_LETTER_STREAM = os.getenv('UPDATE_DEAD_LETTER_STREAM', 'updates:dead')
+UPDATE_GROUP = os.getenv('UPDATE_GROUP', 'snapchef-workers')
+UPDATE_STREAM_MAXLEN = int(os.getenv('UPDATE_STREAM_MAXLEN', 100000))
+
+logger = logging.getLogger(__name__)
+
+
+def consumer_name() -> str:
+    return os.getenv('UPDATE_CONSUMER', f"{socket.gethostname()}-{os.getpid()}")
+
+
+async def ensure_group():
+    await session_store.connect()
+    try:
+        await session_store.redis.xgroup_create(UPDATE_STREAM, UPDATE_GROUP, id='0', mkstream=True)
+        logger.info(f"Consumer group {UPDATE_GROUP} created on {UPDATE_STREAM}")
+    except ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+
+
+async def enqueue_update(update: dict) -> str:
+    """Кладёт сырой апдейт Telegram в Redis Stream и возвращает id записи."""
+    await session_store.connect()
+    entry_id = await session_store.redis.xadd(
+        UPDATE_STREAM,
+        {'update': json.dumps(update, ensure_ascii=False)},
+        maxlen=UPDATE_STREAM_MAXLEN,
+        approximate=True
+    )
+    logger.info(f"Update {update.get('update_id')} enqueued as {entry_id}")
+    return entry_id
+
+
+async def dead_letter(entry_id: str, fields: dict, reason: str):
+    """Переносит «ядовитую» запись в dead-letter стрим и подтверждает её в группе."""
+    await session_store.connect()
+    async with session_store.redis.pipeline(transaction=True) as pipe:
+        pipe.xadd(UPDATE_DEAD_LETTER_STREAM, {**fields, 'source_id': entry_id, 'reason': reason}, maxlen=UPDATE_STREAM_MAXLEN, approximate=True)
+        pipe.xack(UPDATE_STREAM, UPDATE_GROUP, entry_id)
+        await pipe.execute()
+    logger.error(f"Update {entry_id} moved to {UPDATE_DEAD_LETTER_STREAM}: {reason}")
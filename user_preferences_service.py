@@ -1,20 +1,45 @@
 from sqlalchemy.future import select
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from models import UserPreferences
+from database import get_async_session
+from preferences_cache import Preferences, preferences_cache
 
-async def get_preferences(session: AsyncSession, user_id: int) -> UserPreferences:
-    result = await session.execute(select(UserPreferences).where(UserPreferences.user_id == user_id))
-    prefs = result.scalars().first()
-    if not prefs:
-        prefs = UserPreferences(user_id=user_id)
-        session.add(prefs)
-        await session.commit()
-        await session.refresh(prefs)
-    return prefs
+PREFERENCE_FIELDS = ('healthy_profile', 'preferred_cuisine', 'difficulty')
+
+PREFERENCE_COLUMNS = (UserPreferences.healthy_profile, UserPreferences.preferred_cuisine, UserPreferences.difficulty)
+
+def _upsert(user_id: int, values: dict):
+    # Запись — один INSERT … ON CONFLICT DO UPDATE … RETURNING. Чтение с созданием — DO NOTHING:
+    # существующая строка не переписывается (нет лишней версии строки и WAL), но и RETURNING её не вернёт
+    stmt = insert(UserPreferences).values(user_id=user_id, **values)
+    if not values:
+        return stmt.on_conflict_do_nothing(index_elements=[UserPreferences.user_id]).returning(*PREFERENCE_COLUMNS)
+    update = {name: stmt.excluded[name] for name in values}
+    return stmt.on_conflict_do_update(index_elements=[UserPreferences.user_id], set_=update).returning(*PREFERENCE_COLUMNS)
 
-async def update_preference(session: AsyncSession, user_id: int, field: str, value):
-    prefs = await get_preferences(session, user_id)
-    setattr(prefs, field, value)
+async def _execute_upsert(session: AsyncSession, user_id: int, values: dict) -> Preferences:
+    if session is None:
+        async for db_session in get_async_session():
+            return await _execute_upsert(db_session, user_id, values)
+    result = await session.execute(_upsert(user_id, values))
+    row = result.first()
+    if row is None:
+        # Строка уже была — конфликт при DO NOTHING, читаем её
+        row = (await session.execute(select(*PREFERENCE_COLUMNS).where(UserPreferences.user_id == user_id))).one()
     await session.commit()
-    await session.refresh(prefs)
-    return prefs 
\ No newline at end of file
+    prefs = Preferences.resolve(*row)
+    await preferences_cache.set(user_id, prefs)
+    return prefs
+
+async def get_preferences(session: AsyncSession, user_id: int) -> Preferences:
+    """Настройки из кэша; при промахе — из БД (строка создаётся, если её ещё нет)."""
+    prefs = await preferences_cache.get(user_id)
+    if prefs is not None:
+        return prefs
+    return await _execute_upsert(session, user_id, {})
+
+async def update_preference(session: AsyncSession, user_id: int, field: str, value) -> Preferences:
+    if field not in PREFERENCE_FIELDS:
+        raise ValueError(f"Unknown preference field: {field}")
+    return await _execute_upsert(session, user_id, {field: value})
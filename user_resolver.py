@@ -0,0 +1,77 @@
+import os
+import logging
+from collections import Counter, OrderedDict
+from typing import Optional
+from dotenv import load_dotenv
+from sqlalchemy.ext.asyncio import AsyncSession
+from session_store import session_store
+from database import get_async_session
+from user_service import upsert_user
+
+load_dotenv()
+
+USER_CACHE_LOCAL_SIZE = int(os.getenv('USER_CACHE_LOCAL_SIZE', 10000))
+# id пользователя не меняется, TTL нужен только чтобы Redis не копил ушедших пользователей
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 7 * 86400))
+
+logger = logging.getLogger(__name__)
+
+
+class UserResolver:
+    """telegram_id → users.id: LRU в процессе, затем Redis, затем upsert в БД."""
+
+    def __init__(self, max_size: int = USER_CACHE_LOCAL_SIZE, ttl: int = USER_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.local = OrderedDict()
+        self.stats = Counter()
+
+    def _local_set(self, telegram_id: str, user_id: int):
+        self.local[telegram_id] = user_id
+        self.local.move_to_end(telegram_id)
+        while len(self.local) > self.max_size:
+            self.local.popitem(last=False)
+
+    async def _redis_get(self, telegram_id: str) -> Optional[int]:
+        try:
+            await session_store.connect()
+            raw = await session_store.redis.get(f"user_id:{telegram_id}")
+        except Exception as e:
+            logger.error(f"Redis user cache get error: {e}")
+            return None
+        return int(raw) if raw else None
+
+    async def _redis_set(self, telegram_id: str, user_id: int):
+        try:
+            await session_store.connect()
+            await session_store.redis.set(f"user_id:{telegram_id}", user_id, ex=self.ttl)
+        except Exception as e:
+            logger.error(f"Redis user cache set error: {e}")
+
+    async def resolve(self, chat_id, session: AsyncSession = None, name: Optional[str] = None) -> int:
+        """Возвращает id пользователя для чата; при первом обращении пользователь создаётся."""
+        telegram_id = str(chat_id)
+        user_id = self.local.get(telegram_id)
+        if user_id is not None:
+            self.local.move_to_end(telegram_id)
+            self.stats['local_hits'] += 1
+            return user_id
+        user_id = await self._redis_get(telegram_id)
+        if user_id is not None:
+            self.stats['redis_hits'] += 1
+        else:
+            if session is not None:
+                user_id = await upsert_user(session, telegram_id, name)
+            else:
+                async for db_session in get_async_session():
+                    user_id = await upsert_user(db_session, telegram_id, name)
+            self.stats['upserts'] += 1
+            await self._redis_set(telegram_id, user_id)
+        self._local_set(telegram_id, user_id)
+        return user_id
+
+    def metrics(self) -> dict:
+        return {'local_size': len(self.local), **self.stats}
+
+
+user_resolver = UserResolver()
@@ -1,4 +1,6 @@
+from sqlalchemy import func
 from sqlalchemy.future import select
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from models import User, UserPreferences
 
@@ -13,6 +15,18 @@ async def create_user(session: AsyncSession, telegram_id: str, name: str = None)
     await session.refresh(user)
     return user
 
+async def upsert_user(session: AsyncSession, telegram_id: str, name: str = None) -> int:
+    """Возвращает id пользователя, создавая его при первом обращении (один INSERT … ON CONFLICT)."""
+    stmt = insert(User).values(telegram_id=telegram_id, name=name)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[User.telegram_id],
+        # DO UPDATE, а не DO NOTHING: иначе RETURNING не вернёт id существующей строки
+        set_={'name': func.coalesce(stmt.excluded.name, User.name)}
+    ).returning(User.id)
+    result = await session.execute(stmt)
+    await session.commit()
+    return result.scalar_one()
+
 async def get_state(user_id: int, session: AsyncSession) -> str:
     prefs = await session.execute(select(UserPreferences).where(UserPreferences.user_id == user_id))
     prefs = prefs.scalars().first()
@@ -0,0 +1,116 @@
+import io
+import os
+import json
+import asyncio
+import hashlib
+import logging
+from collections import Counter
+from typing import Optional
+from dotenv import load_dotenv
+from session_store import session_store
+
+try:
+    from PIL import Image
+except ImportError:  # перцептивный хэш необязателен
+    Image = None
+
+load_dotenv()
+
+VISION_CACHE_TTL = int(os.getenv('VISION_CACHE_TTL', 86400))
+VISION_CACHE_PHASH = os.getenv('VISION_CACHE_PHASH', '1') == '1'
+# Ниже такого разброса яркости (стандартное отклонение, 0–255) фото считается однотонным — dHash у него почти всегда 0
+VISION_PHASH_MIN_CONTRAST = float(os.getenv('VISION_PHASH_MIN_CONTRAST', 6))
+# dHash, где единиц (или нулей) меньше стольких, у разных тёмных и пересвеченных снимков совпадает
+VISION_PHASH_MIN_BITS = int(os.getenv('VISION_PHASH_MIN_BITS', 4))
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(image_bytes: bytes) -> str:
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def _dhash(image_bytes: bytes, size: int = 8) -> Optional[str]:
+    """dHash или None, если снимок слишком однотонный, чтобы хэш его отличал."""
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        pixels = list(img.convert('L').resize((size + 1, size)).getdata())
+    mean = sum(pixels) / len(pixels)
+    if (sum((p - mean) ** 2 for p in pixels) / len(pixels)) ** 0.5 < VISION_PHASH_MIN_CONTRAST:
+        return None
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    ones = bin(bits).count('1')
+    if min(ones, size * size - ones) < VISION_PHASH_MIN_BITS:
+        return None
+    return f"{bits:0{size * size // 4}x}"
+
+
+async def perceptual_hash(image_bytes: bytes) -> Optional[str]:
+    """dHash изображения: совпадает у пересжатых и слегка изменённых копий фото.
+    Для тёмных и однотонных снимков None — по такому хэшу совпали бы совсем разные фото."""
+    if Image is None or not VISION_CACHE_PHASH or not image_bytes:
+        return None
+    try:
+        return await asyncio.to_thread(_dhash, image_bytes)
+    except Exception as e:
+        logger.error(f"Perceptual hash error: {e}")
+        return None
+
+
+def cache_keys(file_unique_id: Optional[str] = None, sha: Optional[str] = None, phash: Optional[str] = None) -> list:
+    keys = []
+    if file_unique_id:
+        keys.append(f"vision:fuid:{file_unique_id}")
+    if sha:
+        keys.append(f"vision:sha:{sha}")
+    if phash:
+        keys.append(f"vision:phash:{phash}")
+    return keys
+
+
+class VisionCache:
+    """Кэш распознанных ингредиентов по file_unique_id, sha256 и перцептивному хэшу фото."""
+
+    def __init__(self, ttl: int = VISION_CACHE_TTL):
+        self.ttl = ttl
+        self.stats = Counter()
+
+    async def get(self, **ids) -> Optional[list]:
+        keys = cache_keys(**ids)
+        if not keys:
+            return None
+        try:
+            await session_store.connect()
+            values = await session_store.redis.mget(keys)
+        except Exception as e:
+            logger.error(f"Redis vision cache get error: {e}")
+            return None
+        for key, raw in zip(keys, values):
+            if raw:
+                self.stats[f"hits_{key.split(':')[1]}"] += 1
+                logger.info(f"Vision cache hit: {key}")
+                return json.loads(raw)
+        self.stats['misses'] += 1
+        return None
+
+    async def set(self, ingredients: list, **ids):
+        keys = cache_keys(**ids)
+        if not keys:
+            return
+        raw = json.dumps(ingredients, ensure_ascii=False)
+        try:
+            await session_store.connect()
+            async with session_store.redis.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.set(key, raw, ex=self.ttl)
+                await pipe.execute()
+            self.stats['stored'] += 1
+        except Exception as e:
+            logger.error(f"Redis vision cache set error: {e}")
+
+
+vision_cache = VisionCache()
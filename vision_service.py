@@ -1,16 +1,18 @@
-import os
 import logging
-import google.generativeai as genai
 from dotenv import load_dotenv
+import httpx
+from telegram_client import telegram_client, DownloadTooLarge
+from file_path_cache import file_path_cache
+from vision_cache import vision_cache, content_hash, perceptual_hash
+from ingredient_normalizer import normalize_ingredients
+from llm_gateway import llm_gateway
+from image_preprocessing import image_preprocessor
+from single_flight import single_flight
 
 load_dotenv()
 
-GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
-
 logger = logging.getLogger(__name__)
 
-genai.configure(api_key=GEMINI_API_KEY)
-
 PROMPT = (
     "На изображении представлены продукты питания. "
     "Выведи список ингредиентов через запятую. "
@@ -20,38 +22,118 @@ PROMPT = (
     "Примеры: если на фото живой петух — не включай 'курица' в список; если на фото яблоко — включи 'яблоко'; если на фото человек — ответь: Нет ингредиентов."
 )
 
+# Добавляется к PROMPT, когда фото несколько (альбом)
+ALBUM_PROMPT = (
+    " Фотографий несколько — это один набор продуктов: перечисли продукты со всех фото одним списком без повторов. "
+    "Отвечай «Нет ингредиентов», только если продуктов нет ни на одном фото."
+)
+
 NO_INGREDIENTS_PHRASES = [
     'нет ингредиентов',
     'ингредиенты не найдены',
 ]
 
-async def download_photo(file_path: str, telegram_token: str) -> bytes:
-    """Скачивает фото из Telegram по file_path."""
-    import httpx
-    url = f"https://api.telegram.org/file/bot{telegram_token}/{file_path}"
+async def download_photo(file_path: str, expected_size: int = None):
+    """Скачивает фото из Telegram по file_path через общий клиент Bot API (с потолком размера и таймаутом)."""
     try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(url)
-            resp.raise_for_status()
-            logger.info(f"Photo downloaded: {file_path}")
-            return resp.content
+        content = await telegram_client.download(file_path, expected_size=expected_size)
+        logger.info(f"Photo downloaded: {file_path}")
+        return content
+    except DownloadTooLarge as e:
+        logger.warning(f"[PHOTO] Фото слишком большое, не скачиваем: {e}")
     except Exception as e:
         logger.error(f"Download photo error: {e}")
+    return b''
+
+async def resolve_file_path(file_id: str) -> str:
+    """file_path по file_id: из кэша, иначе getFile."""
+    file_path = await file_path_cache.get(file_id)
+    if file_path:
+        return file_path
+    r = await telegram_client.get("getFile", {"file_id": file_id})
+    file_path = r.json()["result"]["file_path"]
+    await file_path_cache.set(file_id, file_path)
+    return file_path
+
+async def fetch_photo(photo_size: dict) -> bytes:
+    """Скачивает выбранный PhotoSize и готовит его к Vision: уменьшение, пересжатие, без метаданных."""
+    file_id, expected_size = photo_size["file_id"], photo_size.get("file_size")
+    file_path = await resolve_file_path(file_id)
+    try:
+        photo = await telegram_client.download(file_path, expected_size=expected_size)
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code not in (400, 404):
+            logger.error(f"Download photo error: {e}")
+            return b''
+        # Ссылка из кэша истекла раньше срока — запрашиваем новую
+        await file_path_cache.invalidate(file_id)
+        photo = await download_photo(await resolve_file_path(file_id), expected_size=expected_size)
+    except DownloadTooLarge as e:
+        logger.warning(f"[PHOTO] Фото слишком большое, не скачиваем: {e}")
         return b''
+    except Exception as e:
+        logger.error(f"Download photo error: {e}")
+        return b''
+    # Буфер скачивания уходит в подготовку как есть, без копии
+    return await image_preprocessor.prepare(photo)
 
-async def extract_ingredients_from_image(image_bytes: bytes) -> list:
+async def extract_ingredients_from_image(image_bytes: bytes, file_unique_id: str = None) -> list:
     """
     Отправляет изображение в Gemini Vision API через google-generativeai и извлекает ингредиенты.
+    Повторно присланные фото (тот же file_unique_id, те же байты или почти то же изображение) берутся из кэша.
     """
-    headers = {"Content-Type": "application/json"}
+    if not image_bytes:
+        return []
+    sha = content_hash(image_bytes)
+    phash = await perceptual_hash(image_bytes)
+    cached = await vision_cache.get(sha=sha, phash=phash)
+    if cached is not None:
+        # Запоминаем и file_unique_id, чтобы в следующий раз не скачивать фото
+        await vision_cache.set(cached, file_unique_id=file_unique_id)
+        return cached
+    # Одно и то же фото, присланное одновременно (альбом, пересылка), распознаётся одним вызовом
+    ingredients = await single_flight.do(f"vision:{sha}", lambda: _recognize([image_bytes]))
+    if ingredients:
+        await vision_cache.set(ingredients, file_unique_id=file_unique_id, sha=sha, phash=phash)
+    return ingredients
+
+async def extract_ingredients_from_images(images: list) -> list:
+    """
+    Альбом: images — пары (байты, file_unique_id). Уже распознанные фото берутся из кэша,
+    остальные уходят в Gemini одним запросом с несколькими изображениями; ингредиенты объединяются без повторов.
+    """
+    images = [(image_bytes, file_unique_id) for image_bytes, file_unique_id in images if image_bytes]
+    if len(images) <= 1:
+        return await extract_ingredients_from_image(*images[0]) if images else []
+    found, pending = [], []
+    for image_bytes, file_unique_id in images:
+        sha = content_hash(image_bytes)
+        cached = await vision_cache.get(sha=sha, phash=await perceptual_hash(image_bytes))
+        if cached is not None:
+            await vision_cache.set(cached, file_unique_id=file_unique_id)
+            found += cached
+        else:
+            pending.append((image_bytes, file_unique_id, sha))
+    if len(pending) == 1:
+        found += await extract_ingredients_from_image(*pending[0][:2])
+    elif pending:
+        # Результат относится ко всему набору фото сразу, поэтому кэшируется по хэшу набора
+        group_sha = content_hash('+'.join(sorted(sha for *_, sha in pending)).encode())
+        recognized = await vision_cache.get(sha=group_sha)
+        if recognized is None:
+            recognized = await single_flight.do(f"vision:{group_sha}", lambda: _recognize([b for b, *_ in pending]))
+            if recognized:
+                await vision_cache.set(recognized, sha=group_sha)
+        found += recognized
+    return normalize_ingredients(found)
+
+async def _recognize(images: list) -> list:
     try:
-        model = genai.GenerativeModel('gemini-1.5-flash-latest')
-        logger.info("Sending image to Gemini Vision API...")
-        response = await model.generate_content_async([
-            PROMPT,
-            {"mime_type": "image/jpeg", "data": image_bytes}
-        ])
-        text = response.text.strip()
+        logger.info(f"Sending {len(images)} image(s) to Gemini Vision API...")
+        text = (await llm_gateway.generate(
+            [PROMPT + (ALBUM_PROMPT if len(images) > 1 else '')]
+            + [{"mime_type": "image/jpeg", "data": image_bytes} for image_bytes in images]
+        )).strip()
         logger.info(f"Gemini response: {text}")
         # Фильтрация по фразам отсутствия ингредиентов
         if not text or any(phrase in text.lower() for phrase in NO_INGREDIENTS_PHRASES):
@@ -62,14 +144,14 @@ async def extract_ingredients_from_image(image_bytes: bytes) -> list:
         return []
 
 def parse_ingredients(text: str) -> list:
-    """Парсит список ингредиентов из текста Gemini."""
+    """Парсит список ингредиентов из текста Gemini и приводит их к каноническим названиям."""
     if not text:
         return []
     # Ожидаем строку с ингредиентами через запятую
     if ',' in text:
-        return [i.strip() for i in text.split(',') if i.strip()]
+        return normalize_ingredients(i.strip() for i in text.split(','))
     # Если список по строкам
-    return [i.strip('-• \,') for i in text.split('\n') if i.strip()]
+    return normalize_ingredients(i.strip('-• ,') for i in text.split('\n'))
 
 async def extract_ingredients_from_text(text: str) -> list:
     """Парсит ингредиенты из текстового сообщения пользователя."""
@@ -0,0 +1,131 @@
+# Воркер очереди апдейтов: читает Redis Stream через consumer group и обрабатывает апдейты.
+# Запуск: python worker.py  (можно запускать несколько процессов и на разных хостах)
+import os
+import json
+import signal
+import asyncio
+import logging
+from typing import Optional
+from dotenv import load_dotenv
+from session_store import session_store
+from redis_scripts import script_registry
+from telegram_client import telegram_client
+from outbound_dispatcher import outbound_dispatcher
+from telegram_service import process_update
+from update_queue import UPDATE_STREAM, UPDATE_GROUP, ensure_group, consumer_name, dead_letter
+
+load_dotenv()
+
+UPDATE_WORKER_CONCURRENCY = int(os.getenv('UPDATE_WORKER_CONCURRENCY', 8))
+# После стольких доставок без ACK запись считается «ядовитой»
+UPDATE_MAX_DELIVERIES = int(os.getenv('UPDATE_MAX_DELIVERIES', 5))
+# Запись, висящая без ACK дольше этого времени, забирается у упавшего воркера
+UPDATE_CLAIM_IDLE_MS = int(os.getenv('UPDATE_CLAIM_IDLE_MS', 60000))
+UPDATE_CLAIM_INTERVAL = float(os.getenv('UPDATE_CLAIM_INTERVAL', 15))
+UPDATE_READ_BLOCK_MS = int(os.getenv('UPDATE_READ_BLOCK_MS', 5000))
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateWorker:
+    def __init__(self, name: Optional[str] = None, concurrency: int = UPDATE_WORKER_CONCURRENCY):
+        self.name = name or consumer_name()
+        self.concurrency = concurrency
+        self._stopping: Optional[asyncio.Event] = None
+
+    async def handle_entry(self, entry_id: str, fields: dict):
+        try:
+            update = json.loads(fields['update'])
+        except (KeyError, TypeError, ValueError) as e:
+            await dead_letter(entry_id, fields or {}, f"bad payload: {e}")
+            return
+        try:
+            await process_update(update)
+        except Exception as e:
+            # Без ACK: запись останется в pending и будет повторена после UPDATE_CLAIM_IDLE_MS
+            logger.exception(f"[WORKER] {self.name} не смог обработать {entry_id}: {e}")
+            return
+        await session_store.redis.xack(UPDATE_STREAM, UPDATE_GROUP, entry_id)
+
+    async def consume(self):
+        while not self._stopping.is_set():
+            try:
+                response = await session_store.redis.xreadgroup(
+                    UPDATE_GROUP, self.name, {UPDATE_STREAM: '>'}, count=1, block=UPDATE_READ_BLOCK_MS
+                )
+            except Exception as e:
+                logger.error(f"[WORKER] Redis xreadgroup error: {e}")
+                await asyncio.sleep(1)
+                continue
+            for _stream, entries in response or []:
+                for entry_id, fields in entries:
+                    try:
+                        await self.handle_entry(entry_id, fields)
+                    except Exception as e:
+                        # Ошибка Redis при ACK или dead-letter не должна останавливать потребителя:
+                        # запись осталась в pending и вернётся через reclaim
+                        logger.error(f"[WORKER] {self.name} entry {entry_id} error: {e}")
+
+    async def reclaim_once(self):
+        """Забирает записи, зависшие у упавших потребителей; «ядовитые» — в dead-letter."""
+        pending = await session_store.redis.xpending_range(
+            UPDATE_STREAM, UPDATE_GROUP, min='-', max='+', count=100, idle=UPDATE_CLAIM_IDLE_MS
+        )
+        for item in pending:
+            entry_id = item['message_id']
+            claimed = await session_store.redis.xclaim(
+                UPDATE_STREAM, UPDATE_GROUP, self.name, UPDATE_CLAIM_IDLE_MS, [entry_id]
+            )
+            if not claimed:
+                # Запись уже забрал другой воркер
+                continue
+            _, fields = claimed[0]
+            if not fields:
+                # Запись вытеснена MAXLEN — повторять нечего
+                await session_store.redis.xack(UPDATE_STREAM, UPDATE_GROUP, entry_id)
+                continue
+            if item['times_delivered'] >= UPDATE_MAX_DELIVERIES:
+                await dead_letter(entry_id, fields, f"delivered {item['times_delivered']} times")
+                continue
+            logger.warning(f"[WORKER] {self.name} забрал {entry_id} у {item['consumer']}")
+            await self.handle_entry(entry_id, fields)
+
+    async def reclaim(self):
+        while not self._stopping.is_set():
+            try:
+                await self.reclaim_once()
+            except Exception as e:
+                logger.error(f"[WORKER] reclaim error: {e}")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=UPDATE_CLAIM_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self):
+        self._stopping = asyncio.Event()
+        await session_store.connect()
+        await script_registry.load()
+        await session_store.start_near_cache()
+        await ensure_group()
+        await telegram_client.start()
+        await outbound_dispatcher.start()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self._stopping.set)
+            except NotImplementedError:
+                pass
+        logger.info(f"[WORKER] {self.name} запущен, задач: {self.concurrency}")
+        tasks = [asyncio.create_task(self.consume()) for _ in range(self.concurrency)]
+        tasks.append(asyncio.create_task(self.reclaim()))
+        await self._stopping.wait()
+        logger.info(f"[WORKER] {self.name} останавливается, дожидаемся текущих апдейтов…")
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await outbound_dispatcher.stop()
+        await telegram_client.close()
+        await session_store.stop_near_cache()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(UpdateWorker().run())